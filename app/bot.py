@@ -1,5 +1,7 @@
-import time
-from datetime import datetime, timedelta, timezone
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from datetime import datetime
 from pymongo.errors import DuplicateKeyError
 from telebot import TeleBot, apihelper
 from telebot.apihelper import ApiTelegramException
@@ -7,9 +9,10 @@ from telebot.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     CallbackQuery,
+    ChatFullInfo,
+    ChatMemberUpdated,
     Message,
 )
-from bson import ObjectId
 import re
 
 from .config import get_config
@@ -23,22 +26,22 @@ from .repositories.stats import StatsRepository
 from .repositories.quizzes import QuizzesRepository
 from .repositories.battles import BattlesRepository
 from .repositories.progress import ProgressRepository
-from .services.exporter import QuizExporter
-from .services.gemini import generate_questions, validate_gemini_api_key
-from .services.file_parser import fetch_and_parse_file, chunk_text
-
-from .services.youtube_service import get_youtube_transcript
+from .services.gemini import generate_questions, generate_from_chunks, validate_gemini_api_key, get_client, _choose_api_key
+from .services.file_parser import fetch_and_parse_file, iter_sliding_chunks, sliding_chunk_count, download_to_tempfile, remove_tempfile
 from .services.quota import (
     has_quota,
-    can_submit_note_now,
-    update_last_note_time,
-    reset_notes_if_new_day,
-    increment_quota,
-    increase_total_notes,
-    is_premium
+    claim_note,
+    release_note,
+    is_premium,
+    daily_note_limit,
+    notes_used_today,
 )
 from .services.scheduler import QuizScheduler
-from .utils import is_subscribed, home_keyboard, format_dt_utc3, from_utc3_to_utc, notify_admins
+from .services.delivery import DeliveryQueue, batch_by_length
+from .services.http_session import install_telegram_session
+from .services.rate_limiter import install_send_limiter
+from .services.state_store import StateStore
+from .utils import is_subscribed, forget_subscription, home_keyboard, format_dt_utc3, from_utc3_to_utc, notify_admins, format_question, choice_label, EXPLANATION_LIMIT
 from .logger import logger
 import traceback
 import functools
@@ -60,13 +63,25 @@ settings_repo = SettingsRepository(db) if db is not None else None
 users_repo = UsersRepository(db) if db is not None else None
 channels_repo = ChannelsRepository(db) if db is not None else None
 payments_repo = PaymentsRepository(db) if db is not None else None
-payments_repo = PaymentsRepository(db) if db is not None else None
 schedules_repo = SchedulesRepository(db) if db is not None else None
 quizzes_repo = QuizzesRepository(db) if db is not None else None
 battles_repo = BattlesRepository(db) if db is not None else None
 progress_repo = ProgressRepository(db) if db is not None else None
 
-bot = TeleBot(cfg.bot_token)
+bot = TeleBot(cfg.bot_token, threaded=True, num_threads=cfg.worker_threads)
+# One keep-alive pool shared by every thread that talks to Telegram: handler and I/O
+# workers plus the poller, delivery queue, scheduler and broadcast threads. An
+# undersized pool discards connections ("Connection pool is full") and re-handshakes.
+# Broadcasts send from their own small pool of threads.
+BROADCAST_WORKERS = 8
+install_telegram_session(cfg.worker_threads + cfg.io_threads + BROADCAST_WORKERS + 8)
+install_send_limiter(cfg.send_rate_limit)
+# Downloads/transcripts run here so slow network I/O never occupies a handler worker
+_io_pool = ThreadPoolExecutor(max_workers=cfg.io_threads, thread_name_prefix="io")
+# Short API lookups a handler waits on; kept apart so they never queue behind a download
+_lookup_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="lookup")
+# chat_member is opt-in on Telegram's side, so list exactly what we handle
+ALLOWED_UPDATES = ["message", "callback_query", "pre_checkout_query", "chat_member"]
 BOT_INFO = None
 
 def get_bot_info():
@@ -82,20 +97,117 @@ def get_bot_info():
                     self.id = 0
             return MockBot()
     return BOT_INFO
-if db is not None:
-    scheduler = QuizScheduler(db, bot)
-    scheduler.start()
+# Paced quiz questions are sent from here so handlers never sleep between them
+delivery = DeliveryQueue(bot)
+# Started by the entry points rather than on import, so importing this module has no side threads
+scheduler = QuizScheduler(db, bot, delivery) if db is not None else None
+
+# Conversation state lives in Redis when configured; see services/state_store.py
+pending_notes = StateStore("state")
+pending_subscriptions = StateStore("subscription")
+pending_keys = StateStore("apikey")
+# Marks a recent key validation so pasting repeatedly cannot tie up workers or Gemini quota
+key_check_cooldown = StateStore("keycheck", ttl=10)
+# Questions of each user's newest quiz, for the "Explain More" buttons sent with it
+last_quizzes = StateStore("lastquiz", ttl=3600)
+
+
+def _state_for(m: Message, store: StateStore) -> dict | None:
+    """The sender's state in `store`, fetched at most once per incoming message."""
+    if not m.from_user:
+        return None
+    memo = m.__dict__.setdefault("_states", {})
+    if store.namespace not in memo:
+        memo[store.namespace] = store.get(m.from_user.id)
+    return memo[store.namespace]
+
+
+def _stage_is(store: StateStore, stage: str):
+    """Handler predicate: the sender's state in `store` is at `stage`."""
+    def check(m: Message) -> bool:
+        state = _state_for(m, store)
+        return bool(state) and state.get("stage") == stage
+    return check
+
+
+# (store namespace, stage) -> (handler, content types); see dispatch_stage_route
+_STAGE_ROUTES: dict = {}
+
+
+def stage_route(store: StateStore, stage: str, content_types=("text",)):
+    def decorator(handler):
+        _STAGE_ROUTES[(store.namespace, stage)] = (handler, tuple(content_types))
+        return handler
+    return decorator
+
+
+def _resolve_stage_route(m: Message):
+    # Stores are consulted in the order their handlers used to be registered
+    for store in (pending_notes, pending_keys):
+        state = _state_for(m, store)
+        if not state:
+            continue
+        route = _STAGE_ROUTES.get((store.namespace, state.get("stage")))
+        if route and m.content_type in route[1]:
+            return route[0]
+    return None
+
+
+# Interactive shared-quiz and battle sessions; they carry the quiz's questions
+pending_quizzes = StateStore("quizplay", ttl=3600)
+pending_battles = StateStore("battle", ttl=3600)
+
+
+# User documents already fetched during the current handler call; opened by error_handler
+_user_cache: ContextVar[dict | None] = ContextVar("user_cache", default=None)
+
+
+def get_user_cached(user_id: int) -> dict | None:
+    """
+    The user's document, memoized for the duration of the current handler call
+    on top of the repository's short TTL cache.
+    """
+    cache = _user_cache.get()
+    if cache is None:
+        return users_repo.get_cached(user_id) if users_repo else None
+    if user_id not in cache:
+        cache[user_id] = users_repo.get_cached(user_id) if users_repo else None
+    return cache[user_id]
+
+
+def get_setting(key: str, default=None):
+    """A runtime setting from the settings collection, or `default` when unset or without a DB."""
+    return settings_repo.get(key, default) if settings_repo else default
+
+
+def is_admin_user(user_id: int) -> bool:
+    """Admin check from the cached admin-id set, without loading the sender's document."""
+    return users_repo.is_admin_id(user_id) if users_repo else False
+
+
+def require_admin(func):
+    """Callback guard: the owner and admins get through, anyone else sees "Not authorized."."""
+    @functools.wraps(func)
+    def wrapper(call: CallbackQuery, *args, **kwargs):
+        user_id = call.from_user.id
+        if user_id != cfg.owner_id and not is_admin_user(user_id):
+            bot.answer_callback_query(call.id, "Not authorized.")
+            return
+        return func(call, *args, **kwargs)
+    return wrapper
 
-pending_notes: dict[int, dict] = {}
-pending_subscriptions: dict[int, dict] = {}
-pending_keys: dict[int, dict] = {}
-pending_quizzes: dict[int, dict] = {}  # Interactive quiz sessions
-pending_battles: dict[int, dict] = {}  # Battle quiz sessions
+
+def remember_user(user_doc: dict | None) -> None:
+    cache = _user_cache.get()
+    if cache is not None and user_doc:
+        cache[user_doc["id"]] = user_doc
 
 
 def error_handler(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
+        # Nested decorated calls share the outermost handler's cache
+        token = _user_cache.set({}) if _user_cache.get() is None else None
         try:
             return func(*args, **kwargs)
         except Exception as e:
@@ -120,21 +232,30 @@ def error_handler(func):
                 logger.error(traceback.format_exc())
             
             if db is not None and not is_ignored:
-                notify_admins(bot, f"⚠️ Error in `{func.__name__}`:\n`{str(e)}`", db)
+                # One send per admin; the user's error reply should not wait behind them
+                _io_pool.submit(
+                    notify_admins,
+                    bot,
+                    f"⚠️ Error in `{func.__name__}`:\n`{str(e)}`",
+                    db,
+                    dedupe_key=f"{func.__name__}:{type(e).__name__}:{str(e)[:200]}",
+                    disable_notification=True,
+                )
             
             if user_id and not is_ignored:
                 try:
                     bot.send_message(user_id, "An unexpected error occurred. The admins have been notified.")
                 except Exception:
                     pass
+        finally:
+            if token is not None:
+                _user_cache.reset(token)
     return wrapper
 
 
-def main_menu(user_id: int) -> InlineKeyboardMarkup:
+def _build_main_menu(with_admin: bool) -> InlineKeyboardMarkup:
     kb = InlineKeyboardMarkup(row_width=2)
-    # Admin / Owner check
-    user = users_repo.get(user_id) if users_repo else None
-    if user and (user.get("role") == "admin" or user_id == cfg.owner_id):
+    if with_admin:
         kb.add(InlineKeyboardButton("🛠 Admin Manage", callback_data="admin_menu"))
     kb.add(
         InlineKeyboardButton("📝 Generate", callback_data="generate"),
@@ -153,6 +274,32 @@ def main_menu(user_id: int) -> InlineKeyboardMarkup:
     return kb
 
 
+# The menu only differs by the admin row, so both variants are built once and shared
+_MAIN_MENU = _build_main_menu(with_admin=False)
+_ADMIN_MAIN_MENU = _build_main_menu(with_admin=True)
+
+
+def main_menu(user_id: int) -> InlineKeyboardMarkup:
+    # Admin / Owner check
+    if user_id == cfg.owner_id or is_admin_user(user_id):
+        return _ADMIN_MAIN_MENU
+    return _MAIN_MENU
+
+
+_WELCOME_TEMPLATE = (
+    "<b>Welcome to SmartQuiz Bot!</b>\n\n"
+    "Turn your notes into interactive questions effortlessly.\n\n"
+    "✨ Features:\n"
+    "- Convert study notes into quizzes\n"
+    "- Choose between text or quiz mode\n"
+    "- Deliver to PM or your channel\n"
+    "- Configure delay and schedule delivery\n\n"
+    "Your referral link: https://t.me/{bot_username}?start=ref{user_id}\n"
+    "Invite 2 users to get Premium!\n\n"
+    "Your support makes this bot better!"
+)
+
+
 @bot.message_handler(commands=["start"]) 
 @error_handler
 def handle_start(message: Message):
@@ -178,11 +325,11 @@ def handle_start(message: Message):
         elif arg.startswith("battle_"):
             deep_link_battle_id = arg[7:]
 
-    users_repo.upsert_user(user_id, username)
+    remember_user(users_repo.upsert_user(user_id, username))
 
     # Store pending referral — actual credit happens after channel join
     if referrer_id and referrer_id != user_id:
-        existing = users_repo.get(user_id) or {}
+        existing = get_user_cached(user_id) or {}
         if not existing.get("invited_by"):
             users_repo.set_pending_referrer(user_id, referrer_id)
 
@@ -191,7 +338,7 @@ def handle_start(message: Message):
         return
 
     if not is_subscribed(bot, user_id):
-        channels = settings_repo.get("force_channels", cfg.force_channels) if settings_repo else cfg.force_channels
+        channels = get_setting("force_channels", cfg.force_channels)
         channels_txt = "\n".join(channels) if channels else ""
         kb = InlineKeyboardMarkup()
         kb.add(InlineKeyboardButton("🔄 Check Subscription", callback_data="home"))
@@ -217,18 +364,7 @@ def handle_start(message: Message):
         _start_battle_quiz(user_id, deep_link_battle_id)
         return
 
-    text = (
-        "<b>Welcome to SmartQuiz Bot!</b>\n\n"
-        "Turn your notes into interactive questions effortlessly.\n\n"
-        "✨ Features:\n"
-        "- Convert study notes into quizzes\n"
-        "- Choose between text or quiz mode\n"
-        "- Deliver to PM or your channel\n"
-        "- Configure delay and schedule delivery\n\n"
-        f"Your referral link: https://t.me/{get_bot_info().username}?start=ref{user_id}\n"
-        "Invite 2 users to get Premium!\n\n"
-        "Your support makes this bot better!"
-    )
+    text = _WELCOME_TEMPLATE.format(bot_username=get_bot_info().username, user_id=user_id)
     bot.send_message(user_id, text, parse_mode="HTML", reply_markup=main_menu(user_id), disable_web_page_preview=True)
 
 
@@ -239,19 +375,64 @@ def _process_pending_referral(user_id: int, display_name: str = "Someone"):
     pending_ref = users_repo.get_pending_referrer(user_id)
     if pending_ref:
         if users_repo.set_referrer(user_id, pending_ref):
-            try:
-                bot.send_message(pending_ref, f"🎉 New user {display_name} joined via your link!")
-                users_repo.check_and_reward_referral_milestone(pending_ref, bot, settings_repo)
-            except Exception:
-                pass
+            # The new user's welcome does not wait on the referrer's notification or reward
+            _io_pool.submit(_referral_side_effects, pending_ref, display_name)
         users_repo.clear_pending_referrer(user_id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "home")
+def _referral_side_effects(referrer_id: int, display_name: str):
+    try:
+        bot.send_message(referrer_id, f"🎉 New user {display_name} joined via your link!", disable_notification=True)
+    except Exception:
+        pass
+    try:
+        users_repo.check_and_reward_referral_milestone(referrer_id, bot, settings_repo)
+    except Exception as e:
+        logger.error(f"Referral milestone check for {referrer_id} failed: {e}")
+
+
+# Prefix-routed callbacks ("<prefix>_<payload>"): one dict lookup instead of a startswith filter each
+_CALLBACK_ROUTES: dict = {}
+# Fixed callbacks ("home", "settings", ...), likewise looked up instead of filtered one by one
+_CALLBACK_EXACT: dict = {}
+
+
+def callback_route(prefix: str):
+    def decorator(handler):
+        _CALLBACK_ROUTES[prefix] = handler
+        return handler
+    return decorator
+
+
+def callback_exact(data: str):
+    def decorator(handler):
+        _CALLBACK_EXACT[data] = handler
+        return handler
+    return decorator
+
+
+def _resolve_callback_route(data: str):
+    head, _, rest = (data or "").partition("_")
+    if not rest:
+        return _CALLBACK_EXACT.get(head)
+    # Two-token prefixes (exp_more) take precedence over their one-token parent (exp)
+    return (
+        _CALLBACK_ROUTES.get(f"{head}_{rest.partition('_')[0]}")
+        or _CALLBACK_ROUTES.get(head)
+        or _CALLBACK_EXACT.get(data)
+    )
+
+
+@bot.callback_query_handler(func=lambda call: _resolve_callback_route(call.data) is not None)
+def dispatch_callback_route(call: CallbackQuery):
+    _resolve_callback_route(call.data)(call)
+
+
+@callback_exact("home")
 def handle_home(call: CallbackQuery):
     user_id = call.from_user.id
     if not is_subscribed(bot, user_id):
-        channels = settings_repo.get("force_channels", cfg.force_channels) if settings_repo else cfg.force_channels
+        channels = get_setting("force_channels", cfg.force_channels)
         channels_txt = "\n".join(channels) if channels else ""
         kb = InlineKeyboardMarkup()
         kb.add(InlineKeyboardButton("🔄 Check Subscription", callback_data="home"))
@@ -263,19 +444,19 @@ def handle_home(call: CallbackQuery):
             f"{channels_txt}"
         )
         
-        try:
-            bot.edit_message_text(msg_text, call.message.chat.id, call.message.message_id, parse_mode="HTML", reply_markup=kb)
-        except Exception:
-            bot.send_message(user_id, msg_text, parse_mode="HTML", reply_markup=kb)
+        edit_menu(call, msg_text, kb, parse_mode="HTML")
         return
 
     # User is now subscribed — process any pending referral
     display_name = call.from_user.first_name or call.from_user.username or "Someone"
     _process_pending_referral(user_id, display_name)
 
-    pending_notes.pop(user_id, None)
-    pending_quizzes.pop(user_id, None)
-    pending_battles.pop(user_id, None)
+    abandoned = pending_notes.get(user_id)
+    if abandoned:
+        remove_tempfile(abandoned.get("media_path"))
+    pending_notes.delete(user_id)
+    pending_quizzes.delete(user_id)
+    pending_battles.delete(user_id)
     try:
         bot.edit_message_text(
             "🏠 **Home**\nSelect an option below:", 
@@ -288,7 +469,14 @@ def handle_home(call: CallbackQuery):
         bot.send_message(user_id, "🏠 **Home**", parse_mode="Markdown", reply_markup=main_menu(user_id))
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "faq")
+@bot.chat_member_handler()
+def handle_chat_member_update(update: ChatMemberUpdated):
+    # A member left or was removed somewhere we administer; drop their cached subscription verdict
+    if update.new_chat_member.status in ("left", "kicked"):
+        forget_subscription(update.new_chat_member.user.id)
+
+
+@callback_exact("faq")
 def handle_faq(call: CallbackQuery):
     try:
         bot.delete_message(call.message.chat.id, call.message.message_id)
@@ -313,7 +501,7 @@ def handle_faq(call: CallbackQuery):
     )
     bot.send_message(call.message.chat.id, text, parse_mode="Markdown", reply_markup=home_keyboard())
 
-@bot.callback_query_handler(func=lambda call: call.data == "about")
+@callback_exact("about")
 def handle_about(call: CallbackQuery):
     try:
         bot.delete_message(call.message.chat.id, call.message.message_id)
@@ -329,7 +517,12 @@ def handle_about(call: CallbackQuery):
     bot.send_message(call.message.chat.id, text, parse_mode="HTML", reply_markup=home_keyboard())
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "features")
+_FEATURES_KEYBOARD = InlineKeyboardMarkup()
+_FEATURES_KEYBOARD.add(InlineKeyboardButton("💎 Get Premium", callback_data="subscribe_premium"))
+_FEATURES_KEYBOARD.add(InlineKeyboardButton("🔙 Home", callback_data="home"))
+
+
+@callback_exact("features")
 def handle_features(call: CallbackQuery):
     try:
         bot.delete_message(call.message.chat.id, call.message.message_id)
@@ -366,77 +559,92 @@ def handle_features(call: CallbackQuery):
         "💡 <i>Get Premium by inviting friends or subscribing!</i>"
     )
     
-    kb = InlineKeyboardMarkup()
-    kb.add(InlineKeyboardButton("💎 Get Premium", callback_data="subscribe_premium"))
-    kb.add(InlineKeyboardButton("🔙 Home", callback_data="home"))
-    
-    bot.send_message(call.message.chat.id, text, parse_mode="HTML", reply_markup=kb)
+    bot.send_message(call.message.chat.id, text, parse_mode="HTML", reply_markup=_FEATURES_KEYBOARD)
+
+
+# "/cmd <user_id>" and "/addpremium <user_id> [days]", with or without @BotName
+_USER_ID_ARG_RE = re.compile(r"^/\w+(?:@\w+)?\s+(\d+)\s*$")
+_ADDPREMIUM_RE = re.compile(r"^/\w+(?:@\w+)?\s+(\d+)(?:\s+(\d+))?\s*$")
+_USAGE_ADDADMIN = "Usage: /addadmin <user_id>"
+_USAGE_ADDPREMIUM = "Usage: /addpremium <user_id> [days]"
+_USAGE_REMOVEADMIN = "Usage: /removeadmin <user_id>"
+
+
+def admin_command(pattern: re.Pattern | None = None, usage: str = "", owner_only: bool = False):
+    """
+    Shared preamble for admin slash commands: DB availability, then the
+    sender's rights (the owner always passes), then, with `pattern`, the
+    argument syntax. Matched groups are passed on as extra arguments.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(message: Message):
+            if not users_repo:
+                bot.reply_to(message, "DB unavailable.")
+                return
+            user_id = message.from_user.id
+            if user_id != cfg.owner_id and (owner_only or not is_admin_user(user_id)):
+                bot.reply_to(message, "Not authorized.")
+                return
+            if pattern is None:
+                return func(message)
+            m = pattern.match(message.text or "")
+            if not m:
+                bot.reply_to(message, usage)
+                return
+            return func(message, *m.groups())
+        return wrapper
+    return decorator
 
 
 @bot.message_handler(commands=["addadmin"])
-def handle_add_admin(message: Message):
-    if message.from_user.id != cfg.owner_id:
-        return
+@admin_command(_USER_ID_ARG_RE, _USAGE_ADDADMIN, owner_only=True)
+def handle_add_admin(message: Message, target_id: str):
+    target_id = int(target_id)
     try:
-        args = message.text.split()
-        if len(args) < 2:
-            bot.reply_to(message, "Usage: /addadmin <user_id>")
-            return
-        target_id = int(args[1])
         users_repo.set_admin(target_id)
         bot.reply_to(message, f"User {target_id} is now an admin.")
     except Exception as e:
         bot.reply_to(message, f"Error: {e}")
 
 
+_ADMIN_KEYBOARD = InlineKeyboardMarkup(row_width=2)
+_ADMIN_KEYBOARD.add(
+    InlineKeyboardButton("📊 Settings Overview", callback_data="admin_settings_overview"),
+    InlineKeyboardButton("📈 Analytics", callback_data="admin_analytics"),
+    InlineKeyboardButton("📢 Broadcast", callback_data="admin_broadcast"),
+    InlineKeyboardButton("🔐 Force Subscription", callback_data="admin_manage_sub"),
+    InlineKeyboardButton("💰 Set Premium Price", callback_data="admin_set_price"),
+    InlineKeyboardButton("👥 Manage Users", callback_data="admin_users"),
+    InlineKeyboardButton("🔍 Lookup User", callback_data="admin_lookup"),
+    InlineKeyboardButton("🔙 Close", callback_data="close_admin"),
+)
+
+
 def admin_keyboard() -> InlineKeyboardMarkup:
-    kb = InlineKeyboardMarkup(row_width=2)
-    kb.add(
-        InlineKeyboardButton("📊 Settings Overview", callback_data="admin_settings_overview"),
-        InlineKeyboardButton("📈 Analytics", callback_data="admin_analytics"),
-        InlineKeyboardButton("📢 Broadcast", callback_data="admin_broadcast"),
-        InlineKeyboardButton("🔐 Force Subscription", callback_data="admin_manage_sub"),
-        InlineKeyboardButton("💰 Set Premium Price", callback_data="admin_set_price"),
-        InlineKeyboardButton("👥 Manage Users", callback_data="admin_users"),
-        InlineKeyboardButton("🔍 Lookup User", callback_data="admin_lookup"),
-        InlineKeyboardButton("🔙 Close", callback_data="close_admin"),
-    )
-    return kb
+    # Static, so one shared instance; callers must not add rows to it
+    return _ADMIN_KEYBOARD
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_menu")
+@callback_exact("admin_menu")
+@require_admin
 def handle_admin_menu_btn(call: CallbackQuery):
-    user_id = call.from_user.id
-    # Auth Check
-    admin = users_repo.get(user_id)
-    is_owner = (user_id == cfg.owner_id)
-    if not is_owner and (not admin or admin.get("role") != "admin"):
-        bot.answer_callback_query(call.id, "Not authorized.")
-        return
-    
     # Admin Dashboard Menu
     kb = admin_keyboard()
     bot.answer_callback_query(call.id)
     
-    try:
-        bot.edit_message_text("🔧 **Admin Dashboard**", call.message.chat.id, call.message.message_id, parse_mode="Markdown", reply_markup=kb)
-    except Exception:
-        bot.send_message(user_id, "🔧 **Admin Dashboard**", parse_mode="Markdown", reply_markup=kb)
+    edit_menu(call, "🔧 **Admin Dashboard**", kb, parse_mode="Markdown")
+
+_RM_SUB_PREFIX = "admin_rm_sub_"
+
 
 # Manager handler (called by others as well)
+@require_admin
 def handle_admin_manage_sub(call: CallbackQuery):
-    user_id = call.from_user.id
-    # Auth Check
-    admin = users_repo.get(user_id)
-    is_owner = (user_id == cfg.owner_id)
-    if not is_owner and (not admin or admin.get("role") != "admin"):
-        bot.answer_callback_query(call.id, "Not authorized.")
-        return
-
     # Get settings
-    sr = SettingsRepository(db)
-    force = sr.get("force_subscription", cfg.force_subscription)
-    channels = sr.get("force_channels", cfg.force_channels)
+    values = settings_repo.get_many({"force_subscription": cfg.force_subscription, "force_channels": cfg.force_channels})
+    force = values["force_subscription"]
+    channels = values["force_channels"]
     
     status_icon = "✅" if force else "❌"
     toggle_btn_text = "Disable Force Sub" if force else "Enable Force Sub"
@@ -451,44 +659,35 @@ def handle_admin_manage_sub(call: CallbackQuery):
     kb.add(InlineKeyboardButton(toggle_btn_text, callback_data="admin_toggle_force"))
     
     for ch in channels:
-        kb.add(InlineKeyboardButton(f"❌ Remove {ch}", callback_data=f"admin_rm_sub_{ch}"))
+        kb.add(InlineKeyboardButton(f"❌ Remove {ch}", callback_data=f"{_RM_SUB_PREFIX}{ch}"))
         
     kb.add(InlineKeyboardButton("➕ Add Channel", callback_data="admin_add_sub_prompt"))
     kb.add(InlineKeyboardButton("🔙 Back to Admin", callback_data="admin_menu"))
     
-    try:
-        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, parse_mode="Markdown", reply_markup=kb)
-    except Exception:
-        bot.send_message(user_id, text, parse_mode="Markdown", reply_markup=kb)
+    # Removing a channel that is already gone leaves the text as is, so only the keyboard is sent
+    edit_menu(call, text, kb, parse_mode="Markdown")
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_toggle_force")
+@callback_exact("admin_toggle_force")
+@require_admin
 def toggle_force_sub(call: CallbackQuery):
     bot.answer_callback_query(call.id)
-    user_id = call.from_user.id
-    # Auth Check
-    admin = users_repo.get(user_id)
-    is_owner = (user_id == cfg.owner_id)
-    if not is_owner and (not admin or admin.get("role") != "admin"):
-        bot.answer_callback_query(call.id)
-        return
-
-    sr = SettingsRepository(db)
-    current = sr.get("force_subscription", cfg.force_subscription)
-    sr.set("force_subscription", not current)
+    current = settings_repo.get("force_subscription", cfg.force_subscription)
+    settings_repo.set("force_subscription", not current)
     handle_admin_manage_sub(call)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("admin_rm_sub_"))
+@callback_route("admin_rm")
+@require_admin
 def remove_force_channel(call: CallbackQuery):
     bot.answer_callback_query(call.id)
-    channel = call.data.replace("admin_rm_sub_", "")
-    sr = SettingsRepository(db)
-    channels = sr.get("force_channels", cfg.force_channels)
+    channel = call.data[len(_RM_SUB_PREFIX):]
+    channels = settings_repo.get("force_channels", cfg.force_channels)
     if channel in channels:
         channels.remove(channel)
-        sr.set("force_channels", channels)
+        settings_repo.set("force_channels", channels)
     handle_admin_manage_sub(call)
 
-@bot.callback_query_handler(func=lambda call: call.data == "admin_add_sub_prompt")
+@callback_exact("admin_add_sub_prompt")
+@require_admin
 def prompt_add_force_channel(call: CallbackQuery):
     bot.answer_callback_query(call.id)
     user_id = call.from_user.id
@@ -497,10 +696,9 @@ def prompt_add_force_channel(call: CallbackQuery):
     except Exception:
         pass
     msg = bot.send_message(user_id, "Send the channel @username (bot must be admin there).")
-    pending_notes[user_id] = {"stage": "await_admin_force_channel", "last_msg_id": msg.message_id}
-    bot.answer_callback_query(call.id)
+    pending_notes.set(user_id, {"stage": "await_admin_force_channel", "last_msg_id": msg.message_id})
 
-@bot.message_handler(func=lambda m: m.from_user and m.from_user.id in pending_notes and pending_notes[m.from_user.id].get("stage") == "await_admin_force_channel")
+@bot.message_handler(func=_stage_is(pending_notes, "await_admin_force_channel"))
 def handle_add_force_channel_msg(message: Message):
     user_id = message.from_user.id
     channel = message.text.strip()
@@ -520,54 +718,53 @@ def handle_add_force_channel_msg(message: Message):
     except:
         pass
 
-    sr = SettingsRepository(db)
-    channels = sr.get("force_channels", cfg.force_channels)
+    channels = settings_repo.get("force_channels", cfg.force_channels)
     if channel not in channels:
         channels.append(channel)
-        sr.set("force_channels", channels)
+        settings_repo.set("force_channels", channels)
     
-    pending_notes.pop(user_id, None)
+    pending_notes.delete(user_id)
     bot.reply_to(message, f"Added {channel} to required channels.")
     
     # Show menu again
     kb = InlineKeyboardMarkup()
     kb.add(InlineKeyboardButton("🔙 Manage Subs", callback_data="admin_manage_sub"))
-    bot.send_message(user_id, "Channel added.", reply_markup=kb)
+    bot.send_message(user_id, "Channel added.", reply_markup=kb, disable_notification=True)
 
 
 # Overview handler
+@require_admin
 def handle_admin_settings_overview(call: CallbackQuery):
-    user_id = call.from_user.id
-    # Auth Check
-    admin = users_repo.get(user_id)
-    is_owner = (user_id == cfg.owner_id)
-    if not is_owner and (not admin or admin.get("role") != "admin"):
-        bot.answer_callback_query(call.id, "Not authorized.")
-        return
-    
-    # Get all settings
-    sr = SettingsRepository(db) if db is not None else None
-    
-    # Premium & Payment
-    premium_price = sr.get("premium_price", cfg.premium_price) if sr else cfg.premium_price
-    payment_channel = sr.get("payment_channel", cfg.payment_channel) if sr else cfg.payment_channel
-    
-    # Force Subscription
-    force_sub = sr.get("force_subscription", cfg.force_subscription) if sr else cfg.force_subscription
-    force_channels = sr.get("force_channels", cfg.force_channels) if sr else cfg.force_channels
-    
-    # Limits
-    max_notes_regular = sr.get("max_notes_regular", cfg.max_notes_regular) if sr else cfg.max_notes_regular
-    max_notes_premium = sr.get("max_notes_premium", cfg.max_notes_premium) if sr else cfg.max_notes_premium
-    max_notes_custom = sr.get("max_notes_custom_key", cfg.max_notes_custom_key) if sr else cfg.max_notes_custom_key
-    
-    max_q_regular = sr.get("max_questions_regular", cfg.max_questions_regular) if sr else cfg.max_questions_regular
-    max_q_premium = sr.get("max_questions_premium", cfg.max_questions_premium) if sr else cfg.max_questions_premium
-    max_q_custom = sr.get("max_questions_custom_key", cfg.max_questions_custom_key) if sr else cfg.max_questions_custom_key
-    
-    # Referral (future feature - placeholder)
-    referral_target = sr.get("referral_target", 2) if sr else 2
-    referral_reward_days = sr.get("referral_reward_days", 30) if sr else 30
+    defaults = {
+        "premium_price": cfg.premium_price,
+        "payment_channel": cfg.payment_channel,
+        "force_subscription": cfg.force_subscription,
+        "force_channels": cfg.force_channels,
+        "max_notes_regular": cfg.max_notes_regular,
+        "max_notes_premium": cfg.max_notes_premium,
+        "max_notes_custom_key": cfg.max_notes_custom_key,
+        "max_questions_regular": cfg.max_questions_regular,
+        "max_questions_premium": cfg.max_questions_premium,
+        "max_questions_custom_key": cfg.max_questions_custom_key,
+        # Referral (future feature - placeholder)
+        "referral_target": 2,
+        "referral_reward_days": 30,
+    }
+    # One settings query for the whole overview
+    values = settings_repo.get_many(defaults) if settings_repo else defaults
+
+    premium_price = values["premium_price"]
+    payment_channel = values["payment_channel"]
+    force_sub = values["force_subscription"]
+    force_channels = values["force_channels"]
+    max_notes_regular = values["max_notes_regular"]
+    max_notes_premium = values["max_notes_premium"]
+    max_notes_custom = values["max_notes_custom_key"]
+    max_q_regular = values["max_questions_regular"]
+    max_q_premium = values["max_questions_premium"]
+    max_q_custom = values["max_questions_custom_key"]
+    referral_target = values["referral_target"]
+    referral_reward_days = values["referral_reward_days"]
     
     text = (
         "📊 **Current Settings Overview**\n\n"
@@ -595,28 +792,15 @@ def handle_admin_settings_overview(call: CallbackQuery):
     kb = InlineKeyboardMarkup()
     kb.add(InlineKeyboardButton("🔙 Back to Admin", callback_data="admin_menu"))
     
-    try:
-        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, parse_mode="Markdown", reply_markup=kb)
-    except Exception:
-        bot.send_message(user_id, text, parse_mode="Markdown", reply_markup=kb)
+    edit_menu(call, text, kb, parse_mode="Markdown")
 
 
 @bot.message_handler(commands=["addpremium"])
-def handle_add_premium(message: Message):
-    user_id = message.from_user.id
-    user = users_repo.get(user_id)
-    if not user or (user.get("role") != "admin" and user_id != cfg.owner_id):
-        return
-
+@admin_command(_ADDPREMIUM_RE, _USAGE_ADDPREMIUM)
+def handle_add_premium(message: Message, target_id: str, days: str | None):
+    target_id = int(target_id)
+    duration = int(days) if days else None
     try:
-        args = message.text.split()
-        if len(args) < 2:
-            bot.reply_to(message, "Usage: /addpremium <user_id> [days]")
-            return
-        
-        target_id = int(args[1])
-        duration = int(args[2]) if len(args) > 2 else None
-        
         users_repo.set_premium(target_id, duration)
         dur_str = f"{duration} days" if duration else "Permanent"
         bot.reply_to(message, f"User {target_id} is now Premium ({dur_str}).")
@@ -626,7 +810,7 @@ def handle_add_premium(message: Message):
 
 
 # Payment Handlers (Telegram Stars)
-@bot.callback_query_handler(func=lambda call: call.data == "upgrade_premium")
+@callback_exact("upgrade_premium")
 def handle_upgrade_premium(call: CallbackQuery):
     user_id = call.from_user.id
     try:
@@ -683,29 +867,22 @@ def got_payment(message):
 
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "profile")
+@callback_exact("profile")
 def handle_profile(call: CallbackQuery):
     user_id = call.from_user.id
-    user = users_repo.get(user_id) or {}
+    user = get_user_cached(user_id) or {}
     
     status = "🌟 Premium" if is_premium(user) else "Regular"
     role = user.get("role", "user").capitalize()
     
-    # Quota info
-    today_str = datetime.now().strftime("%Y-%m-%d")
-    used_today = user.get("daily_count", 0)
-    last_date = user.get("last_note_date", "")
-    if last_date != today_str:
-        used_today = 0
-        
+    # Quota info, from the same fields and limits claim_note enforces
+    used_today = notes_used_today(user)
+    limit_notes = daily_note_limit(user)
     if is_premium(user):
-        limit_notes = cfg.max_notes_premium
         limit_questions = cfg.max_questions_premium
     elif user.get("gemini_api_key"):
-        limit_notes = cfg.max_notes_custom_key
         limit_questions = cfg.max_questions_custom_key
     else:
-        limit_notes = cfg.max_notes_regular
         limit_questions = cfg.max_questions_regular
 
     referrer_count = user.get("referral_count", 0)
@@ -727,13 +904,10 @@ def handle_profile(call: CallbackQuery):
         kb.add(InlineKeyboardButton("💎 Upgrade to Premium", callback_data="subscribe_premium"))
     kb.add(InlineKeyboardButton("🔙 Home", callback_data="home"))
     
-    try:
-        bot.edit_message_text(msg, call.message.chat.id, call.message.message_id, parse_mode="Markdown", reply_markup=kb)
-    except Exception:
-        bot.send_message(user_id, msg, parse_mode="Markdown", reply_markup=kb)
+    edit_menu(call, msg, kb, parse_mode="Markdown")
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "channels")
+@callback_exact("channels")
 def handle_channels(call: CallbackQuery):
     user_id = call.from_user.id
     user_channels = channels_repo.list_channels(user_id)
@@ -749,13 +923,10 @@ def handle_channels(call: CallbackQuery):
         "- Add channels where you are admin/owner and where the bot is also admin.\n"
         "- You can later select any of them as quiz targets."
     )
-    try:
-        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=kb)
-    except Exception:
-        bot.send_message(user_id, text, reply_markup=kb)
+    edit_menu(call, text, kb)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "add_channel_info")
+@callback_exact("add_channel_info")
 def handle_add_channel_info(call: CallbackQuery):
     user_id = call.from_user.id
     text = (
@@ -772,7 +943,16 @@ def handle_add_channel_info(call: CallbackQuery):
     # We might need to store this last_msg_id in a separate state if we want to delete it later
     # but channel addition doesn't use pending_notes state yet.
     # Let's add it.
-    pending_notes[user_id] = {"stage": "await_channel", "last_msg_id": msg.message_id}
+    pending_notes.set(user_id, {"stage": "await_channel", "last_msg_id": msg.message_id})
+
+
+def _channel_rights(chat_id: int, user_id: int) -> tuple[bool, bool]:
+    """(user is an admin of the channel, bot can post there), with both lookups in flight at once."""
+    bot_member = _lookup_pool.submit(bot.get_chat_member, chat_id, get_bot_info().id)
+    member = bot.get_chat_member(chat_id, user_id)
+    is_admin = member.status in ["administrator", "creator"]
+    can_post = bot_member.result().status in ["administrator", "creator"]
+    return is_admin, can_post
 
 
 @bot.message_handler(func=lambda m: m.forward_from_chat is not None and m.forward_from_chat.type == "channel")
@@ -791,26 +971,37 @@ def handle_channel_forward(message: Message):
                 bot.delete_message(user_id, state["last_msg_id"])
             except:
                 pass
-        pending_notes.pop(user_id, None)
+        pending_notes.delete(user_id)
     try:
         bot.delete_message(message.chat.id, message.message_id)
     except:
         pass
 
     try:
-        member = bot.get_chat_member(chat_id, user_id)
-        if member.status not in ["administrator", "creator"]:
+        is_admin, can_post = _channel_rights(chat_id, user_id)
+        if not is_admin:
             bot.reply_to(message, "You must be admin of that channel.")
             return
-        bot_member = bot.get_chat_member(chat_id, get_bot_info().id)
-        can_post = bot_member.status in ["administrator", "creator"]
         channels_repo.add_channel(user_id, chat_id, title, username, can_post)
         bot.reply_to(message, f"Channel saved: {title}")
     except Exception as e:
         bot.reply_to(message, f"Failed to verify channel: {e}")
 
 
-@bot.message_handler(func=lambda m: bool(m.text) and m.text.startswith("@"))
+# Resolved @username -> Chat payloads; usernames rarely move, so a short TTL is safe
+_chat_cache = StateStore("chat", ttl=300)
+
+
+def _get_chat_cached(username: str) -> ChatFullInfo:
+    key = username.lower()
+    raw = _chat_cache.get(key)
+    if raw is None:
+        raw = apihelper.get_chat(bot.token, username)
+        _chat_cache.set(key, raw)
+    return ChatFullInfo.de_json(raw)
+
+
+@bot.message_handler(regexp=r"^\s*@[a-z][a-z0-9_]{3,31}\s*$")
 def handle_channel_username(message: Message):
     # Attempt to resolve channel by username
     user_id = message.from_user.id
@@ -823,43 +1014,41 @@ def handle_channel_username(message: Message):
                 bot.delete_message(user_id, state["last_msg_id"])
             except:
                 pass
-        pending_notes.pop(user_id, None)
+        pending_notes.delete(user_id)
     try:
         bot.delete_message(message.chat.id, message.message_id)
     except:
         pass
 
     try:
-        chat = bot.get_chat(message.text)
+        chat = _get_chat_cached(message.text.strip())
         if not chat or chat.type != "channel":
             bot.reply_to(message, "Not a valid channel username.")
             return
-        member = bot.get_chat_member(chat.id, user_id)
-        if member.status not in ["administrator", "creator"]:
+        is_admin, can_post = _channel_rights(chat.id, user_id)
+        if not is_admin:
             bot.reply_to(message, "You must be admin of that channel.")
             return
-        bot_member = bot.get_chat_member(chat.id, get_bot_info().id)
-        can_post = bot_member.status in ["administrator", "creator"]
         channels_repo.add_channel(user_id, chat.id, chat.title or "Channel", chat.username, can_post)
         bot.reply_to(message, f"Channel saved: {chat.title}")
     except Exception as e:
         bot.reply_to(message, f"Failed to add channel: {e}")
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("removech_"))
+@callback_route("removech")
 def handle_remove_channel(call: CallbackQuery):
     user_id = call.from_user.id
-    chat_id = int(call.data.split("_")[1])
+    chat_id = int(call.data.partition("_")[2])
     channels_repo.remove_channel(user_id, chat_id)
     bot.answer_callback_query(call.id, "Removed")
     handle_channels(call)
 
 
 # Quizzes Management
-@bot.callback_query_handler(func=lambda call: call.data == "my_quizzes")
+@callback_exact("my_quizzes")
 def handle_my_quizzes(call: CallbackQuery):
     user_id = call.from_user.id
-    user = users_repo.get(user_id) or {}
+    user = get_user_cached(user_id) or {}
     is_prem = is_premium(user)
     
     # If not premium, only fetch last 2. If premium, fetch last 20 (pagination later if needed)
@@ -869,7 +1058,10 @@ def handle_my_quizzes(call: CallbackQuery):
     kb = InlineKeyboardMarkup(row_width=1)
     for q in quizzes:
         title = q.get("title", "Quiz")
-        created = q.get("created_at").strftime("%Y-%m-%d") if q.get("created_at") else ""
+        created = q.get("created_at_str")
+        if created is None:
+            # Quizzes saved before created_at_str existed
+            created = q.get("created_at").strftime("%Y-%m-%d") if q.get("created_at") else ""
         kb.add(InlineKeyboardButton(f"📄 {title} ({created})", callback_data=f"viewquiz_{q['_id']}"))
     
     if not quizzes:
@@ -881,17 +1073,13 @@ def handle_my_quizzes(call: CallbackQuery):
     kb.add(InlineKeyboardButton("🔙 Home", callback_data="home"))
     
     text = "<b>My Quizzes</b>\nSelect a quiz to view or export."
-    try:
-        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, parse_mode="HTML", reply_markup=kb)
-    except Exception:
-        bot.send_message(user_id, text, parse_mode="HTML", reply_markup=kb)
+    edit_menu(call, text, kb, parse_mode="HTML")
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("viewquiz_"))
+@callback_route("viewquiz")
 def handle_view_quiz(call: CallbackQuery):
-    user_id = call.from_user.id
-    quiz_id = call.data.split("_")[1]
-    quiz = quizzes_repo.get_quiz(quiz_id)
+    quiz_id = call.data.partition("_")[2]
+    quiz = quizzes_repo.get_quiz_meta(quiz_id)
     
     if not quiz:
         bot.answer_callback_query(call.id, "Quiz not found")
@@ -900,7 +1088,7 @@ def handle_view_quiz(call: CallbackQuery):
     shares = quiz.get('share_count', 0)
     plays = quiz.get('play_count', 0)
     text = f"<b>{quiz.get('title')}</b>\n"
-    text += f"Questions: {len(quiz.get('questions', []))}\n"
+    text += f"Questions: {quiz.get('question_count', 0)}\n"
     text += f"Date: {quiz.get('created_at')}\n"
     if shares or plays:
         text += f"\n📊 Shared: {shares} | Played: {plays}\n"
@@ -917,19 +1105,18 @@ def handle_view_quiz(call: CallbackQuery):
     kb.add(InlineKeyboardButton("📃 Export TXT", callback_data=f"exp_{quiz_id}_txt"))
     kb.add(InlineKeyboardButton("🔙 Back", callback_data="my_quizzes"))
 
-    try:
-        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, parse_mode="HTML", reply_markup=kb)
-    except Exception:
-        bot.send_message(user_id, text, parse_mode="HTML", reply_markup=kb)
+    edit_menu(call, text, kb, parse_mode="HTML")
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("exp_more_"))
+@callback_route("exp_more")
 def handle_explain_more(call: CallbackQuery):
     user_id = call.from_user.id
-    q_index = int(call.data.split("_")[-1])
+    q_index = int(call.data.rpartition("_")[2])
     
     # Attempt to retrieve the last quiz generated for this user
-    last_quiz = quizzes_repo.collection.find_one({"user_id": user_id}, sort=[("created_at", -1)])
+    last_quiz = last_quizzes.get(user_id) or quizzes_repo.collection.find_one(
+        {"user_id": user_id}, {"questions": 1}, sort=[("created_at", -1)]
+    )
     if not last_quiz or "questions" not in last_quiz:
         bot.answer_callback_query(call.id, "Context lost. Please start a new quiz.")
         return
@@ -944,11 +1131,15 @@ def handle_explain_more(call: CallbackQuery):
     
     # Use Gemini to explain this specific question in detail
     prompt = f"Explain this quiz question in more detail. Why is the correct answer right and why might someone get it wrong?\n\nQuestion: {q_data['question']}\nCorrect Answer: {q_data['choices'][q_data['answer_index']]}\nExplanation: {q_data.get('explanation','')}"
-    
+    # The Gemini call takes seconds; keep it off the update worker
+    _io_pool.submit(_send_deep_dive, user_id, q_index, prompt)
+
+
+def _send_deep_dive(user_id: int, q_index: int, prompt: str):
     try:
         # Re-using the generate logic but for a simple chat/explanation
         api_key = _choose_api_key(user_id)
-        client = genai.Client(api_key=api_key)
+        client = get_client(api_key)
         response = client.models.generate_content(
             model="gemini-2.0-flash",
             contents=prompt
@@ -959,19 +1150,17 @@ def handle_explain_more(call: CallbackQuery):
         bot.send_message(user_id, f"Failed to get deep dive: {e}")
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("exp_"))
+@callback_route("exp")
 def handle_export_quiz(call: CallbackQuery):
     user_id = call.from_user.id
-    user = users_repo.get(user_id) or {}
+    user = get_user_cached(user_id) or {}
     
     # Check premium
     if not is_premium(user) and user.get("role") != "admin" and user_id != cfg.owner_id:
         bot.answer_callback_query(call.id, "Export is a Premium feature!", show_alert=True)
         return
 
-    parts = call.data.split("_")
-    quiz_id = parts[1]
-    fmt = parts[2]
+    quiz_id, _, fmt = call.data.partition("_")[2].partition("_")
     
     quiz = quizzes_repo.get_quiz(quiz_id)
     if not quiz:
@@ -988,6 +1177,8 @@ def handle_export_quiz(call: CallbackQuery):
         
         bot_username = get_bot_info().username or "SmartQuizBot"
 
+        # reportlab and python-docx are only needed here, so keep them out of startup
+        from .services.exporter import QuizExporter
         if fmt == "pdf":
             file_io = QuizExporter.to_pdf(title, questions, bot_username)
         elif fmt == "docx":
@@ -996,98 +1187,118 @@ def handle_export_quiz(call: CallbackQuery):
             file_io = QuizExporter.to_txt(title, questions, bot_username)
             
         if file_io:
-            bot.send_document(user_id, (filename, file_io))
+            with file_io:
+                bot.send_document(user_id, (filename, file_io))
             bot.delete_message(user_id, processing.message_id)
         else:
-            bot.embed_message_text("Export failed.", user_id, processing.message_id)
+            bot.edit_message_text("Export failed.", user_id, processing.message_id)
 
     except Exception as e:
         bot.edit_message_text(f"Export Error: {e}", user_id, processing.message_id)
 
 
 # Generate flow
-@bot.callback_query_handler(func=lambda call: call.data == "generate")
+_INPUT_TYPE_KEYBOARD = InlineKeyboardMarkup(row_width=1)
+_INPUT_TYPE_KEYBOARD.add(
+    InlineKeyboardButton("📝 Use a Note", callback_data="input_note"),
+    InlineKeyboardButton("🏷️ Title Only", callback_data="input_title"),
+    InlineKeyboardButton("📄 File (PDF/DOCX/TXT/PPT) [Premium]", callback_data="input_file"),
+    InlineKeyboardButton("📺 YouTube [Premium]", callback_data="input_youtube"),
+    InlineKeyboardButton("🎙️ Audio [Premium]", callback_data="input_audio"),
+    InlineKeyboardButton("🔙 Home", callback_data="home"),
+)
+
+_DIFFICULTY_KEYBOARD = InlineKeyboardMarkup(row_width=1)
+_DIFFICULTY_KEYBOARD.add(
+    InlineKeyboardButton("🟢 Beginner", callback_data="diff_Beginner"),
+    InlineKeyboardButton("🟡 Medium", callback_data="diff_Medium"),
+    InlineKeyboardButton("🔴 Hard", callback_data="diff_Hard"),
+    InlineKeyboardButton("🔙 Home", callback_data="home"),
+)
+
+_DELAY_KEYBOARD = InlineKeyboardMarkup(row_width=5)
+for _s in [5, 10, 15, 20, 30, 45, 60]:
+    _DELAY_KEYBOARD.add(InlineKeyboardButton(f"{_s}s", callback_data=f"delay_{_s}"))
+_DELAY_KEYBOARD.add(InlineKeyboardButton("Custom", callback_data="delay_custom"))
+_DELAY_KEYBOARD.add(InlineKeyboardButton("🔙 Home", callback_data="home"))
+
+_SEND_OR_SCHEDULE_KEYBOARD = InlineKeyboardMarkup(row_width=2)
+_SEND_OR_SCHEDULE_KEYBOARD.add(InlineKeyboardButton("Send Now", callback_data="sendnow"))
+_SEND_OR_SCHEDULE_KEYBOARD.add(InlineKeyboardButton("Schedule", callback_data="doschedule"))
+_SEND_OR_SCHEDULE_KEYBOARD.add(InlineKeyboardButton("🔙 Home", callback_data="home"))
+
+
+def replace_menu(call: CallbackQuery, text: str, markup: InlineKeyboardMarkup | None = None) -> int:
+    """
+    Turn the message `call` came from into the next step's prompt and return its id.
+
+    One edit instead of deleting the old step and sending a new message; a
+    fresh message is sent only when the old one cannot be edited.
+    """
+    try:
+        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+    except ApiTelegramException as e:
+        if "message is not modified" not in str(e):
+            return bot.send_message(call.from_user.id, text, reply_markup=markup).message_id
+    except Exception:
+        return bot.send_message(call.from_user.id, text, reply_markup=markup).message_id
+    return call.message.message_id
+
+
+@callback_exact("generate")
 @error_handler
 def handle_generate(call: CallbackQuery):
     bot.answer_callback_query(call.id)
     user_id = call.from_user.id
-    users_repo.reset_notes_if_new_day(user_id)
 
     if not is_subscribed(bot, user_id):
         bot.send_message(user_id, "Please Join All Our Channels!\n/start - To start again")
         return
 
-    if not has_quota(db, user_id):
+    user = get_user_cached(user_id) or {}
+    if not has_quota(db, user_id, user):
         bot.send_message(user_id, "You have reached your daily limit. Add your own Gemini API key in Settings to increase limits.")
         return
 
-    pending_notes[user_id] = {"stage": "await_input_type"}
-    kb = InlineKeyboardMarkup(row_width=1)
-    kb.add(
-        InlineKeyboardButton("📝 Use a Note", callback_data="input_note"),
-        InlineKeyboardButton("🏷️ Title Only", callback_data="input_title"),
-        InlineKeyboardButton("📄 File (PDF/DOCX/TXT/PPT) [Premium]", callback_data="input_file"),
-        InlineKeyboardButton("📺 YouTube [Premium]", callback_data="input_youtube"),
-        InlineKeyboardButton("🎙️ Audio [Premium]", callback_data="input_audio"),
-        InlineKeyboardButton("🔙 Home", callback_data="home"),
-    )
+    pending_notes.set(user_id, {"stage": "await_input_type"})
     tip = ""
-    user = users_repo.get(user_id) or {}
     if not user.get("gemini_api_key"):
         tip = "\n\nTip: Add your own Gemini API key to lift the 2/day limit. Use Settings → Set/Change Gemini API Key."
     try:
         bot.delete_message(call.message.chat.id, call.message.message_id)
     except Exception:
         pass
-    bot.send_message(user_id, "Choose input type:" + tip, reply_markup=kb)
+    bot.send_message(user_id, "Choose input type:" + tip, reply_markup=_INPUT_TYPE_KEYBOARD)
+
 
+_INPUT_PROMPTS = {
+    "input_note": ("await_note", "Please send your note now."),
+    "input_title": ("await_title", "Please send the topic/title."),
+    "input_file": ("await_file", "Please upload your file (PDF, DOCX, TXT, PPT)."),
+    "input_youtube": ("await_youtube", "Please send a YouTube video link."),
+    "input_audio": ("await_audio", "Please send an audio file (Voice Note or MP3/OGG/WAV). English Only."),
+}
 
-@bot.callback_query_handler(func=lambda call: call.data in ["input_note", "input_title", "input_file", "input_youtube", "input_audio"])
+
+@callback_route("input")
 def handle_input_choice(call: CallbackQuery):
     user_id = call.from_user.id
-    if user_id not in pending_notes:
+    state = pending_notes.get(user_id)
+    if state is None:
         bot.answer_callback_query(call.id, "Session expired.")
         return
     
     choice = call.data
-    try:
-        bot.delete_message(call.message.chat.id, call.message.message_id)
-    except Exception:
-        pass
-
-    if choice == "input_note":
-        pending_notes[user_id]["stage"] = "await_note"
-        msg = bot.send_message(user_id, "Please send your note now.")
-        pending_notes[user_id]["last_msg_id"] = msg.message_id
-    elif choice == "input_title":
-        pending_notes[user_id]["stage"] = "await_title"
-        msg = bot.send_message(user_id, "Please send the topic/title.")
-        pending_notes[user_id]["last_msg_id"] = msg.message_id
-    elif choice == "input_file":
-        pending_notes[user_id]["stage"] = "await_file"
-        msg = bot.send_message(user_id, "Please upload your file (PDF, DOCX, TXT, PPT).")
-        pending_notes[user_id]["last_msg_id"] = msg.message_id
-    elif choice == "input_youtube":
-        user = users_repo.get(user_id) or {}
+    if choice in ("input_youtube", "input_audio"):
+        user = get_user_cached(user_id) or {}
         if not is_premium(user) and user.get("role") != "admin" and user_id != cfg.owner_id:
-             bot.answer_callback_query(call.id, "Premium feature only!", show_alert=True)
-             return
-        pending_notes[user_id]["stage"] = "await_youtube"
-        msg = bot.send_message(user_id, "Please send a YouTube video link.")
-        pending_notes[user_id]["last_msg_id"] = msg.message_id
-    elif choice == "input_audio":
-        user = users_repo.get(user_id) or {}
-        if not is_premium(user) and user.get("role") != "admin" and user_id != cfg.owner_id:
-             bot.answer_callback_query(call.id, "Premium feature only!", show_alert=True)
-             return
-        pending_notes[user_id]["stage"] = "await_audio"
-        msg = bot.send_message(user_id, "Please send an audio file (Voice Note or MP3/OGG/WAV). English Only.")
-        pending_notes[user_id]["last_msg_id"] = msg.message_id
-    
-    try:
-        bot.delete_message(call.message.chat.id, call.message.message_id)
-    except Exception:
-        pass
+            bot.answer_callback_query(call.id, "Premium feature only!", show_alert=True)
+            return
+
+    stage, prompt = _INPUT_PROMPTS[choice]
+    state["stage"] = stage
+    state["last_msg_id"] = replace_menu(call, prompt)
+    pending_notes.set(user_id, state)
 
 
 def ask_difficulty(user_id: int):
@@ -1100,22 +1311,29 @@ def ask_difficulty(user_id: int):
             pass
 
     # Ask Difficulty
-    kb = InlineKeyboardMarkup(row_width=1)
-    kb.add(
-        InlineKeyboardButton("🟢 Beginner", callback_data="diff_Beginner"),
-        InlineKeyboardButton("🟡 Medium", callback_data="diff_Medium"),
-        InlineKeyboardButton("🔴 Hard", callback_data="diff_Hard"),
-        InlineKeyboardButton("🔙 Home", callback_data="home"),
-    )
-    pending_notes[user_id]["stage"] = "choose_difficulty"
-    bot.send_message(user_id, "Choose difficulty:", reply_markup=kb)
+    if state is not None:
+        state["stage"] = "choose_difficulty"
+        pending_notes.set(user_id, state)
+    bot.send_message(user_id, "Choose difficulty:", reply_markup=_DIFFICULTY_KEYBOARD)
+
+
+# One handler for every stage-gated input below; registered here so that the
+# command/forward/"@" handlers above still take precedence, as they did before
+@bot.message_handler(
+    content_types=["text", "document", "audio", "voice"],
+    func=lambda m: _resolve_stage_route(m) is not None,
+)
+def dispatch_stage_route(message: Message):
+    _resolve_stage_route(message)(message)
 
 
-@bot.message_handler(func=lambda m: m.from_user and m.from_user.id in pending_notes and pending_notes[m.from_user.id].get("stage") == "await_title")
+@stage_route(pending_notes, "await_title")
 def handle_title_submission(message: Message):
     user_id = message.from_user.id
     title = message.text or ""
-    pending_notes[user_id]["title"] = title
+    state = pending_notes.get(user_id) or {}
+    state["title"] = title
+    pending_notes.set(user_id, state)
     try:
         bot.delete_message(message.chat.id, message.message_id)
     except:
@@ -1123,18 +1341,65 @@ def handle_title_submission(message: Message):
     ask_difficulty(user_id)
 
 
-@bot.message_handler(content_types=["document"], func=lambda m: m.from_user and m.from_user.id in pending_notes and pending_notes[m.from_user.id].get("stage") == "await_file")
+def _delete_quietly(chat_id: int, message_id: int) -> None:
+    try:
+        bot.delete_message(chat_id, message_id)
+    except Exception:
+        pass
+
+
+def _processing_state(user_id: int) -> dict | None:
+    """The session parked by a submission handler, or None if the user moved on during the download."""
+    state = pending_notes.get(user_id)
+    if state is None or state.get("stage") != "processing":
+        return None
+    return state
+
+
+def _end_processing(user_id: int, stage: str | None = None) -> bool:
+    """
+    After a failed download, return the session to `stage` (or end it when
+    None). Returns False without touching anything if the user moved on.
+    """
+    state = _processing_state(user_id)
+    if state is None:
+        return False
+    if stage is None:
+        pending_notes.delete(user_id)
+    else:
+        state["stage"] = stage
+        pending_notes.set(user_id, state)
+    return True
+
+
+@stage_route(pending_notes, "await_file", content_types=["document"])
 @error_handler
 def handle_file_submission(message: Message):
+    user_id = message.from_user.id
+    # Park the session so a second upload is ignored while this one downloads
+    pending_notes.update(user_id, stage="processing")
+    processing = bot.reply_to(message, "🔄 Processing file...")
+    _io_pool.submit(_process_file_submission, message, processing)
+
+
+@error_handler
+def _process_file_submission(message: Message, processing: Message):
     user_id = message.from_user.id
     try:
         text, filename = fetch_and_parse_file(bot, db, message)
+        _delete_quietly(message.chat.id, processing.message_id)
         if not text or not text.strip():
-            bot.reply_to(message, "Could not extract text. Scanned PDFs/Images are not supported. Please send a text/DOCX/PPTX file.")
+            if _end_processing(user_id, "await_file"):
+                bot.reply_to(message, "Could not extract text. Scanned PDFs/Images are not supported. Please send a text/DOCX/PPTX file.")
             return
 
-        pending_notes[user_id]["file_content"] = text
-        pending_notes[user_id]["file_name"] = filename
+        # Re-read: the user may have gone Home or started another flow meanwhile
+        state = _processing_state(user_id)
+        if state is None:
+            return
+        state["file_content"] = text
+        state["file_name"] = filename
+        pending_notes.set(user_id, state)
         try:
             bot.delete_message(message.chat.id, message.message_id)
         except:
@@ -1144,16 +1409,22 @@ def handle_file_submission(message: Message):
         # Better to just delete the user's file message too.
         ask_difficulty(user_id)
     except ValueError as e:
-        bot.reply_to(message, f"File Error: {e}")
+        _delete_quietly(message.chat.id, processing.message_id)
+        if _end_processing(user_id, "await_file"):
+            bot.reply_to(message, f"File Error: {e}")
     except Exception as e:
-        bot.reply_to(message, "Failed to process file. Ensure it is a valid text-based PDF, DOCX, or PPTX.")
+        _delete_quietly(message.chat.id, processing.message_id)
+        if _end_processing(user_id, "await_file"):
+            bot.reply_to(message, "Failed to process file. Ensure it is a valid text-based PDF, DOCX, or PPTX.")
 
 
-@bot.message_handler(func=lambda m: m.from_user and m.from_user.id in pending_notes and pending_notes[m.from_user.id].get("stage") == "await_note")
+@stage_route(pending_notes, "await_note")
 def handle_note_submission(message: Message):
     user_id = message.from_user.id
     note = message.text or ""
-    pending_notes[user_id]["note"] = note
+    state = pending_notes.get(user_id) or {}
+    state["note"] = note
+    pending_notes.set(user_id, state)
     try:
         bot.delete_message(message.chat.id, message.message_id)
     except:
@@ -1161,7 +1432,7 @@ def handle_note_submission(message: Message):
     ask_difficulty(user_id)
 
 
-@bot.message_handler(func=lambda m: m.from_user and m.from_user.id in pending_notes and pending_notes[m.from_user.id].get("stage") == "await_youtube")
+@stage_route(pending_notes, "await_youtube")
 @error_handler
 def handle_youtube_submission(message: Message):
     user_id = message.from_user.id
@@ -1171,30 +1442,46 @@ def handle_youtube_submission(message: Message):
         bot.reply_to(message, "⚠️ Please send a valid YouTube URL.")
         return
 
+    pending_notes.update(user_id, stage="processing")
     processing = bot.reply_to(message, "🔄 Fetching YouTube content (transcript or audio)...\nThis may take up to 60 seconds.")
+    _io_pool.submit(_process_youtube_submission, message, processing, url)
+
+
+@error_handler
+def _process_youtube_submission(message: Message, processing: Message, url: str):
+    user_id = message.from_user.id
     try:
-        text, audio_data, mime_type, video_title, video_description = get_youtube_transcript(url)
+        # yt-dlp is large and only needed for YouTube notes
+        from .services.youtube_service import get_youtube_content
+        text, audio_path, mime_type, video_title, video_description = get_youtube_content(url)
         try:
             bot.delete_message(message.chat.id, processing.message_id)
         except Exception:
             pass
-        
+
+        # Re-read: the user may have gone Home or started another flow meanwhile
+        state = _processing_state(user_id)
+        if state is None:
+            remove_tempfile(audio_path)
+            return
+
         # Use video title as the quiz title
         if video_title:
-            pending_notes[user_id]["title"] = video_title
+            state["title"] = video_title
         
         if text:
-            pending_notes[user_id]["note"] = text
-        elif audio_data:
-            pending_notes[user_id]["media_data"] = audio_data
-            pending_notes[user_id]["mime_type"] = mime_type
+            state["note"] = text
+        elif audio_path:
+            state["media_path"] = audio_path
+            state["mime_type"] = mime_type
             if video_description:
-                context = video_description[:500] if len(video_description) > 500 else video_description
-                pending_notes[user_id]["note"] = f"Video Description: {context}"
+                context = video_description[:500]
+                state["note"] = f"Video Description: {context}"
         else:
             bot.send_message(user_id, "❌ Could not fetch any content from this video.\n\nPossible reasons:\n• Video has no subtitles/captions\n• Video is age-restricted or region-locked\n• Audio could not be downloaded\n\nTry a different video.", reply_markup=home_keyboard())
-            pending_notes.pop(user_id, None)
+            _end_processing(user_id)
             return
+        pending_notes.set(user_id, state)
 
         try:
             bot.delete_message(message.chat.id, message.message_id)
@@ -1207,27 +1494,27 @@ def handle_youtube_submission(message: Message):
             bot.delete_message(message.chat.id, processing.message_id)
         except:
             pass
-        bot.send_message(user_id, f"⚠️ {e}", reply_markup=home_keyboard())
-        pending_notes.pop(user_id, None)
+        if _end_processing(user_id):
+            bot.send_message(user_id, f"⚠️ {e}", reply_markup=home_keyboard())
     except RuntimeError as e:
         logger.error(f"YouTube Error: {e}")
         try:
             bot.delete_message(message.chat.id, processing.message_id)
         except:
             pass
-        bot.send_message(user_id, f"❌ {e}", reply_markup=home_keyboard())
-        pending_notes.pop(user_id, None)
+        if _end_processing(user_id):
+            bot.send_message(user_id, f"❌ {e}", reply_markup=home_keyboard())
     except Exception as e:
         logger.error(f"YouTube Error: {e}")
         try:
             bot.delete_message(message.chat.id, processing.message_id)
         except:
             pass
-        bot.send_message(user_id, "❌ Failed to process YouTube video.\n\nPlease try:\n• A different/shorter video\n• A video with English subtitles\n• Check the URL is correct", reply_markup=home_keyboard())
-        pending_notes.pop(user_id, None)
+        if _end_processing(user_id):
+            bot.send_message(user_id, "❌ Failed to process YouTube video.\n\nPlease try:\n• A different/shorter video\n• A video with English subtitles\n• Check the URL is correct", reply_markup=home_keyboard())
 
 
-@bot.message_handler(content_types=["audio", "voice"], func=lambda m: m.from_user and m.from_user.id in pending_notes and pending_notes[m.from_user.id].get("stage") == "await_audio")
+@stage_route(pending_notes, "await_audio", content_types=["audio", "voice"])
 @error_handler
 def handle_audio_submission(message: Message):
     user_id = message.from_user.id
@@ -1244,18 +1531,27 @@ def handle_audio_submission(message: Message):
     file_id = file_info.file_id
     mime_type = getattr(file_info, "mime_type", None) or "audio/ogg"
     
+    pending_notes.update(user_id, stage="processing")
     processing = bot.reply_to(message, "🔄 Processing audio...")
+    _io_pool.submit(_process_audio_submission, message, processing, file_id, mime_type)
+
+
+@error_handler
+def _process_audio_submission(message: Message, processing: Message, file_id: str, mime_type: str):
+    user_id = message.from_user.id
     try:
-        file_path = bot.get_file(file_id).file_path
-        downloaded_file = bot.download_file(file_path)
-        
-        if not downloaded_file or len(downloaded_file) == 0:
-            raise ValueError("Download returned empty data")
-              
-        pending_notes[user_id]["media_data"] = downloaded_file
-        pending_notes[user_id]["mime_type"] = mime_type
-        pending_notes[user_id]["title"] = "Audio Note"
-        
+        media_path = download_to_tempfile(bot, file_id)
+        # Re-read: the user may have gone Home or started another flow meanwhile
+        state = _processing_state(user_id)
+        if state is None:
+            remove_tempfile(media_path)
+            _delete_quietly(message.chat.id, processing.message_id)
+            return
+        state["media_path"] = media_path
+        state["mime_type"] = mime_type
+        state["title"] = "Audio Note"
+        pending_notes.set(user_id, state)
+
         try:
             bot.delete_message(message.chat.id, processing.message_id)
         except:
@@ -1267,6 +1563,9 @@ def handle_audio_submission(message: Message):
         ask_difficulty(user_id)
     except Exception as e:
         logger.error(f"Audio processing error: {e}")
+        if not _end_processing(user_id, "await_audio"):
+            _delete_quietly(message.chat.id, processing.message_id)
+            return
         try:
             bot.edit_message_text("❌ Error processing audio. Please try again with a different file.", message.chat.id, processing.message_id)
         except:
@@ -1277,7 +1576,7 @@ def handle_audio_submission(message: Message):
 
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("diff_"))
+@callback_route("diff")
 def handle_difficulty_selection(call: CallbackQuery):
     user_id = call.from_user.id
     state = pending_notes.get(user_id)
@@ -1285,7 +1584,7 @@ def handle_difficulty_selection(call: CallbackQuery):
         bot.answer_callback_query(call.id, "Session expired.")
         return
 
-    diff = call.data.split("_")[1]
+    diff = call.data.partition("_")[2]
     state["difficulty"] = diff
     
     # Now ask destination
@@ -1299,14 +1598,11 @@ def handle_difficulty_selection(call: CallbackQuery):
     kb.add(InlineKeyboardButton("🔙 Home", callback_data="home"))
 
     state["stage"] = "choose_destination"
-    try:
-        bot.delete_message(call.message.chat.id, call.message.message_id)
-    except Exception:
-        pass
-    bot.send_message(user_id, f"Difficulty: {diff}\nChoose where to send the quiz:", reply_markup=kb)
+    pending_notes.set(user_id, state)
+    replace_menu(call, f"Difficulty: {diff}\nChoose where to send the quiz:", kb)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("toggle_beyond_"))
+@callback_route("toggle_beyond")
 def toggle_beyond_note(call: CallbackQuery):
     user_id = call.from_user.id
     state = pending_notes.get(user_id)
@@ -1315,10 +1611,11 @@ def toggle_beyond_note(call: CallbackQuery):
         return
     allow = call.data.endswith("yes")
     state["allow_beyond"] = allow
+    pending_notes.set(user_id, state)
     bot.answer_callback_query(call.id, "Will use knowledge beyond note." if allow else "Will stick to provided note only.")
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("dst_"))
+@callback_route("dst")
 def handle_destination_selection(call: CallbackQuery):
     user_id = call.from_user.id
     state = pending_notes.get(user_id)
@@ -1330,7 +1627,7 @@ def handle_destination_selection(call: CallbackQuery):
         state["target_chat_id"] = user_id
         state["target_label"] = "PM"
     elif call.data.startswith("dst_ch_"):
-        chat_id = int(call.data.split("_")[2])
+        chat_id = int(call.data.rpartition("_")[2])
         ch = channels_repo.get_channel(user_id, chat_id)
         if not ch:
             bot.answer_callback_query(call.id, "Channel not found")
@@ -1342,22 +1639,13 @@ def handle_destination_selection(call: CallbackQuery):
         return
 
     # Ask delay (5-60 seconds)
-    kb = InlineKeyboardMarkup(row_width=5)
-    for s in [5, 10, 15, 20, 30, 45, 60]:
-        kb.add(InlineKeyboardButton(f"{s}s", callback_data=f"delay_{s}"))
-    kb.add(InlineKeyboardButton("Custom", callback_data="delay_custom"))
-    kb.add(InlineKeyboardButton("🔙 Home", callback_data="home"))
-
     state["stage"] = "choose_delay"
+    pending_notes.set(user_id, state)
     bot.answer_callback_query(call.id)
-    try:
-        bot.delete_message(call.message.chat.id, call.message.message_id)
-    except Exception:
-        pass
-    bot.send_message(user_id, "Choose delay between questions:", reply_markup=kb)
+    replace_menu(call, "Choose delay between questions:", _DELAY_KEYBOARD)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("delay_"))
+@callback_route("delay")
 def handle_delay(call: CallbackQuery):
     user_id = call.from_user.id
     state = pending_notes.get(user_id)
@@ -1368,34 +1656,22 @@ def handle_delay(call: CallbackQuery):
     if call.data == "delay_custom":
         state["stage"] = "await_custom_delay"
         bot.answer_callback_query(call.id)
-        try:
-            bot.delete_message(call.message.chat.id, call.message.message_id)
-        except Exception:
-            pass
-        msg = bot.send_message(user_id, "Send a delay in seconds (5-60):")
-        state["last_msg_id"] = msg.message_id
+        state["last_msg_id"] = replace_menu(call, "Send a delay in seconds (5-60):")
+        pending_notes.set(user_id, state)
         return
 
-    delay = int(call.data.split("_")[1])
+    delay = int(call.data.partition("_")[2])
     delay = max(5, min(60, delay))
     state["delay_seconds"] = delay
 
     # Ask schedule or send now
-    kb = InlineKeyboardMarkup(row_width=2)
-    kb.add(InlineKeyboardButton("Send Now", callback_data="sendnow"))
-    kb.add(InlineKeyboardButton("Schedule", callback_data="doschedule"))
-    kb.add(InlineKeyboardButton("🔙 Home", callback_data="home"))
-
     state["stage"] = "confirm_send_or_schedule"
+    pending_notes.set(user_id, state)
     bot.answer_callback_query(call.id)
-    try:
-        bot.delete_message(call.message.chat.id, call.message.message_id)
-    except Exception:
-        pass
-    bot.send_message(user_id, f"Delay set to {delay}s. Send now or schedule?", reply_markup=kb)
+    replace_menu(call, f"Delay set to {delay}s. Send now or schedule?", _SEND_OR_SCHEDULE_KEYBOARD)
 
 
-@bot.message_handler(func=lambda m: m.from_user and m.from_user.id in pending_notes and pending_notes[m.from_user.id].get("stage") == "await_custom_delay")
+@stage_route(pending_notes, "await_custom_delay")
 def handle_custom_delay(message: Message):
     user_id = message.from_user.id
     state = pending_notes.get(user_id)
@@ -1421,16 +1697,34 @@ def handle_custom_delay(message: Message):
     except:
         pass
 
-    kb = InlineKeyboardMarkup(row_width=2)
-    kb.add(InlineKeyboardButton("Send Now", callback_data="sendnow"))
-    kb.add(InlineKeyboardButton("Schedule", callback_data="doschedule"))
-    kb.add(InlineKeyboardButton("🔙 Home", callback_data="home"))
-
     state["stage"] = "confirm_send_or_schedule"
-    bot.send_message(user_id, f"Delay set to {state['delay_seconds']}s. Send now or schedule?", reply_markup=kb)
+    pending_notes.set(user_id, state)
+    bot.send_message(user_id, f"Delay set to {state['delay_seconds']}s. Send now or schedule?", reply_markup=_SEND_OR_SCHEDULE_KEYBOARD)
+
+
+@error_handler
+def _record_generated_quiz(user_id: int, quiz_title: str, questions: list, to_self: bool):
+    """Save a delivered quiz and credit the user's streak and progress."""
+    if quizzes_repo:
+        quizzes_repo.create({
+            "user_id": user_id,
+            "title": quiz_title,
+            "questions": questions,
+            "created_at": datetime.now()
+        })
+    if users_repo:
+        users_repo.update_streak(user_id)
+    if progress_repo and to_self:
+        progress_repo.record_quiz_attempt(
+            user_id=user_id,
+            quiz_id="",
+            score=len(questions),
+            total=len(questions),
+            topic=quiz_title,
+        )
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "sendnow")
+@callback_exact("sendnow")
 @error_handler
 def send_now(call: CallbackQuery):
     user_id = call.from_user.id
@@ -1442,22 +1736,27 @@ def send_now(call: CallbackQuery):
     note = state.get("note", "")
     title = state.get("title")
     file_content = state.get("file_content")
-    media_data = state.get("media_data")
+    media_path = state.get("media_path")
     mime_type = state.get("mime_type")
     
     target = state.get("target_chat_id", user_id)
     delay = int(state.get("delay_seconds", 5))
     difficulty = state.get("difficulty", "Medium")
 
-    user = users_repo.get(user_id) or {}
+    user = get_user_cached(user_id) or {}
     num_questions = int(user.get("questions_per_note", 5))
     q_format = (user.get("default_question_type") or cfg.question_type_default).lower()
 
-    if not has_quota(db, user_id):
+    # Reserves the note up front so a double tap cannot generate twice
+    refused = claim_note(db, user_id, user)
+    if refused == "cooldown":
+        bot.answer_callback_query(call.id, "Please wait a few seconds before generating again.")
+        return
+    if refused:
         bot.answer_callback_query(call.id, "Daily quota reached")
         return
 
-    update_last_note_time(db, user_id)
+    delivered = False
     bot.answer_callback_query(call.id)
     try:
         bot.delete_message(call.message.chat.id, call.message.message_id)
@@ -1471,30 +1770,26 @@ def send_now(call: CallbackQuery):
         
         if file_content:
             # Chunking to avoid limits; distribute questions across chunks up to requested number
-            chunks = chunk_text(file_content, max_chars=3500)
-            per_chunk = max(1, num_questions // max(1, len(chunks)))
-            for idx, ch in enumerate(chunks):
-                if len(questions) >= num_questions:
-                    break
-                qbatch = generate_questions(ch, per_chunk, user_id=user_id, title_only=False, allow_beyond=True, difficulty=difficulty)
-                questions.extend(qbatch)
-            questions = questions[:num_questions]
-        elif title:
-            warn = "⚠️ Title-only mode: AI may include info beyond your intended scope."
-            bot.send_message(user_id, warn)
-            questions = generate_questions("", num_questions, user_id=user_id, title_only=True, allow_beyond=True, topic_title=title, difficulty=difficulty)
-        elif media_data:
-            # Multimodal (Audio/Image)
+            chunks = iter_sliding_chunks(file_content, size=3500, stride=2625)
+            chunk_count = sliding_chunk_count(len(file_content.strip()), size=3500, stride=2625)
+            questions = generate_from_chunks(chunks, num_questions, chunk_count=chunk_count, user_id=user_id, title_only=False, allow_beyond=True, difficulty=difficulty)
+        elif media_path:
+            # Multimodal (Audio/Image); checked before title, which audio/YouTube flows also set
             questions = generate_questions(
                 "", 
                 num_questions, 
                 user_id=user_id, 
                 title_only=False, 
                 allow_beyond=True, 
+                topic_title=title,
                 difficulty=difficulty,
-                media_data=media_data,
+                media_path=media_path,
                 mime_type=mime_type
             )
+        elif title:
+            warn = "⚠️ Title-only mode: AI may include info beyond your intended scope."
+            bot.send_message(user_id, warn)
+            questions = generate_questions("", num_questions, user_id=user_id, title_only=True, allow_beyond=True, topic_title=title, difficulty=difficulty)
         else:
             questions = generate_questions(note, num_questions, user_id=user_id, title_only=False, allow_beyond=allow_beyond, difficulty=difficulty)
         
@@ -1503,33 +1798,30 @@ def send_now(call: CallbackQuery):
             bot.delete_message(user_id, generating.id)
             return
         bot.delete_message(user_id, generating.id)
-        letters = ["A", "B", "C", "D"]
-        for idx, q in enumerate(questions, start=1):
-            time.sleep(delay)
-            kb = None
-            if q_format == "text":
-                text = f"{idx}. {q['question']}\n"
-                for i, c in enumerate(q["choices"]):
-                    prefix = letters[i] if i < len(letters) else str(i + 1)
-                    text += f"{prefix}. {c}\n"
-                text += f"\n<b>Correct Answer</b>: {letters[q['answer_index']]} - {q['choices'][q['answer_index']]}"
-                explanation = (q.get("explanation") or "")
-                if explanation:
-                    text += f"\n<b>Explanation:</b> {explanation[:195]}"
-                
-                kb = InlineKeyboardMarkup()
-                # Store enough context in callback_data to explain the question
-                # Limitation: callback_data max 64 bytes. We'll use a short ID.
-                kb.add(InlineKeyboardButton("🤖 Explain More", callback_data=f"exp_more_{idx}"))
-                bot.send_message(target, text, parse_mode="HTML", reply_markup=kb)
-            else:
-                bot.send_poll(
+        sends = 0
+        if q_format == "text":
+            rendered = [format_question(idx, q) for idx, q in enumerate(questions, start=1)]
+            # Several questions per message: far fewer API calls against the per-chat limit
+            for group in batch_by_length(rendered):
+                sends += 1
+                kb = InlineKeyboardMarkup(row_width=4)
+                # callback_data is capped at 64 bytes, so buttons carry only the question number
+                kb.add(*[InlineKeyboardButton(f"🤖 Explain {i + 1}", callback_data=f"exp_more_{i + 1}") for i in group])
+                block = "\n\n".join(rendered[i] for i in group)
+                delivery.submit(sends * delay, "send_message", target, block, parse_mode="HTML", reply_markup=kb)
+        else:
+            # Polls cannot be batched; one per send
+            for q in questions:
+                sends += 1
+                delivery.submit(
+                    sends * delay,
+                    "send_poll",
                     target,
                     q["question"],
                     q["choices"],
                     type="quiz",
                     correct_option_id=q["answer_index"],
-                    explanation=(q.get("explanation") or "")[:195],
+                    explanation=(q.get("explanation") or "")[:EXPLANATION_LIMIT],
                 )
         
         # Save generated questions in state for "Explain More" sessions
@@ -1538,33 +1830,17 @@ def send_now(call: CallbackQuery):
              # but for now we'll use a temporary cache or similar logic.
              # Actually, we already save the quiz to DB.
              pass
-        increment_quota(db, user_id)
-        increase_total_notes(db, user_id)
+        delivered = True
         
         # Save Quiz
-        quiz_title = title or (note[:30] + "..." if note else "Quiz") or "Generated Quiz"
-        if media_data:
-             quiz_title = f"{state.get('title', 'Media Quiz')}"
-
-        if quizzes_repo:
-            quizzes_repo.create({
-                "user_id": user_id,
-                "title": quiz_title,
-                "questions": questions,
-                "created_at": datetime.now()
-            })
-
-        # Update streak and progress
-        if users_repo:
-            users_repo.update_streak(user_id)
-        if progress_repo and target == user_id:
-            progress_repo.record_quiz_attempt(
-                user_id=user_id,
-                quiz_id="",
-                score=len(questions),
-                total=len(questions),
-                topic=quiz_title,
-            )
+        if media_path:
+            quiz_title = str(state.get("title", "Media Quiz"))
+        else:
+            quiz_title = title or (f"{note[:30]}..." if note else "Quiz")
+
+        last_quizzes.set(user_id, {"questions": questions})
+        # The questions are already queued; saving them need not hold up this worker
+        _io_pool.submit(_record_generated_quiz, user_id, quiz_title, questions, target == user_id)
 
         # Send summary
         destinations = state.get("target_label", "PM")
@@ -1581,33 +1857,40 @@ def send_now(call: CallbackQuery):
         )
         kb = InlineKeyboardMarkup()
         kb.add(InlineKeyboardButton("🏠 Home", callback_data="home"))
-        bot.send_message(user_id, summary, reply_markup=kb)
+        # Lands just after the last question
+        delivery.submit(sends * delay + 1, "send_message", user_id, summary, reply_markup=kb)
     except Exception as e:
         bot.send_message(user_id, f"Something went wrong: {e}")
     finally:
-        pending_notes.pop(user_id, None)
+        if not delivered:
+            release_note(db, user_id)
+        remove_tempfile(media_path)
+        pending_notes.delete(user_id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "doschedule")
+@callback_exact("doschedule")
 def do_schedule(call: CallbackQuery):
     user_id = call.from_user.id
     state = pending_notes.get(user_id)
     if not state:
         bot.answer_callback_query(call.id)
         return
+    # Schedules store text only; staged audio would not survive until the run
+    if state.get("media_path") and not (state.get("note") or state.get("file_content")):
+        bot.answer_callback_query(call.id, "Audio notes can't be scheduled. Use Send Now instead.", show_alert=True)
+        return
     state["stage"] = "await_schedule_time"
     bot.answer_callback_query(call.id)
     # Show local UTC+3 time hint
     now = datetime.now()
-    try:
-        bot.delete_message(call.message.chat.id, call.message.message_id)
-    except Exception:
-        pass
-    msg = bot.send_message(user_id, f"Send schedule time in format YYYY-MM-DD HH:MM (UTC+3). Example: 2025-01-01 12:30\nNow (UTC+3): {format_dt_utc3(now)}")
-    state["last_msg_id"] = msg.message_id
+    state["last_msg_id"] = replace_menu(
+        call,
+        f"Send schedule time in format YYYY-MM-DD HH:MM (UTC+3). Example: 2025-01-01 12:30\nNow (UTC+3): {format_dt_utc3(now)}",
+    )
+    pending_notes.set(user_id, state)
 
 
-@bot.message_handler(func=lambda m: m.from_user and m.from_user.id in pending_notes and pending_notes[m.from_user.id].get("stage") == "await_schedule_time")
+@stage_route(pending_notes, "await_schedule_time")
 def handle_schedule_time(message: Message):
     user_id = message.from_user.id
     state = pending_notes.get(user_id)
@@ -1631,12 +1914,13 @@ def handle_schedule_time(message: Message):
         pass
 
     # Save schedule
-    user = users_repo.get(user_id) or {}
+    user = get_user_cached(user_id) or {}
     num_questions = int(user.get("questions_per_note", 5))
     q_format = (user.get("default_question_type") or cfg.question_type_default).lower()
 
     # Convert provided UTC+3 time to UTC for storage
     scheduled_utc = from_utc3_to_utc(dt_local)
+    now = datetime.now()
 
     schedules_repo.create(
         {
@@ -1653,20 +1937,83 @@ def handle_schedule_time(message: Message):
             "difficulty": state.get("difficulty", "Medium"),
             "scheduled_at": scheduled_utc,
             "status": "pending",
-            "created_at": datetime.now(),
+            "created_at": now,
         }
     )
-    pending_notes.pop(user_id, None)
-    bot.send_message(user_id, "📅 Scheduled successfully.", reply_markup=home_keyboard())
+    media_path = state.get("media_path")
+    remove_tempfile(media_path)
+    pending_notes.delete(user_id)
+    done = "📅 Scheduled successfully."
+    if media_path:
+        done += "\nThe audio isn't kept for scheduled quizzes; only the video description will be used."
+    bot.send_message(user_id, done, reply_markup=home_keyboard())
 
 
 # Settings
-@bot.callback_query_handler(func=lambda call: call.data == "settings")
+_SETTINGS_KEYBOARD = InlineKeyboardMarkup(row_width=1)
+_SETTINGS_KEYBOARD.add(
+    InlineKeyboardButton("Change Question Type", callback_data="change_qtype"),
+    InlineKeyboardButton("Change Questions/Note", callback_data="change_qpernote"),
+    InlineKeyboardButton("Set/Change Gemini API Key", callback_data="set_gemini_key"),
+    InlineKeyboardButton("Remove Gemini API Key", callback_data="remove_gemini_key"),
+    InlineKeyboardButton("Back to Home", callback_data="home"),
+)
+
+_QTYPE_KEYBOARD = InlineKeyboardMarkup()
+_QTYPE_KEYBOARD.add(
+    InlineKeyboardButton("Text", callback_data="set_qtype_text"),
+    InlineKeyboardButton("Poll", callback_data="set_qtype_poll"),
+    InlineKeyboardButton("Back", callback_data="settings"),
+)
+
+_QPERNOTE_OPTIONS = [5, 10, 15, 20, 25, 30, 40, 50, 75, 100]
+_QPERNOTE_KEYBOARD = InlineKeyboardMarkup(row_width=5)
+for _i in range(0, len(_QPERNOTE_OPTIONS), 5):
+    _QPERNOTE_KEYBOARD.row(*[InlineKeyboardButton(str(n), callback_data=f"set_qpernote_{n}") for n in _QPERNOTE_OPTIONS[_i : _i + 5]])
+_QPERNOTE_KEYBOARD.add(InlineKeyboardButton("Back", callback_data="settings"))
+
+# Last text each menu message was edited to: the source we sent and the text Telegram shows for it
+_menu_texts = StateStore("menu", ttl=600)
+
+
+def edit_menu(call: CallbackQuery, text: str, markup: InlineKeyboardMarkup, parse_mode: str | None = None) -> None:
+    """
+    Show `text` with `markup` in the menu message `call` came from.
+
+    When the message already shows this exact text only the keyboard is
+    edited; a fresh message is sent if the menu cannot be edited at all.
+    """
+    chat_id, message_id = call.message.chat.id, call.message.message_id
+    key = f"{chat_id}:{message_id}"
+    last = _menu_texts.get(key)
+    shown = call.message.text
+    # Formatted text comes back rendered, so compare against what the last edit produced
+    unchanged = shown == text if parse_mode is None else last == {"source": text, "shown": shown}
+    try:
+        if shown is not None and unchanged:
+            bot.edit_message_reply_markup(chat_id, message_id, reply_markup=markup)
+            return
+        edited = bot.edit_message_text(text, chat_id, message_id, reply_markup=markup, parse_mode=parse_mode)
+        if parse_mode is not None and isinstance(edited, Message):
+            _menu_texts.set(key, {"source": text, "shown": edited.text})
+    except ApiTelegramException as e:
+        if "message is not modified" in str(e):
+            return
+        bot.send_message(chat_id, text, parse_mode=parse_mode, reply_markup=markup)
+    except Exception:
+        bot.send_message(chat_id, text, parse_mode=parse_mode, reply_markup=markup)
+
+
+@callback_exact("settings")
 def handle_settings(call: CallbackQuery):
-    user_id = call.from_user.id
-    user = users_repo.get(user_id)
+    bot.answer_callback_query(call.id)
+    show_settings(call)
+
+
+def show_settings(call: CallbackQuery):
+    """Render the settings menu; callers answer the callback query themselves."""
+    user = get_user_cached(call.from_user.id)
     if not user:
-        bot.answer_callback_query(call.id, "User not found.")
         return
 
     question_type = user.get("default_question_type", "text")
@@ -1679,74 +2026,49 @@ def handle_settings(call: CallbackQuery):
         f"• Gemini API Key: {key_status}"
     )
 
-    markup = InlineKeyboardMarkup(row_width=1)
-    markup.add(
-        InlineKeyboardButton("Change Question Type", callback_data="change_qtype"),
-        InlineKeyboardButton("Change Questions/Note", callback_data="change_qpernote"),
-        InlineKeyboardButton("Set/Change Gemini API Key", callback_data="set_gemini_key"),
-        InlineKeyboardButton("Remove Gemini API Key", callback_data="remove_gemini_key"),
-        InlineKeyboardButton("Back to Home", callback_data="home"),
-    )
-
-    try:
-        bot.edit_message_text(msg, call.message.chat.id, call.message.message_id, reply_markup=markup, parse_mode="Markdown")
-    except Exception:
-        bot.send_message(user_id, msg, parse_mode="Markdown", reply_markup=markup)
+    edit_menu(call, msg, _SETTINGS_KEYBOARD, parse_mode="Markdown")
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "change_qtype")
+@callback_exact("change_qtype")
 def change_question_type(call: CallbackQuery):
-    markup = InlineKeyboardMarkup()
-    markup.add(
-        InlineKeyboardButton("Text", callback_data="set_qtype_text"),
-        InlineKeyboardButton("Poll", callback_data="set_qtype_poll"),
-        InlineKeyboardButton("Back", callback_data="settings"),
-    )
-    try:
-        bot.edit_message_text("Choose a question type:", call.message.chat.id, call.message.message_id, reply_markup=markup)
-    except Exception:
-        bot.send_message(call.message.chat.id, "Choose a question type:", reply_markup=markup)
+    bot.answer_callback_query(call.id)
+    edit_menu(call, "Choose a question type:", _QTYPE_KEYBOARD)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("set_qtype_"))
+@callback_route("set_qtype")
 def set_question_type(call: CallbackQuery):
     user_id = call.from_user.id
-    new_type = call.data.split("_")[-1]
-    users_repo.set_default_qtype(user_id, new_type)
+    new_type = call.data.rpartition("_")[2]
     bot.answer_callback_query(call.id, f"Question type updated to {new_type.capitalize()}")
-    handle_settings(call)
+    users_repo.set_default_qtype(user_id, new_type)
+    show_settings(call)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "change_qpernote")
+@callback_exact("change_qpernote")
 def change_questions_per_note(call: CallbackQuery):
-    markup = InlineKeyboardMarkup(row_width=5)
-    # Common options
-    options = [5, 10, 15, 20, 25, 30, 40, 50, 75, 100]
-    buttons = [InlineKeyboardButton(str(i), callback_data=f"set_qpernote_{i}") for i in options]
-    for i in range(0, len(buttons), 5):
-        markup.row(*buttons[i : i + 5])
-    markup.add(InlineKeyboardButton("Back", callback_data="settings"))
-    try:
-        bot.edit_message_text("Choose number of questions per note:", call.message.chat.id, call.message.message_id, reply_markup=markup)
-    except Exception:
-        bot.send_message(call.message.chat.id, "Choose number of questions per note:", reply_markup=markup)
+    bot.answer_callback_query(call.id)
+    edit_menu(call, "Choose number of questions per note:", _QPERNOTE_KEYBOARD)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "set_gemini_key")
+@callback_exact("set_gemini_key")
 def start_set_gemini_key(call: CallbackQuery):
     user_id = call.from_user.id
-    pending_keys[user_id] = {"stage": "await_key"}
+    pending_keys.set(user_id, {"stage": "await_key"})
     bot.answer_callback_query(call.id)
     bot.send_message(user_id, "Send your Gemini API key now. You can create one at https://aistudio.google.com/app/apikey")
 
 
-@bot.message_handler(func=lambda m: m.from_user and m.from_user.id in pending_keys and pending_keys[m.from_user.id].get("stage") == "await_key")
+@stage_route(pending_keys, "await_key")
 def handle_set_gemini_key(message: Message):
     user_id = message.from_user.id
     key = (message.text or "").strip()
     if not key:
         bot.reply_to(message, "Key cannot be empty.")
         return
+    if user_id in key_check_cooldown:
+        bot.reply_to(message, "Please wait a few seconds before sending another key.")
+        return
+    key_check_cooldown.set(user_id, {})
     verifying = bot.reply_to(message, "Validating key...")
     ok = validate_gemini_api_key(key)
     if not ok:
@@ -1764,23 +2086,23 @@ def handle_set_gemini_key(message: Message):
         bot.delete_message(message.chat.id, verifying.id)
         bot.reply_to(message, "This key is already used by another user. Please use a unique key.")
     finally:
-        pending_keys.pop(user_id, None)
+        pending_keys.delete(user_id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "remove_gemini_key")
+@callback_exact("remove_gemini_key")
 def remove_gemini_key(call: CallbackQuery):
     user_id = call.from_user.id
-    users_repo.set_gemini_api_key(user_id, None)
     bot.answer_callback_query(call.id, "Key removed.")
-    handle_settings(call)
+    users_repo.set_gemini_api_key(user_id, None)
+    show_settings(call)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("set_qpernote_"))
+@callback_route("set_qpernote")
 def set_questions_per_note(call: CallbackQuery):
     user_id = call.from_user.id
-    new_value = int(call.data.split("_")[-1])
+    new_value = int(call.data.rpartition("_")[2])
     
-    user = users_repo.get(user_id) or {}
+    user = get_user_cached(user_id) or {}
     personal_key = user.get("gemini_api_key")
     
     # Determine max limit
@@ -1794,60 +2116,51 @@ def set_questions_per_note(call: CallbackQuery):
     if new_value > max_limit:
         bot.answer_callback_query(call.id, f"Limit is {max_limit} for your plan.")
         return
-    users_repo.set_questions_per_note(user_id, new_value)
     bot.answer_callback_query(call.id, f"Updated to {new_value} questions per note.")
-    handle_settings(call)
+    users_repo.set_questions_per_note(user_id, new_value)
+    show_settings(call)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "about")
-def handle_about(call: CallbackQuery):
-    try:
-        bot.delete_message(call.message.chat.id, call.message.message_id)
-    except Exception:
-        pass
-    text = (
-        "ℹ️ <b>About the Bot</b>\n\n"
-        "🤖 Version: <b><i>v2.0.0</i></b>\n"
-        "📚 Converts your text notes into MCQ quizzes.\n"
-        "🎓 For students, educators, creators.\n\n"
-        "🛠 New: MongoDB, user channels, delay, scheduling.\n"
-    )
-    bot.send_message(call.message.chat.id, text, parse_mode="HTML", reply_markup=home_keyboard())
+# Simple payment flow (pending → accept/decline)
+_PAYMENT_METHODS_KEYBOARD = InlineKeyboardMarkup()
+_PAYMENT_METHODS_KEYBOARD.row(
+    InlineKeyboardButton("Telebirr", callback_data="pay_telebirr"),
+    InlineKeyboardButton("CBE", callback_data="pay_cbe"),
+)
+_PAYMENT_METHODS_KEYBOARD.row(
+    InlineKeyboardButton("USDT TRC-20", callback_data="pay_trc"),
+    InlineKeyboardButton("USDT ERC-20", callback_data="pay_erc"),
+)
+_PAYMENT_METHODS_KEYBOARD.row(InlineKeyboardButton("🔙 Home", callback_data="home"))
 
+_PAYMENT_CONFIRM_KEYBOARD = InlineKeyboardMarkup()
+_PAYMENT_CONFIRM_KEYBOARD.row(
+    InlineKeyboardButton("Done", callback_data="confirm_payment"),
+    InlineKeyboardButton("Cancel", callback_data="cancel_payment"),
+)
 
-# Simple payment flow (pending → accept/decline)
-@bot.callback_query_handler(func=lambda call: call.data == "subscribe_premium")
+
+@callback_exact("subscribe_premium")
 def subscribe_premium_start(call: CallbackQuery):
     user_id = call.from_user.id
-    kb = InlineKeyboardMarkup()
-    kb.row(
-        InlineKeyboardButton("Telebirr", callback_data="pay_telebirr"),
-        InlineKeyboardButton("CBE", callback_data="pay_cbe"),
-    )
-    kb.row(
-        InlineKeyboardButton("USDT TRC-20", callback_data="pay_trc"),
-        InlineKeyboardButton("USDT ERC-20", callback_data="pay_erc"),
-    )
-    kb.row(InlineKeyboardButton("🔙 Home", callback_data="home"))
-    amount = cfg.premium_price if not settings_repo else settings_repo.get("premium_price", cfg.premium_price)
+    amount = get_setting("premium_price", cfg.premium_price)
     bot.delete_message(call.message.chat.id, call.message.message_id)
-    bot.send_message(user_id, f"Premium is {amount} ETB or ~0.5 USDT per month. Choose payment method:", reply_markup=kb)
+    bot.send_message(user_id, f"Premium is {amount} ETB or ~0.5 USDT per month. Choose payment method:", reply_markup=_PAYMENT_METHODS_KEYBOARD)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("pay_"))
+@callback_route("pay")
 def choose_payment_method(call: CallbackQuery):
     user_id = call.from_user.id
-    method = call.data.split("_")[1]
-    pending_subscriptions[user_id] = {"method": method}
-
+    method = call.data.partition("_")[2]
+    pending_subscriptions.set(user_id, {"method": method})
     if method == "telebirr":
-        numbers = (settings_repo.get("telebirr_numbers", cfg.telebirr_numbers) if settings_repo else cfg.telebirr_numbers)
+        numbers = get_setting("telebirr_numbers", cfg.telebirr_numbers)
     elif method == "cbe":
-        numbers = (settings_repo.get("cbe_numbers", cfg.cbe_numbers) if settings_repo else cfg.cbe_numbers)
+        numbers = get_setting("cbe_numbers", cfg.cbe_numbers)
     else:
         numbers = ["TRC20 Wallet: <provide>", "ERC20 Wallet: <provide>"]
 
-    amount = (settings_repo.get("premium_price", cfg.premium_price) if settings_repo else cfg.premium_price)
+    amount = get_setting("premium_price", cfg.premium_price)
     number_list = "\n".join(numbers)
     bot.delete_message(call.message.chat.id, call.message.message_id)
     bot.send_message(user_id, f"Send {amount} ETB or 0.5 USDT to:\n{number_list}\nAfter payment send a screenshot.")
@@ -1857,23 +2170,23 @@ def choose_payment_method(call: CallbackQuery):
 @bot.message_handler(content_types=["photo"]) 
 def handle_payment_photo(message: Message):
     user_id = message.from_user.id
-    if user_id not in pending_subscriptions:
+    info = pending_subscriptions.get(user_id)
+    if info is None:
         return
-    pending_subscriptions[user_id]["screenshot"] = message.photo[-1].file_id
-    kb = InlineKeyboardMarkup()
-    kb.row(InlineKeyboardButton("Done", callback_data="confirm_payment"), InlineKeyboardButton("Cancel", callback_data="cancel_payment"))
-    bot.send_message(user_id, "Submit this payment?", reply_markup=kb)
+    info["screenshot"] = message.photo[-1].file_id
+    pending_subscriptions.set(user_id, info)
+    bot.send_message(user_id, "Submit this payment?", reply_markup=_PAYMENT_CONFIRM_KEYBOARD)
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "cancel_payment")
+@callback_exact("cancel_payment")
 def cancel_payment(call: CallbackQuery):
     user_id = call.from_user.id
-    pending_subscriptions.pop(user_id, None)
+    pending_subscriptions.delete(user_id)
     bot.delete_message(call.message.chat.id, call.message.message_id)
     bot.send_message(user_id, "Payment process canceled.", reply_markup=home_keyboard())
 
 
-@bot.callback_query_handler(func=lambda call: call.data == "confirm_payment")
+@callback_exact("confirm_payment")
 @error_handler
 def confirm_payment(call: CallbackQuery):
     user_id = call.from_user.id
@@ -1887,60 +2200,56 @@ def confirm_payment(call: CallbackQuery):
         bot.send_message(user_id, "Please send a photo of your payment.")
         return
 
-    amount = (settings_repo.get("premium_price", cfg.premium_price) if settings_repo else cfg.premium_price)
+    amount = get_setting("premium_price", cfg.premium_price)
     payments_repo.insert(user_id, method, amount, screenshot_id)
 
     # Notify admins: for demo, anyone with role admin in DB
-    admins = [u.get("id") for u in db["users"].find({"role": "admin"})]
-    for admin_id in admins:
-        kb = InlineKeyboardMarkup()
-        kb.row(
-            InlineKeyboardButton("Accept", callback_data=f"acceptpay_{user_id}"),
-            InlineKeyboardButton("Decline", callback_data=f"declinepay_{user_id}"),
-        )
-        try:
-            bot.delete_message(call.message.chat.id, call.message.message_id)
-        except Exception:
-            pass
-        bot.send_photo(admin_id, screenshot_id, caption=f"New Payment\nUser: {user_id}\nMethod: {method}\nAmount: {amount}", reply_markup=kb)
+    try:
+        bot.delete_message(call.message.chat.id, call.message.message_id)
+    except Exception:
+        pass
+    kb = InlineKeyboardMarkup()
+    kb.row(
+        InlineKeyboardButton("Accept", callback_data=f"acceptpay_{user_id}"),
+        InlineKeyboardButton("Decline", callback_data=f"declinepay_{user_id}"),
+    )
+    caption = f"New Payment\nUser: {user_id}\nMethod: {method}\nAmount: {amount}"
+    # Queued so the user's confirmation is not held up by one round-trip per admin
+    for admin_id in users_repo.admin_ids():
+        delivery.submit(0, "send_photo", admin_id, screenshot_id, caption=caption, reply_markup=kb)
 
     bot.send_message(user_id, "Payment submitted for review. You'll be notified soon.", reply_markup=home_keyboard())
-    pending_subscriptions.pop(user_id, None)
+    pending_subscriptions.delete(user_id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("acceptpay_"))
+@callback_route("acceptpay")
+@require_admin
 def accept_payment(call: CallbackQuery):
-    # Only admins should accept
-    admin_user = users_repo.get(call.from_user.id)
-    if (admin_user or {}).get("role") != "admin":
-        return
-    user_id = int(call.data.split("_")[1])
+    user_id = int(call.data.partition("_")[2])
     users_repo.set_premium(user_id, 30)
     payments_repo.update_status(user_id, "accepted")
-    amount = (settings_repo.get("premium_price", cfg.premium_price) if settings_repo else cfg.premium_price)
-    bot.send_message(user_id, f"Your premium subscription for {amount} Birr has been approved!")
+    bot.answer_callback_query(call.id, "Accepted")
+    amount = get_setting("premium_price", cfg.premium_price)
+    # Notifications go out from the delivery thread; the admin's tap is done once the writes land
+    delivery.submit(0, "send_message", user_id, f"Your premium subscription for {amount} Birr has been approved!")
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    pay_channel = (settings_repo.get("payment_channel", cfg.payment_channel) if settings_repo else cfg.payment_channel)
+    pay_channel = get_setting("payment_channel", cfg.payment_channel)
     if pay_channel:
-        try:
-            bot.send_message(pay_channel, f"New Premium Subscription\nUser ID: {user_id}\nAmount Paid: {amount}\nDate: {now}")
-        except Exception:
-            pass
+        delivery.submit(0, "send_message", pay_channel, f"New Premium Subscription\nUser ID: {user_id}\nAmount Paid: {amount}\nDate: {now}")
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("declinepay_"))
+@callback_route("declinepay")
+@require_admin
 def decline_payment(call: CallbackQuery):
-    admin_user = users_repo.get(call.from_user.id)
-    if (admin_user or {}).get("role") != "admin":
-        return
-    user_id = int(call.data.split("_")[1])
+    user_id = int(call.data.partition("_")[2])
     payments_repo.update_status(user_id, "declined")
-    bot.send_message(user_id, "Your premium request was declined. If this is a mistake, please try again.")
+    bot.answer_callback_query(call.id, "Declined")
+    delivery.submit(0, "send_message", user_id, "Your premium request was declined. If this is a mistake, please try again.")
 
 
 # FAQ/About handlers already added
 
-@bot.callback_query_handler(func=lambda call: call.data == "schedule_menu")
+@callback_exact("schedule_menu")
 def handle_schedule_menu(call: CallbackQuery):
     user_id = call.from_user.id
     items = schedules_repo.get_user_schedules(user_id)
@@ -1957,16 +2266,13 @@ def handle_schedule_menu(call: CallbackQuery):
         label = f"{s.get('target_label','PM')} @ {when} ({s.get('status','pending')})"
         kb.add(InlineKeyboardButton(f"❌ Delete {label}", callback_data=f"delsch_{sched_id}"))
     kb.add(InlineKeyboardButton("🔙 Home", callback_data="home"))
-    try:
-        bot.edit_message_text("Your schedules:", call.message.chat.id, call.message.message_id, reply_markup=kb)
-    except Exception:
-        bot.send_message(user_id, "Your schedules:", reply_markup=kb)
+    edit_menu(call, "Your schedules:", kb)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("delsch_"))
+@callback_route("delsch")
 def handle_delete_schedule(call: CallbackQuery):
     user_id = call.from_user.id
-    sched_id = call.data.split("_")[1]
+    sched_id = call.data.partition("_")[2]
     ok = schedules_repo.delete(user_id, sched_id)
     bot.answer_callback_query(call.id, "Deleted" if ok else "Not found")
     handle_schedule_menu(call)
@@ -1975,123 +2281,78 @@ def handle_delete_schedule(call: CallbackQuery):
 
 
 @bot.message_handler(commands=["setforcesub"]) 
+@admin_command()
 def admin_set_force_subscription(message: Message):
-    if not users_repo:
-        bot.reply_to(message, "DB unavailable.")
-        return
-    admin = users_repo.get(message.from_user.id)
-    if not admin or admin.get("role") != "admin":
-        bot.reply_to(message, "Not authorized.")
-        return
     parts = message.text.strip().split()
     if len(parts) < 2:
         bot.reply_to(message, "Usage: /setforcesub on|off")
         return
     val = parts[1].lower() in ("on", "true", "1", "yes")
-    SettingsRepository(db).set("force_subscription", val)
+    settings_repo.set("force_subscription", val)
     bot.reply_to(message, f"force_subscription set to {val}")
 
 
 @bot.message_handler(commands=["setforcechannels"]) 
+@admin_command()
 def admin_set_force_channels(message: Message):
-    if not users_repo:
-        bot.reply_to(message, "DB unavailable.")
-        return
-    admin = users_repo.get(message.from_user.id)
-    if not admin or admin.get("role") != "admin":
-        bot.reply_to(message, "Not authorized.")
-        return
     # Example: /setforcechannels @Ch1 @Ch2 @Ch3
     parts = message.text.strip().split()
     channels = [p for p in parts[1:] if p.startswith("@")]
     if not channels:
         bot.reply_to(message, "Usage: /setforcechannels @Ch1 @Ch2 ...")
         return
-    SettingsRepository(db).set("force_channels", channels)
+    settings_repo.set("force_channels", channels)
     bot.reply_to(message, f"force_channels updated: {', '.join(channels)}")
 
 
 @bot.message_handler(commands=["setpremiumprice"]) 
+@admin_command()
 def admin_set_premium_price(message: Message):
-    if not users_repo:
-        bot.reply_to(message, "DB unavailable.")
-        return
-    admin = users_repo.get(message.from_user.id)
-    if not admin or admin.get("role") != "admin":
-        bot.reply_to(message, "Not authorized.")
-        return
     parts = message.text.strip().split()
     if len(parts) < 2 or not parts[1].isdigit():
         bot.reply_to(message, "Usage: /setpremiumprice 40")
         return
     price = int(parts[1])
-    SettingsRepository(db).set("premium_price", price)
+    settings_repo.set("premium_price", price)
     bot.reply_to(message, f"premium_price set to {price}")
 
 
 @bot.message_handler(commands=["setpaymentchannel"]) 
+@admin_command()
 def admin_set_payment_channel(message: Message):
-    if not users_repo:
-        bot.reply_to(message, "DB unavailable.")
-        return
-    admin = users_repo.get(message.from_user.id)
-    if not admin or admin.get("role") != "admin":
-        bot.reply_to(message, "Not authorized.")
-        return
     parts = message.text.strip().split()
     if len(parts) < 2 or not parts[1].startswith("@"):
         bot.reply_to(message, "Usage: /setpaymentchannel @PaymentsChannel")
         return
-    SettingsRepository(db).set("payment_channel", parts[1])
+    settings_repo.set("payment_channel", parts[1])
     bot.reply_to(message, f"payment_channel set to {parts[1]}")
 
 
 @bot.message_handler(commands=["addtelebirr"]) 
+@admin_command()
 def admin_add_telebirr(message: Message):
-    if not users_repo:
-        bot.reply_to(message, "DB unavailable.")
-        return
-    admin = users_repo.get(message.from_user.id)
-    if not admin or admin.get("role") != "admin":
-        bot.reply_to(message, "Not authorized.")
-        return
     parts = message.text.strip().split()
     if len(parts) < 2:
         bot.reply_to(message, "Usage: /addtelebirr 0912345678")
         return
-    current = SettingsRepository(db).get("telebirr_numbers", [])
+    current = settings_repo.get("telebirr_numbers", [])
     if parts[1] not in current:
         current.append(parts[1])
-    SettingsRepository(db).set("telebirr_numbers", current)
+    settings_repo.set("telebirr_numbers", current)
     bot.reply_to(message, f"telebirr_numbers: {', '.join(current)}")
 
 
 @bot.message_handler(commands=["admin"]) 
+@admin_command()
 def admin_dashboard(message: Message):
-    if not users_repo:
-        bot.reply_to(message, "DB unavailable.")
-        return
-
-    user_id = message.from_user.id
-    admin = users_repo.get(user_id)
-    is_owner = (user_id == cfg.owner_id)
-
-    if not is_owner and (not admin or admin.get("role") != "admin"):
-        bot.reply_to(message, "Not authorized.")
-        return
-
     kb = admin_keyboard()
-    bot.send_message(user_id, "🔧 **Admin Dashboard**", parse_mode="Markdown", reply_markup=kb)
+    bot.send_message(message.from_user.id, "🔧 **Admin Dashboard**", parse_mode="Markdown", reply_markup=kb)
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("admin_") or call.data == "close_admin")
 @error_handler
+@require_admin
 def handle_admin_callbacks(call: CallbackQuery):
     user_id = call.from_user.id
-    admin = users_repo.get(user_id)
-    is_owner = (user_id == cfg.owner_id)
-    if not is_owner and (not admin or admin.get("role") != "admin"):
-        bot.answer_callback_query(call.id, "Not authorized.")
-        return
 
     bot.answer_callback_query(call.id)
 
@@ -2133,10 +2394,7 @@ def handle_admin_callbacks(call: CallbackQuery):
         )
         kb = InlineKeyboardMarkup()
         kb.add(InlineKeyboardButton("🔙 Back", callback_data="admin_menu"))
-        try:
-            bot.edit_message_text(text, call.message.chat.id, call.message.message_id, parse_mode="HTML", reply_markup=kb)
-        except:
-            bot.send_message(user_id, text, parse_mode="HTML", reply_markup=kb)
+        edit_menu(call, text, kb, parse_mode="HTML")
             
     elif call.data == "close_admin":
         try: bot.delete_message(call.message.chat.id, call.message.message_id)
@@ -2152,7 +2410,7 @@ def handle_admin_callbacks(call: CallbackQuery):
         handle_admin_menu_btn(call)
 
     elif call.data.startswith("admin_give_prem_"):
-        target_id = int(call.data.split("_")[-1])
+        target_id = int(call.data.rpartition("_")[2])
         users_repo.set_premium(target_id, 30) # Default 30 days
         bot.answer_callback_query(call.id, f"User {target_id} is now Premium for 30 days.", show_alert=True)
         # Refresh details
@@ -2160,7 +2418,7 @@ def handle_admin_callbacks(call: CallbackQuery):
         if user_doc: _show_user_details(user_id, user_doc)
 
     elif call.data.startswith("admin_give_admin_"):
-        target_id = int(call.data.split("_")[-1])
+        target_id = int(call.data.rpartition("_")[2])
         if user_id != cfg.owner_id:
             bot.answer_callback_query(call.id, "Only owner can promote admins.", show_alert=True)
             return
@@ -2175,31 +2433,38 @@ def process_set_price(message: Message):
     if not message.text or not message.text.isdigit():
         bot.reply_to(message, "Error.")
         return
-    SettingsRepository(db).set("premium_price", int(message.text))
+    settings_repo.set("premium_price", int(message.text))
     bot.reply_to(message, "Done.")
 
 def process_broadcast(message: Message):
     user_id = message.from_user.id
     kb = InlineKeyboardMarkup()
     kb.add(InlineKeyboardButton("✅ Send", callback_data="confirm_broadcast"), InlineKeyboardButton("❌ Cancel", callback_data="cancel_broadcast"))
-    pending_notes[user_id] = {"broadcast_msg": message} 
+    # Store the raw update payload; Message objects are not serializable
+    pending_notes.set(user_id, {"broadcast_msg": message.json})
     bot.reply_to(message, "Confirm broadcast?", reply_markup=kb)
 
+
+# Users fetched from Mongo per round of broadcast sends
+BROADCAST_BATCH = 500
+
+
 def execute_broadcast(call: CallbackQuery):
     user_id = call.from_user.id
     if call.data == "cancel_broadcast":
-        pending_notes.pop(user_id, None)
+        pending_notes.delete(user_id)
         try:
             bot.edit_message_text("Broadcast cancelled.", call.message.chat.id, call.message.message_id)
         except:
             bot.send_message(user_id, "Broadcast cancelled.")
         return
         
-    state = pending_notes.get(user_id, {})
-    broadcast_msg = state.get("broadcast_msg")
-    if not broadcast_msg:
+    state = pending_notes.get(user_id) or {}
+    broadcast_json = state.get("broadcast_msg")
+    if not broadcast_json:
         bot.answer_callback_query(call.id, "Session expired.")
         return
+    broadcast_msg = Message.de_json(broadcast_json)
 
     try:
         bot.edit_message_text("Broadcasting started in background. You will be notified when complete.", call.message.chat.id, call.message.message_id)
@@ -2207,50 +2472,33 @@ def execute_broadcast(call: CallbackQuery):
         bot.send_message(user_id, "Broadcasting started in background.")
     
     import threading
-    def run_broadcast(msg, requester_id):
-        all_users = list(users_repo.collection.find({}))
-        success_count = 0
-        total = len(all_users)
-        
-        for i, u in enumerate(all_users):
-            target_id = u.get("id")
-            if not target_id: continue
-            try:
-                if msg.content_type == "text":
-                    bot.send_message(target_id, msg.text)
-                elif msg.content_type == "photo":
-                    bot.send_photo(target_id, msg.photo[-1].file_id, caption=msg.caption)
-                elif msg.content_type == "document":
-                    bot.send_document(target_id, msg.document.file_id, caption=msg.caption)
-                elif msg.content_type == "video":
-                    bot.send_video(target_id, msg.video.file_id, caption=msg.caption)
-                elif msg.content_type == "audio":
-                    bot.send_audio(target_id, msg.audio.file_id, caption=msg.caption)
-                elif msg.content_type == "voice":
-                    bot.send_voice(target_id, msg.voice.file_id, caption=msg.caption)
-                elif msg.content_type == "video_note":
-                    bot.send_video_note(target_id, msg.video_note.file_id)
-                elif msg.content_type == "animation":
-                    bot.send_animation(target_id, msg.animation.file_id, caption=msg.caption)
-                elif msg.content_type == "sticker":
-                    bot.send_sticker(target_id, msg.sticker.file_id)
-                else:
-                    bot.copy_message(target_id, msg.chat.id, msg.message_id)
-                success_count += 1
-                # Mark as NOT blocked if send was successful
-                users_repo.update_blocked_status(target_id, False)
-            except ApiTelegramException as e:
-                if e.error_code == 403: # Forbidden: bot was blocked by the user
-                    users_repo.update_blocked_status(target_id, True)
-                    logger.info(f"User {target_id} has blocked the bot.")
-                else:
-                    logger.error(f"Failed to send broadcast to {target_id}: {e}")
-            except Exception as e:
+    def send_one(msg, target_id) -> bool:
+        try:
+            # Works for every content type, keeps formatting and reuses the uploaded file
+            bot.copy_message(target_id, msg.chat.id, msg.message_id)
+            # Mark as NOT blocked if send was successful
+            users_repo.update_blocked_status(target_id, False)
+            return True
+        except ApiTelegramException as e:
+            if e.error_code == 403: # Forbidden: bot was blocked by the user
+                users_repo.update_blocked_status(target_id, True)
+                logger.info(f"User {target_id} has blocked the bot.")
+            else:
                 logger.error(f"Failed to send broadcast to {target_id}: {e}")
-            
-            # Rate limiting: 20 messages per second (Telegram's limit)
-            if (i + 1) % 20 == 0:
-                time.sleep(1)
+        except Exception as e:
+            logger.error(f"Failed to send broadcast to {target_id}: {e}")
+        return False
+
+    def run_broadcast(msg, requester_id):
+        success_count = total = 0
+        # Stream ids from Mongo a batch at a time instead of loading every user document
+        cursor = users_repo.collection.find({"id": {"$ne": None}}, {"id": 1, "_id": 0}, batch_size=BROADCAST_BATCH)
+        # The send limiter already paces the whole bot; the threads only overlap round trips
+        with cursor, ThreadPoolExecutor(max_workers=BROADCAST_WORKERS, thread_name_prefix="broadcast") as pool:
+            targets = (u["id"] for u in cursor)
+            while batch := list(itertools.islice(targets, BROADCAST_BATCH)):
+                total += len(batch)
+                success_count += sum(pool.map(lambda target_id: send_one(msg, target_id), batch))
         
         try:
             bot.send_message(requester_id, f"✅ Broadcast complete.\nSent to: {success_count} / {total} users.")
@@ -2258,7 +2506,7 @@ def execute_broadcast(call: CallbackQuery):
             pass
 
     threading.Thread(target=run_broadcast, args=(broadcast_msg, user_id), daemon=True).start()
-    pending_notes.pop(user_id, None)
+    pending_notes.delete(user_id)
 
 def process_admin_user_lookup(message: Message):
     admin_id = message.from_user.id
@@ -2329,123 +2577,55 @@ def _show_user_details(admin_id: int, user_doc: dict):
     
     bot.send_message(admin_id, text, parse_mode="Markdown", reply_markup=kb)
 
-@bot.callback_query_handler(func=lambda call: call.data in ["confirm_broadcast", "cancel_broadcast"])
+@callback_exact("confirm_broadcast")
+@callback_exact("cancel_broadcast")
 @error_handler
 def handle_broadcast_confirmation(call: CallbackQuery):
     execute_broadcast(call)
 
 
 @bot.message_handler(commands=["setmaxnotes"]) 
+@admin_command()
 def admin_set_max_notes(message: Message):
-    if not users_repo:
-        bot.reply_to(message, "DB unavailable.")
-        return
-    admin = users_repo.get(message.from_user.id)
-    if not admin or admin.get("role") != "admin":
-        bot.reply_to(message, "Not authorized.")
-        return
     # Usage: /setmaxnotes regular 5  OR  /setmaxnotes premium 10
     parts = message.text.strip().split()
     if len(parts) < 3 or parts[1] not in ("regular", "premium") or not parts[2].isdigit():
         bot.reply_to(message, "Usage: /setmaxnotes regular|premium <num>")
         return
     key = f"max_notes_{parts[1]}"
-    SettingsRepository(db).set(key, int(parts[2]))
+    settings_repo.set(key, int(parts[2]))
     bot.reply_to(message, f"{key} set to {parts[2]}")
 
 
 @bot.message_handler(commands=["setmaxquestions"]) 
+@admin_command()
 def admin_set_max_questions(message: Message):
-    if not users_repo:
-        bot.reply_to(message, "DB unavailable.")
-        return
-    admin = users_repo.get(message.from_user.id)
-    if not admin or admin.get("role") != "admin":
-        bot.reply_to(message, "Not authorized.")
-        return
     # Usage: /setmaxquestions regular 5  OR  /setmaxquestions premium 10
     parts = message.text.strip().split()
     if len(parts) < 3 or parts[1] not in ("regular", "premium") or not parts[2].isdigit():
         bot.reply_to(message, "Usage: /setmaxquestions regular|premium <num>")
         return
     key = f"max_questions_{parts[1]}"
-    SettingsRepository(db).set(key, int(parts[2]))
+    settings_repo.set(key, int(parts[2]))
     bot.reply_to(message, f"{key} set to {parts[2]}")
 
 
 @bot.message_handler(commands=["maintenancemode"]) 
+@admin_command()
 def admin_maintenance_mode(message: Message):
-    if not users_repo:
-        bot.reply_to(message, "DB unavailable.")
-        return
-    admin = users_repo.get(message.from_user.id)
-    if not admin or admin.get("role") != "admin":
-        bot.reply_to(message, "Not authorized.")
-        return
     parts = message.text.strip().split()
     if len(parts) < 2:
         bot.reply_to(message, "Usage: /maintenancemode on|off")
         return
     val = parts[1].lower() in ("on", "true", "1", "yes")
-    SettingsRepository(db).set("maintenance_mode", val)
+    settings_repo.set("maintenance_mode", val)
     bot.reply_to(message, f"maintenance_mode set to {val}")
 
 
-@bot.message_handler(commands=["addadmin"]) 
-def admin_add_admin(message: Message):
-    if not users_repo:
-        bot.reply_to(message, "DB unavailable.")
-        return
-    user_id = message.from_user.id
-    req = users_repo.get(user_id)
-    is_owner = (user_id == cfg.owner_id)
-    if not is_owner and (not req or req.get("role") != "admin"):
-        bot.reply_to(message, "Not authorized.")
-        return
-    parts = message.text.strip().split()
-    if len(parts) < 2 or not parts[1].isdigit():
-        bot.reply_to(message, "Usage: /addadmin <user_id>")
-        return
-    target_id = int(parts[1])
-    users_repo.set_admin(target_id)
-    bot.reply_to(message, f"User {target_id} promoted to admin.")
-
-
-@bot.message_handler(commands=["addpremium"])
-def admin_add_premium(message: Message):
-    if not users_repo:
-        bot.reply_to(message, "DB unavailable.")
-        return
-    user_id = message.from_user.id
-    req = users_repo.get(user_id)
-    is_owner = (user_id == cfg.owner_id)
-    if not is_owner and (not req or req.get("role") != "admin"):
-        bot.reply_to(message, "Not authorized.")
-        return
-    parts = message.text.strip().split()
-    if len(parts) < 2 or not parts[1].isdigit():
-        bot.reply_to(message, "Usage: /addpremium <user_id> [days]")
-        return
-    target_id = int(parts[1])
-    days = int(parts[2]) if len(parts) > 2 else 30
-    users_repo.set_premium(target_id, days)
-    bot.reply_to(message, f"User {target_id} is now Premium for {days} days.")
-
-
 @bot.message_handler(commands=["removeadmin"]) 
-def admin_remove_admin(message: Message):
-    if not users_repo:
-        bot.reply_to(message, "DB unavailable.")
-        return
-    req = users_repo.get(message.from_user.id)
-    if not req or req.get("role") != "admin":
-        bot.reply_to(message, "Not authorized.")
-        return
-    parts = message.text.strip().split()
-    if len(parts) < 2 or not parts[1].isdigit():
-        bot.reply_to(message, "Usage: /removeadmin <user_id>")
-        return
-    target_id = int(parts[1])
+@admin_command(_USER_ID_ARG_RE, _USAGE_REMOVEADMIN)
+def admin_remove_admin(message: Message, target_id: str):
+    target_id = int(target_id)
     users_repo.set_role(target_id, "user")
     bot.reply_to(message, f"User {target_id} demoted from admin.")
 
@@ -2509,10 +2689,7 @@ def _show_admin_analytics(call: CallbackQuery):
         kb.add(InlineKeyboardButton("🔄 Refresh", callback_data="admin_analytics"))
         kb.add(InlineKeyboardButton("🔙 Back to Admin", callback_data="admin_menu"))
 
-        try:
-            bot.edit_message_text(text, call.message.chat.id, call.message.message_id, parse_mode="HTML", reply_markup=kb)
-        except Exception:
-            bot.send_message(user_id, text, parse_mode="HTML", reply_markup=kb)
+        edit_menu(call, text, kb, parse_mode="HTML")
     except Exception as e:
         bot.send_message(user_id, f"Error loading analytics: {e}")
 
@@ -2521,7 +2698,7 @@ def _show_admin_analytics(call: CallbackQuery):
 # ▶ PROGRESS DASHBOARD & STREAKS
 # ═══════════════════════════════════════════════════════
 
-@bot.callback_query_handler(func=lambda call: call.data == "progress")
+@callback_exact("progress")
 @error_handler
 def handle_progress(call: CallbackQuery):
     user_id = call.from_user.id
@@ -2560,17 +2737,14 @@ def handle_progress(call: CallbackQuery):
     kb.add(InlineKeyboardButton("📝 Generate Quiz", callback_data="generate"))
     kb.add(InlineKeyboardButton("🔙 Home", callback_data="home"))
 
-    try:
-        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, parse_mode="HTML", reply_markup=kb)
-    except Exception:
-        bot.send_message(user_id, text, parse_mode="HTML", reply_markup=kb)
+    edit_menu(call, text, kb, parse_mode="HTML")
 
 
 # ═══════════════════════════════════════════════════════
 # ▶ QUIZ BATTLE MODE
 # ═══════════════════════════════════════════════════════
 
-@bot.callback_query_handler(func=lambda call: call.data == "battle_menu")
+@callback_exact("battle_menu")
 @error_handler
 def handle_battle_menu(call: CallbackQuery):
     user_id = call.from_user.id
@@ -2580,10 +2754,13 @@ def handle_battle_menu(call: CallbackQuery):
 
     text = "🏆 <b>Quiz Battles</b>\n\n"
     if battles:
+        # One $in query for every battle's quiz title instead of one lookup per row
+        quiz_ids = [str(b.get("quiz_id", "")) for b in battles]
+        quizzes = quizzes_repo.get_many(quiz_ids, {"title": 1}) if quizzes_repo else {}
         text += "<b>Recent Battles:</b>\n"
         for b in battles:
             status = b.get("status", "waiting")
-            quiz = quizzes_repo.get_quiz(str(b.get("quiz_id", ""))) if quizzes_repo else None
+            quiz = quizzes.get(str(b.get("quiz_id", "")))
             title = quiz.get("title", "Quiz") if quiz else "Quiz"
 
             if status == "waiting":
@@ -2607,19 +2784,16 @@ def handle_battle_menu(call: CallbackQuery):
     kb.add(InlineKeyboardButton("📂 My Quizzes", callback_data="my_quizzes"))
     kb.add(InlineKeyboardButton("🔙 Home", callback_data="home"))
 
-    try:
-        bot.edit_message_text(text, call.message.chat.id, call.message.message_id, parse_mode="HTML", reply_markup=kb)
-    except Exception:
-        bot.send_message(user_id, text, parse_mode="HTML", reply_markup=kb)
+    edit_menu(call, text, kb, parse_mode="HTML")
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("startbattle_"))
+@callback_route("startbattle")
 @error_handler
 def handle_create_battle(call: CallbackQuery):
     """Challenger creates a battle — they take the quiz first, then get a link."""
     user_id = call.from_user.id
     bot.answer_callback_query(call.id)
-    quiz_id = call.data.split("_", 1)[1]
+    quiz_id = call.data.partition("_")[2]
     quiz = quizzes_repo.get_quiz(quiz_id) if quizzes_repo else None
 
     if not quiz:
@@ -2632,7 +2806,7 @@ def handle_create_battle(call: CallbackQuery):
         return
 
     # Start interactive quiz for the challenger
-    pending_battles[user_id] = {
+    pending_battles.set(user_id, {
         "quiz_id": quiz_id,
         "questions": questions,
         "current_index": 0,
@@ -2640,7 +2814,7 @@ def handle_create_battle(call: CallbackQuery):
         "total": len(questions),
         "mode": "challenger",
         "title": quiz.get("title", "Quiz"),
-    }
+    })
 
     bot.send_message(user_id, f"⚔️ <b>Battle Mode!</b>\n\nTake the quiz first, then challenge your friend.\n\nQuiz: <b>{quiz.get('title')}</b>\nQuestions: {len(questions)}", parse_mode="HTML")
     _send_battle_question(user_id)
@@ -2674,7 +2848,7 @@ def _start_battle_quiz(user_id: int, battle_id: str):
         return
 
     questions = quiz.get("questions", [])
-    pending_battles[user_id] = {
+    pending_battles.set(user_id, {
         "battle_id": battle_id,
         "quiz_id": str(battle.get("quiz_id")),
         "questions": questions,
@@ -2685,12 +2859,23 @@ def _start_battle_quiz(user_id: int, battle_id: str):
         "title": quiz.get("title", "Quiz"),
         "challenger_id": battle.get("challenger_id"),
         "challenger_score": battle.get("challenger_score", 0),
-    }
+    })
 
     bot.send_message(user_id, f"⚔️ <b>Battle Challenge!</b>\n\nSomeone challenged you to a quiz battle!\n\nQuiz: <b>{quiz.get('title')}</b>\nQuestions: {len(questions)}", parse_mode="HTML")
     _send_battle_question(user_id)
 
 
+def _interactive_question(questions: list, idx: int, callback_prefix: str):
+    """Text and answer keyboard for question `idx` of a battle or shared quiz."""
+    q = questions[idx]
+    lines = [f"<b>Question {idx + 1}/{len(questions)}</b>\n", f"{q['question']}\n"]
+    lines.extend(f"{choice_label(i)}. {c}" for i, c in enumerate(q["choices"]))
+    kb = InlineKeyboardMarkup(row_width=2)
+    for i in range(len(q["choices"])):
+        kb.add(InlineKeyboardButton(choice_label(i), callback_data=f"{callback_prefix}_{i}"))
+    return "\n".join(lines) + "\n", kb
+
+
 def _send_battle_question(user_id: int):
     state = pending_battles.get(user_id)
     if not state:
@@ -2703,23 +2888,11 @@ def _send_battle_question(user_id: int):
         _finish_battle(user_id)
         return
 
-    q = questions[idx]
-    letters = ["A", "B", "C", "D"]
-    text = f"<b>Question {idx + 1}/{len(questions)}</b>\n\n"
-    text += f"{q['question']}\n\n"
-    for i, c in enumerate(q["choices"]):
-        prefix = letters[i] if i < len(letters) else str(i + 1)
-        text += f"{prefix}. {c}\n"
-
-    kb = InlineKeyboardMarkup(row_width=2)
-    for i in range(len(q["choices"])):
-        letter = letters[i] if i < len(letters) else str(i + 1)
-        kb.add(InlineKeyboardButton(letter, callback_data=f"ba_{i}"))
-
+    text, kb = _interactive_question(questions, idx, "ba")
     bot.send_message(user_id, text, parse_mode="HTML", reply_markup=kb)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("ba_"))
+@callback_route("ba")
 @error_handler
 def handle_battle_answer(call: CallbackQuery):
     user_id = call.from_user.id
@@ -2730,20 +2903,20 @@ def handle_battle_answer(call: CallbackQuery):
         return
 
     bot.answer_callback_query(call.id)
-    chosen = int(call.data.split("_")[1])
+    chosen = int(call.data.partition("_")[2])
     idx = state["current_index"]
     q = state["questions"][idx]
     correct = q.get("answer_index", -1)
 
-    letters = ["A", "B", "C", "D"]
     if chosen == correct:
         state["score"] += 1
         result_text = "✅ Correct!"
     else:
-        correct_letter = letters[correct] if correct < len(letters) else "?"
+        correct_letter = choice_label(correct) if 0 <= correct < len(q["choices"]) else "?"
         result_text = f"❌ Wrong! Answer: {correct_letter}"
 
     state["current_index"] += 1
+    pending_battles.set(user_id, state)
     try:
         bot.edit_message_text(
             f"{result_text}\n\nScore: {state['score']}/{state['current_index']}",
@@ -2757,7 +2930,8 @@ def handle_battle_answer(call: CallbackQuery):
 
 
 def _finish_battle(user_id: int):
-    state = pending_battles.pop(user_id, None)
+    state = pending_battles.get(user_id)
+    pending_battles.delete(user_id)
     if not state:
         return
 
@@ -2866,18 +3040,18 @@ def _start_shared_quiz(user_id: int, quiz_id: str):
     # Track play count
     quizzes_repo.increment_play_count(quiz_id)
 
-    pending_quizzes[user_id] = {
+    pending_quizzes.set(user_id, {
         "quiz_id": quiz_id,
         "questions": questions,
         "current_index": 0,
         "score": 0,
         "total": len(questions),
         "title": quiz.get("title", "Quiz"),
-    }
+    })
 
     owner_name = ""
     if quiz.get("user_id"):
-        owner = users_repo.get(quiz["user_id"]) if users_repo else None
+        owner = get_user_cached(quiz["user_id"])
         if owner:
             owner_name = f"\nCreated by: @{owner.get('username', 'unknown')}"
 
@@ -2904,23 +3078,11 @@ def _send_shared_question(user_id: int):
         _finish_shared_quiz(user_id)
         return
 
-    q = questions[idx]
-    letters = ["A", "B", "C", "D"]
-    text = f"<b>Question {idx + 1}/{len(questions)}</b>\n\n"
-    text += f"{q['question']}\n\n"
-    for i, c in enumerate(q["choices"]):
-        prefix = letters[i] if i < len(letters) else str(i + 1)
-        text += f"{prefix}. {c}\n"
-
-    kb = InlineKeyboardMarkup(row_width=2)
-    for i in range(len(q["choices"])):
-        letter = letters[i] if i < len(letters) else str(i + 1)
-        kb.add(InlineKeyboardButton(letter, callback_data=f"qa_{i}"))
-
+    text, kb = _interactive_question(questions, idx, "qa")
     bot.send_message(user_id, text, parse_mode="HTML", reply_markup=kb)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("qa_"))
+@callback_route("qa")
 @error_handler
 def handle_shared_quiz_answer(call: CallbackQuery):
     user_id = call.from_user.id
@@ -2931,17 +3093,16 @@ def handle_shared_quiz_answer(call: CallbackQuery):
         return
 
     bot.answer_callback_query(call.id)
-    chosen = int(call.data.split("_")[1])
+    chosen = int(call.data.partition("_")[2])
     idx = state["current_index"]
     q = state["questions"][idx]
     correct = q.get("answer_index", -1)
 
-    letters = ["A", "B", "C", "D"]
     if chosen == correct:
         state["score"] += 1
         result_text = "✅ Correct!"
     else:
-        correct_letter = letters[correct] if correct < len(letters) else "?"
+        correct_letter = choice_label(correct) if 0 <= correct < len(q["choices"]) else "?"
         result_text = f"❌ Wrong! Answer: {correct_letter}"
 
     explanation = q.get("explanation", "")
@@ -2949,6 +3110,7 @@ def handle_shared_quiz_answer(call: CallbackQuery):
         result_text += f"\n💡 {explanation}"
 
     state["current_index"] += 1
+    pending_quizzes.set(user_id, state)
     try:
         bot.edit_message_text(
             f"{result_text}\n\nScore: {state['score']}/{state['current_index']}",
@@ -2962,7 +3124,8 @@ def handle_shared_quiz_answer(call: CallbackQuery):
 
 
 def _finish_shared_quiz(user_id: int):
-    state = pending_quizzes.pop(user_id, None)
+    state = pending_quizzes.get(user_id)
+    pending_quizzes.delete(user_id)
     if not state:
         return
 
@@ -3005,5 +3168,19 @@ def _finish_shared_quiz(user_id: int):
 
 
 print("Bot running...")
+
+
 if __name__ == "__main__":
-    bot.infinity_polling()
+    # Resolve our own id/username once up front rather than on the first handler that needs it
+    get_bot_info()
+    if scheduler is not None:
+        scheduler.start()
+    # getUpdates is rejected while a webhook is registered (see app/webhook.py)
+    bot.remove_webhook()
+    bot.infinity_polling(
+        # HTTP timeout for getUpdates; must outlast the long-poll wait itself
+        timeout=cfg.long_polling_timeout + 10,
+        long_polling_timeout=cfg.long_polling_timeout,
+        skip_pending=True,
+        allowed_updates=ALLOWED_UPDATES,
+    )
@@ -14,6 +14,7 @@ class Config(BaseModel):
     bot_token: str = Field(default_factory=lambda: os.getenv("BOT_TOKEN", ""))
     mongo_uri: str = Field(default_factory=lambda: os.getenv("MONGO_URI", "mongodb://localhost:27017"))
     mongo_db: str = Field(default_factory=lambda: os.getenv("MONGO_DB", "quizbot"))
+    redis_url: str = Field(default_factory=lambda: os.getenv("REDIS_URL", ""))
     gemini_api_key: str = Field(default_factory=lambda: os.getenv("GEMINI_API_KEY", ""))
     owner_id: int = Field(default=1263404935)
 
@@ -30,6 +31,19 @@ class Config(BaseModel):
     question_type_default: str = Field(default_factory=lambda: os.getenv("QUESTION_TYPE_DEFAULT", "text"))
     maintenance_mode: bool = Field(default_factory=lambda: os.getenv("MAINTENANCE_MODE", "false").lower() == "true")
 
+    long_polling_timeout: int = Field(default_factory=lambda: int(os.getenv("LONG_POLLING_TIMEOUT", "20")))
+    worker_threads: int = Field(default_factory=lambda: int(os.getenv("WORKER_THREADS", "16")))
+    io_threads: int = Field(default_factory=lambda: int(os.getenv("IO_THREADS", "8")))
+    parse_processes: int = Field(default_factory=lambda: int(os.getenv("PARSE_PROCESSES", "2")))
+    gemini_concurrency: int = Field(default_factory=lambda: int(os.getenv("GEMINI_CONCURRENCY", "4")))
+    send_rate_limit: float = Field(default_factory=lambda: float(os.getenv("SEND_RATE_LIMIT", "25")))
+
+    # Webhook mode (python -m app.webhook); polling is used when WEBHOOK_URL is empty
+    webhook_url: str = Field(default_factory=lambda: os.getenv("WEBHOOK_URL", ""))
+    webhook_secret: str = Field(default_factory=lambda: os.getenv("WEBHOOK_SECRET", ""))
+    webhook_workers: int = Field(default_factory=lambda: int(os.getenv("WEBHOOK_WORKERS", "1")))
+    port: int = Field(default_factory=lambda: int(os.getenv("PORT", "8080")))
+
     premium_price: int = Field(default_factory=lambda: int(os.getenv("PREMIUM_PRICE", "30")))
     payment_channel: str = Field(default_factory=lambda: os.getenv("PAYMENT_CHANNEL", ""))
     telebirr_numbers: List[str] = Field(default_factory=lambda: [c.strip() for c in os.getenv("TELEBIRR_NUMBERS", "").split(",") if c.strip()])
@@ -16,7 +16,9 @@ def init_db() -> Tuple[MongoClient, Database]:
         return _client, _db
 
     cfg = get_config()
-    _client = MongoClient(cfg.mongo_uri)
+    # Keep one warm connection per handler worker so a burst after startup or
+    # an idle spell does not pay the TCP/TLS/auth handshake on the request path
+    _client = MongoClient(cfg.mongo_uri, minPoolSize=cfg.worker_threads)
     try:
         _client.admin.command("ping")
     except ConnectionFailure as exc:
@@ -28,13 +30,24 @@ def init_db() -> Tuple[MongoClient, Database]:
     _db["users"].create_index("id", unique=True)
     # Each user may have at most one key; keys must not be shared between users
     _db["users"].create_index("gemini_api_key", unique=True, sparse=True)
+    _db["users"].create_index("role")
+    # count_premium: equality on type, then the premium_until range
+    _db["users"].create_index([("type", 1), ("premium_until", 1)])
     _db["settings"].create_index("key", unique=True)
     _db["channels"].create_index([("user_id", 1), ("chat_id", 1)], unique=True)
     _db["payments"].create_index([("user_id", 1), ("time", 1)])
+    # Admin review list: pending payments, newest first
+    _db["payments"].create_index([("status", 1), ("time", -1)])
     _db["schedules"].create_index([("user_id", 1), ("scheduled_at", 1)])
+    # Scheduler poll: equality on status first, then the scheduled_at range/sort
+    _db["schedules"].create_index([("status", 1), ("scheduled_at", 1)])
     _db["files"].create_index([("user_id", 1), ("created_at", 1)])
     _db["stats"].create_index("key", unique=True)
     _db["quizzes"].create_index([("user_id", 1), ("created_at", 1)])
+    # get_user_battles ORs the two sides; each branch needs its own index
+    _db["battles"].create_index([("challenger_id", 1), ("created_at", -1)])
+    _db["battles"].create_index([("opponent_id", 1), ("created_at", -1)])
+    _db["progress"].create_index("user_id")
 
     return _client, _db
 
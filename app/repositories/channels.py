@@ -17,7 +17,8 @@ class ChannelsRepository:
         self.collection.delete_one({"user_id": user_id, "chat_id": chat_id})
 
     def list_channels(self, user_id: int) -> List[Dict[str, Any]]:
-        return list(self.collection.find({"user_id": user_id}))
+        # Only the fields the channel pickers render
+        return list(self.collection.find({"user_id": user_id}, {"_id": 0, "chat_id": 1, "title": 1, "username": 1}))
 
     def get_channel(self, user_id: int, chat_id: int) -> Optional[Dict[str, Any]]:
         return self.collection.find_one({"user_id": user_id, "chat_id": chat_id})
\ No newline at end of file
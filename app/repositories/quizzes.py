@@ -14,14 +14,21 @@ class QuizzesRepository:
         """
         if "created_at" not in quiz_data:
             quiz_data["created_at"] = datetime.now()
+        # Pre-rendered for list views so they don't format dates per row
+        quiz_data.setdefault("created_at_str", quiz_data["created_at"].strftime("%Y-%m-%d"))
         result = self.collection.insert_one(quiz_data)
         return str(result.inserted_id)
 
     def get_user_quizzes(self, user_id: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
         """
-        Retrieves quizzes for a user, sorted by creation date (newest first).
+        Retrieves quiz summaries (title, created_at, created_at_str) for a user, newest first.
+        The questions array is left on the server; use get_quiz for the full document.
         """
-        cursor = self.collection.find({"user_id": user_id}).sort("created_at", -1)
+        cursor = self.collection.find(
+            {"user_id": user_id},
+            {"title": 1, "created_at": 1, "created_at_str": 1},
+            batch_size=50,
+        ).sort("created_at", -1)
         if limit:
             cursor = cursor.limit(limit)
         return list(cursor)
@@ -32,8 +39,43 @@ class QuizzesRepository:
         except Exception:
             return None
 
+    def get_quiz_meta(self, quiz_id: str) -> Optional[Dict[str, Any]]:
+        """
+        A quiz without its questions: title, created_at, counters and
+        `question_count`, which the server computes from the array.
+        """
+        try:
+            return self.collection.find_one(
+                {"_id": ObjectId(quiz_id)},
+                {
+                    "title": 1,
+                    "created_at": 1,
+                    "share_count": 1,
+                    "play_count": 1,
+                    "question_count": {"$size": {"$ifNull": ["$questions", []]}},
+                },
+            )
+        except Exception:
+            return None
+
+    def get_many(self, quiz_ids: List[str], projection: Optional[Dict[str, Any]] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Fetches several quizzes in one round-trip, keyed by their string id.
+        Invalid or missing ids are simply absent from the result.
+        """
+        object_ids = []
+        for quiz_id in quiz_ids:
+            try:
+                object_ids.append(ObjectId(quiz_id))
+            except Exception:
+                continue
+        if not object_ids:
+            return {}
+        cursor = self.collection.find({"_id": {"$in": object_ids}}, projection, batch_size=100)
+        return {str(doc["_id"]): doc for doc in cursor}
+
     def count_all(self) -> int:
-        return self.collection.count_documents({})
+        return self.collection.estimated_document_count()
 
     def count_today(self) -> int:
         today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
@@ -1,19 +1,54 @@
+import copy
+import threading
 from typing import Any, Optional
+from cachetools import TTLCache
 from pymongo.database import Database
 
 
+_MISSING = object()
+# Settings are read on nearly every update (force-subscription checks) but change rarely
+_settings_cache: TTLCache = TTLCache(maxsize=256, ttl=30)
+_settings_cache_lock = threading.Lock()
+
+
 class SettingsRepository:
     def __init__(self, db: Database) -> None:
         self.collection = db["settings"]
 
     def get(self, key: str, default: Any | None = None) -> Any:
-        doc = self.collection.find_one({"key": key})
-        if not doc:
+        with _settings_cache_lock:
+            value = _settings_cache.get(key, None)
+        if value is None:
+            doc = self.collection.find_one({"key": key})
+            value = doc.get("value", _MISSING) if doc else _MISSING
+            with _settings_cache_lock:
+                _settings_cache[key] = value
+        if value is _MISSING:
             return default
-        return doc.get("value", default)
+        # Callers may mutate lists/dicts they get back
+        return copy.deepcopy(value)
+
+    def get_many(self, defaults: dict[str, Any]) -> dict[str, Any]:
+        """Values for every key in `defaults` (falling back to its value), with one query for the uncached ones."""
+        with _settings_cache_lock:
+            found = {key: _settings_cache.get(key) for key in defaults}
+        missing = [key for key, value in found.items() if value is None]
+        if missing:
+            fetched = {key: _MISSING for key in missing}
+            for doc in self.collection.find({"key": {"$in": missing}}):
+                fetched[doc["key"]] = doc.get("value", _MISSING)
+            with _settings_cache_lock:
+                _settings_cache.update(fetched)
+            found.update(fetched)
+        return {
+            key: default if found[key] is _MISSING else copy.deepcopy(found[key])
+            for key, default in defaults.items()
+        }
 
     def set(self, key: str, value: Any) -> None:
         self.collection.update_one({"key": key}, {"$set": {"value": value}}, upsert=True)
+        with _settings_cache_lock:
+            _settings_cache.pop(key, None)
 
     def all(self) -> list[dict]:
         return list(self.collection.find({}))
\ No newline at end of file
@@ -1,8 +1,48 @@
+import functools
+import re
+import threading
 from typing import Optional, Dict, Any
 from datetime import datetime, timedelta
+from cachetools import TTLCache
+from pymongo import ReturnDocument
 from pymongo.database import Database
 
 
+# Short-lived copy of user documents shared by every repository instance in
+# this process; writes through the repository drop the affected entry
+_user_cache: TTLCache = TTLCache(maxsize=10_000, ttl=30)
+_user_cache_lock = threading.RLock()
+# Admin ids change only via set_role/set_admin/revoke_admin, which clear this
+# process's copy at once. Other processes (WEBHOOK_WORKERS > 1) cannot be told,
+# so a role change reaches them when their copy expires, hence the short TTL.
+_admin_ids: TTLCache = TTLCache(maxsize=1, ttl=15)
+# Bumped on every clear; a lookup that raced a clear does not store its result
+_admin_ids_generation = 0
+
+
+def _invalidate(user_id: Any) -> None:
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+
+
+def _clear_admin_ids() -> None:
+    global _admin_ids_generation
+    with _user_cache_lock:
+        _admin_ids_generation += 1
+        _admin_ids.clear()
+
+
+def _invalidates(method):
+    """Drop the cached document of the method's `user_id` argument once it has written."""
+    @functools.wraps(method)
+    def wrapper(self, user_id, *args, **kwargs):
+        try:
+            return method(self, user_id, *args, **kwargs)
+        finally:
+            _invalidate(user_id)
+    return wrapper
+
+
 class UsersRepository:
     def __init__(self, db: Database) -> None:
         self.collection = db["users"]
@@ -10,6 +50,18 @@ class UsersRepository:
     def get(self, user_id: int) -> Optional[Dict[str, Any]]:
         return self.collection.find_one({"id": user_id})
 
+    def get_cached(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Like get(), but may return a document up to 30s old. Not for quota decisions."""
+        with _user_cache_lock:
+            if user_id in _user_cache:
+                doc = _user_cache[user_id]
+                return dict(doc) if doc is not None else None
+        doc = self.get(user_id)
+        with _user_cache_lock:
+            _user_cache[user_id] = doc
+        return dict(doc) if doc is not None else None
+
+    @_invalidates
     def upsert_user(self, user_id: int, username: Optional[str]) -> Dict[str, Any]:
         now = datetime.now()
         update = {
@@ -36,6 +88,7 @@ class UsersRepository:
         self.collection.update_one({"id": user_id}, update, upsert=True)
         return self.get(user_id) or {}
 
+    @_invalidates
     def set_referrer(self, user_id: int, referrer_id: int) -> bool:
         """Sets the referrer for a user if not already set. Returns True if successful."""
         # Prevent self-referral
@@ -56,9 +109,11 @@ class UsersRepository:
         if res.modified_count > 0:
             # Increment referrer's count
             self.collection.update_one({"id": referrer_id}, {"$inc": {"referral_count": 1}})
+            _invalidate(referrer_id)
             return True
         return False
     
+    @_invalidates
     def check_and_reward_referral_milestone(self, user_id: int, bot, settings_repo) -> bool:
         """
         Check if user reached a referral milestone and award premium.
@@ -111,6 +166,7 @@ class UsersRepository:
         user = self.get(user_id)
         return user.get("referral_count", 0) if user else 0
 
+    @_invalidates
     def set_premium(self, user_id: int, duration_days: int | None = None) -> None:
         now = datetime.now()
         update: Dict[str, Any] = {"type": "premium", "premium_since": now}
@@ -127,46 +183,66 @@ class UsersRepository:
             upsert=True,
         )
 
+    @_invalidates
     def set_user_type(self, user_id: int, user_type: str) -> None:
         self.collection.update_one({"id": user_id}, {"$set": {"type": user_type}})
 
+    @_invalidates
     def set_role(self, user_id: int, role: str) -> None:
         self.collection.update_one({"id": user_id}, {"$set": {"role": role}})
+        _clear_admin_ids()
 
-    def bump_notes_today(self, user_id: int) -> None:
-        self.collection.update_one({"id": user_id}, {"$inc": {"notes_today": 1}})
-
-    def bump_total_notes(self, user_id: int) -> None:
-        self.collection.update_one({"id": user_id}, {"$inc": {"total_notes": 1}})
+    @_invalidates
+    def try_claim_quota(self, user_id: int, daily_limit: int, cooldown_seconds: int = 0) -> Optional[Dict[str, Any]]:
+        """
+        Atomically reserve one of today's notes: checks the daily limit and the
+        cooldown, bumps notes_today/total_notes and stamps last_note_time in a
+        single findAndModify. Returns the updated user, or None if refused.
+        """
+        now = datetime.now()
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        cutoff = now - timedelta(seconds=cooldown_seconds)
+
+        # Same day: the running counter must still be under the limit
+        user = self.collection.find_one_and_update(
+            {"id": user_id, "notes_today": {"$lt": daily_limit}, "last_note_time": {"$gte": today, "$lte": cutoff}},
+            {"$set": {"last_note_time": now}, "$inc": {"notes_today": 1, "total_notes": 1}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if user is None and daily_limit > 0:
+            # First note of a new day (or ever): the counter restarts at 1.
+            # Older documents stored last_note_time as an ISO string, which no
+            # date comparison matches; treat those as a new day and let the
+            # $set below convert the field.
+            user = self.collection.find_one_and_update(
+                {"id": user_id, "$or": [
+                    {"last_note_time": None},
+                    {"last_note_time": {"$lt": today}},
+                    {"last_note_time": {"$type": "string"}},
+                ]},
+                {"$set": {"last_note_time": now, "notes_today": 1}, "$inc": {"total_notes": 1}},
+                return_document=ReturnDocument.AFTER,
+            )
+        return user
 
-    def set_last_note_time(self, user_id: int, when: datetime | None = None) -> None:
-        self.collection.update_one({"id": user_id}, {"$set": {"last_note_time": when or datetime.now()}})
+    @_invalidates
+    def release_quota(self, user_id: int) -> None:
+        """Give back a note reserved by try_claim_quota when generation produced nothing."""
+        self.collection.update_one(
+            {"id": user_id, "notes_today": {"$gt": 0}},
+            {"$inc": {"notes_today": -1, "total_notes": -1}},
+        )
 
+    @_invalidates
     def set_questions_per_note(self, user_id: int, value: int) -> None:
         self.collection.update_one({"id": user_id}, {"$set": {"questions_per_note": value}})
 
+    @_invalidates
     def set_default_qtype(self, user_id: int, qtype: str) -> None:
         self.collection.update_one({"id": user_id}, {"$set": {"default_question_type": qtype}})
 
-    def reset_notes_if_new_day(self, user_id: int) -> None:
-        user = self.get(user_id)
-        if not user:
-            return
-        last = user.get("last_note_time")
-        if not last:
-            return
-        if isinstance(last, str):
-            try:
-                last = datetime.fromisoformat(last)
-            except Exception:
-                last = None
-        if not last:
-            return
-        now = datetime.now()
-        if last.date() != now.date():
-            self.collection.update_one({"id": user_id}, {"$set": {"notes_today": 0}})
-
     # Gemini API key management
+    @_invalidates
     def set_gemini_api_key(self, user_id: int, api_key: str | None) -> None:
         update = {"$unset": {"gemini_api_key": ""}} if not api_key else {"$set": {"gemini_api_key": api_key}}
         self.collection.update_one({"id": user_id}, update, upsert=True)
@@ -176,13 +252,38 @@ class UsersRepository:
         key = doc.get("gemini_api_key")
         return key if isinstance(key, str) and key.strip() else None
 
+    @_invalidates
     def set_admin(self, user_id: int) -> None:
         self.collection.update_one({"id": user_id}, {"$set": {"role": "admin"}})
+        _clear_admin_ids()
 
+    @_invalidates
     def revoke_admin(self, user_id: int) -> None:
         self.collection.update_one({"id": user_id}, {"$set": {"role": "user"}})
+        _clear_admin_ids()
+
+    def _admin_id_set(self) -> frozenset:
+        with _user_cache_lock:
+            ids = _admin_ids.get("ids")
+            generation = _admin_ids_generation
+        if ids is None:
+            ids = frozenset(u["id"] for u in self.collection.find({"role": "admin"}, {"id": 1, "_id": 0}))
+            with _user_cache_lock:
+                # A role change during the query may not be reflected in `ids`; use it once, don't keep it
+                if generation == _admin_ids_generation:
+                    _admin_ids["ids"] = ids
+        return ids
+
+    def admin_ids(self) -> list[int]:
+        """Ids of users with the admin role, cached for a few seconds."""
+        return list(self._admin_id_set())
+
+    def is_admin_id(self, user_id: int) -> bool:
+        """Role check against the cached admin ids; most callers are not admins and cost no query."""
+        return user_id in self._admin_id_set()
 
     # --- Pending Referral ---
+    @_invalidates
     def set_pending_referrer(self, user_id: int, referrer_id: int) -> None:
         self.collection.update_one({"id": user_id}, {"$set": {"pending_referrer": referrer_id}}, upsert=True)
 
@@ -190,6 +291,7 @@ class UsersRepository:
         user = self.get(user_id)
         return user.get("pending_referrer") if user else None
 
+    @_invalidates
     def clear_pending_referrer(self, user_id: int) -> None:
         self.collection.update_one({"id": user_id}, {"$unset": {"pending_referrer": ""}})
 
@@ -201,13 +303,15 @@ class UsersRepository:
         username = username.lstrip("@").strip()
         return self.collection.find_one({"username": {"$regex": f"^{re.escape(username)}$", "$options": "i"}})
 
+    @_invalidates
     def update_blocked_status(self, user_id: int, is_blocked: bool) -> None:
         """Track whether a user has blocked the bot."""
         self.collection.update_one({"id": user_id}, {"$set": {"is_blocked": is_blocked}})
 
     # --- Analytics Aggregation ---
     def count_all(self) -> int:
-        return self.collection.count_documents({})
+        # Read from collection metadata instead of walking the _id index
+        return self.collection.estimated_document_count()
 
     def count_premium(self) -> int:
         now = datetime.now()
@@ -257,37 +361,38 @@ class UsersRepository:
         return self.collection.count_documents({"registered_at": {"$gte": week_ago}})
 
     # --- Streak Management ---
-    def update_streak(self, user_id: int) -> dict:
-        user = self.get(user_id) or {}
-        today = datetime.now().date()
-        last_date = user.get("streak_last_date")
-
-        current = user.get("streak_current", 0)
-        best = user.get("streak_best", 0)
-
-        if last_date:
-            if isinstance(last_date, datetime):
-                last_date = last_date.date()
-            elif isinstance(last_date, str):
-                try:
-                    last_date = datetime.fromisoformat(last_date).date()
-                except Exception:
-                    last_date = None
-
-        if last_date == today:
-            return {"current": current, "best": best}
-        elif last_date and (today - last_date).days == 1:
-            current += 1
-        else:
-            current = 1
-
-        best = max(best, current)
-        self.collection.update_one({"id": user_id}, {"$set": {
-            "streak_current": current,
-            "streak_best": best,
-            "streak_last_date": datetime.now(),
-        }})
-        return {"current": current, "best": best}
+    @_invalidates
+    def update_streak(self, user_id: int) -> Optional[dict]:
+        """
+        Count today towards the user's streak in one round-trip. Returns the
+        new streak, or None when today was already counted.
+        """
+        now = datetime.now()
+        today = now.date()
+        yesterday = today - timedelta(days=1)
+        # Compare calendar days as YYYY-MM-DD: dates stringify to ISO, and older
+        # documents stored streak_last_date as an ISO string already
+        last_day = {"$substrCP": [{"$convert": {"input": "$streak_last_date", "to": "string", "onNull": ""}}, 0, 10]}
+        # Filter skips users already stamped today; the pipeline continues or restarts the streak
+        user = self.collection.find_one_and_update(
+            {"id": user_id, "$expr": {"$lt": [last_day, today.isoformat()]}},
+            [
+                {"$set": {"streak_current": {"$cond": [
+                    {"$eq": [last_day, yesterday.isoformat()]},
+                    {"$add": [{"$ifNull": ["$streak_current", 0]}, 1]},
+                    1,
+                ]}}},
+                {"$set": {
+                    "streak_best": {"$max": [{"$ifNull": ["$streak_best", 0]}, "$streak_current"]},
+                    "streak_last_date": now,
+                }},
+            ],
+            projection={"streak_current": 1, "streak_best": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if user is None:
+            return None
+        return {"current": user["streak_current"], "best": user["streak_best"]}
 
     def get_streak_info(self, user_id: int) -> dict:
         user = self.get(user_id) or {}
@@ -0,0 +1,112 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Tuple
+from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
+from ..logger import logger
+
+
+# Telegram allows about 20 messages per minute into a single group/channel
+PER_CHAT_PER_MINUTE = 20
+# Message text is capped at 4096 characters; leave room for the separators
+TEXT_BATCH_LIMIT = 3900
+
+
+def batch_by_length(parts: List[str], limit: int = TEXT_BATCH_LIMIT, sep: str = "\n\n") -> List[List[int]]:
+    """Group consecutive `parts` (by index) so each group joined with `sep` stays within `limit`."""
+    groups: List[List[int]] = []
+    size = 0
+    for i, part in enumerate(parts):
+        if groups and size + len(sep) + len(part) <= limit:
+            groups[-1].append(i)
+            size += len(sep) + len(part)
+        else:
+            groups.append([i])
+            size = len(part)
+    return groups
+
+
+class DeliveryQueue:
+    """
+    Delayed sends on a single background thread.
+
+    Handlers push bot calls with a due time and return at once, instead of
+    sleeping between quiz questions on a handler worker. Items for the same
+    chat keep their order; the bot-wide rate is enforced by the send limiter.
+    """
+
+    def __init__(self, bot: TeleBot, per_chat_per_minute: int = PER_CHAT_PER_MINUTE) -> None:
+        self.bot = bot
+        self.per_chat_per_minute = per_chat_per_minute
+        self._heap: List[Tuple[float, int, Any, str, tuple, dict]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._recent: Dict[Any, Deque[float]] = defaultdict(deque)
+        self._thread: threading.Thread | None = None
+
+    def submit(self, delay: float, method: str, chat_id: Any, *args: Any, **kwargs: Any) -> None:
+        """Call `bot.<method>(chat_id, *args, **kwargs)` in `delay` seconds."""
+        self._push(time.monotonic() + delay, method, chat_id, args, kwargs)
+
+    def _push(self, due: float, method: str, chat_id: Any, args: tuple, kwargs: dict) -> None:
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._seq), chat_id, method, args, kwargs))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="delivery", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _chat_wait(self, chat_id: Any, now: float) -> float:
+        """Seconds until `chat_id` has per-minute budget again (0 if it has some now)."""
+        recent = self._recent[chat_id]
+        while recent and now - recent[0] >= 60:
+            recent.popleft()
+        if len(recent) < self.per_chat_per_minute:
+            return 0.0
+        return 60 - (now - recent[0])
+
+    def _forget_idle_chats(self, now: float) -> None:
+        for chat_id in [c for c, recent in self._recent.items() if now - recent[-1] >= 60]:
+            del self._recent[chat_id]
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                _, seq, chat_id, method, args, kwargs = heapq.heappop(self._heap)
+                now = time.monotonic()
+                wait = self._chat_wait(chat_id, now)
+                if wait > 0:
+                    # Keep the original sequence number so this chat's order is preserved
+                    heapq.heappush(self._heap, (now + wait, seq, chat_id, method, args, kwargs))
+                    continue
+                self._recent[chat_id].append(now)
+                if len(self._recent) > 1000:
+                    self._forget_idle_chats(now)
+            self._send(seq, chat_id, method, args, kwargs)
+
+    def _send(self, seq: int, chat_id: Any, method: str, args: tuple, kwargs: dict) -> None:
+        try:
+            getattr(self.bot, method)(chat_id, *args, **kwargs)
+        except ApiTelegramException as e:
+            retry_after = (e.result_json.get("parameters") or {}).get("retry_after")
+            if e.error_code == 429 and retry_after:
+                with self._cond:
+                    # Push this chat's queued items back too, so nothing overtakes the retry
+                    delay = float(retry_after)
+                    self._heap = [
+                        (d + delay if c == chat_id else d, s, c, m, a, k)
+                        for d, s, c, m, a, k in self._heap
+                    ]
+                    heapq.heapify(self._heap)
+                    heapq.heappush(self._heap, (time.monotonic() + delay, seq, chat_id, method, args, kwargs))
+                    self._cond.notify()
+                return
+            logger.error(f"Delivery {method} to {chat_id} failed: {e}")
+        except Exception as e:
+            logger.error(f"Delivery {method} to {chat_id} failed: {e}")
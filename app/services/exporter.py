@@ -1,31 +1,44 @@
-import io
-from typing import List, Dict
+import tempfile
+from typing import BinaryIO, List, Dict
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 from reportlab.lib.colors import lightgrey
 from docx import Document
 from docx.shared import Pt, RGBColor
 
+# Exports stay in memory up to this size, then spill to a temp file on disk
+SPOOL_MAX_SIZE = 2 * 1024 * 1024
+
+
+def _spool() -> BinaryIO:
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+
+
 class QuizExporter:
+    """Each exporter returns a rewound file object; the caller is responsible for closing it."""
+
     @staticmethod
-    def to_txt(title: str, questions: List[Dict], bot_username: str = "SmartQuizBot") -> io.BytesIO:
-        output = io.BytesIO()
-        text = f"Quiz: {title}\nGenerated by t.me/{bot_username}\n\n"
+    def to_txt(title: str, questions: List[Dict], bot_username: str = "SmartQuizBot") -> BinaryIO:
+        output = _spool()
+
+        def write(line: str) -> None:
+            output.write(line.encode('utf-8'))
+
+        write(f"Quiz: {title}\nGenerated by t.me/{bot_username}\n\n")
         for i, q in enumerate(questions, 1):
-            text += f"{i}. {q['question']}\n"
+            write(f"{i}. {q['question']}\n")
             for j, c in enumerate(q['choices']):
                 idx_char = chr(65 + j)
-                text += f"   {idx_char}. {c}\n"
-            text += "\n"
+                write(f"   {idx_char}. {c}\n")
+            write("\n")
         
-        text += "\n--- ANSWERS ---\n"
+        write("\n--- ANSWERS ---\n")
         for i, q in enumerate(questions, 1):
              ans_char = chr(65 + q['answer_index'])
-             text += f"{i}. {ans_char}\n"
+             write(f"{i}. {ans_char}\n")
              if q.get('explanation'):
-                 text += f"   Explanation: {q['explanation']}\n"
+                 write(f"   Explanation: {q['explanation']}\n")
         
-        output.write(text.encode('utf-8'))
         output.seek(0)
         return output
 
@@ -40,8 +53,8 @@ class QuizExporter:
         c.restoreState()
 
     @staticmethod
-    def to_pdf(title: str, questions: List[Dict], bot_username: str = "SmartQuizBot") -> io.BytesIO:
-        output = io.BytesIO()
+    def to_pdf(title: str, questions: List[Dict], bot_username: str = "SmartQuizBot") -> BinaryIO:
+        output = _spool()
         c = canvas.Canvas(output, pagesize=letter)
         width, height = letter
         watermark_text = f"t.me/{bot_username}"
@@ -100,7 +113,7 @@ class QuizExporter:
         return output
 
     @staticmethod
-    def to_docx(title: str, questions: List[Dict], bot_username: str = "SmartQuizBot") -> io.BytesIO:
+    def to_docx(title: str, questions: List[Dict], bot_username: str = "SmartQuizBot") -> BinaryIO:
         doc = Document()
         
         # Add Header
@@ -128,7 +141,7 @@ class QuizExporter:
             if q.get('explanation'):
                 p.add_run(f"\nExplanation: {q['explanation']}").italic = True
         
-        output = io.BytesIO()
+        output = _spool()
         doc.save(output)
         output.seek(0)
         return output
@@ -1,6 +1,12 @@
 import io
-from typing import List, Tuple
-from telebot import TeleBot
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+from telebot import TeleBot, apihelper
 from telebot.types import Message
 from pymongo.database import Database
 from datetime import datetime
@@ -9,6 +15,15 @@ from datetime import datetime
 MAX_FILE_MB = 20
 MAX_FILE_BYTES = MAX_FILE_MB * 1024 * 1024
 
+# Media waiting to be sent to Gemini is staged on disk under this prefix
+TEMP_MEDIA_PREFIX = "qgb_media_"
+TEMP_MEDIA_MAX_AGE = 2 * 60 * 60
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+PARSE_TIMEOUT_SECONDS = 120
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_parse_pool_lock = threading.Lock()
+
 
 def _read_pdf_bytes(data: bytes) -> str:
     try:
@@ -51,13 +66,79 @@ def _read_txt_bytes(data: bytes) -> str:
         return ""
 
 
-def chunk_text(text: str, max_chars: int = 4000) -> List[str]:
-    chunks: List[str] = []
+def _sweep_stale_media() -> None:
+    """Remove staged media left behind by abandoned conversations."""
+    tmp_dir = tempfile.gettempdir()
+    cutoff = time.time() - TEMP_MEDIA_MAX_AGE
+    try:
+        names = os.listdir(tmp_dir)
+    except OSError:
+        return
+    for name in names:
+        if not name.startswith(TEMP_MEDIA_PREFIX):
+            continue
+        path = os.path.join(tmp_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def download_to_tempfile(bot: TeleBot, file_id: str, suffix: str = "", max_bytes: int = MAX_FILE_BYTES) -> str:
+    """Stream a Telegram file to a temp file and return its path. Raises ValueError if empty or too big."""
+    _sweep_stale_media()
+    url = bot.get_file_url(file_id)
+    written = 0
+    fh = tempfile.NamedTemporaryFile(prefix=TEMP_MEDIA_PREFIX, suffix=suffix, delete=False)
+    try:
+        with fh, apihelper._get_req_session().get(url, stream=True, timeout=(15, 120)) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                written += len(chunk)
+                if written > max_bytes:
+                    raise ValueError(f"File exceeds {MAX_FILE_MB} MB.")
+                fh.write(chunk)
+        if written == 0:
+            raise ValueError("Download returned empty data")
+    except Exception:
+        remove_tempfile(fh.name)
+        raise
+    return fh.name
+
+
+def remove_tempfile(path: Optional[str]) -> None:
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def sliding_chunk_count(length: int, size: int = 3500, stride: int = 2625) -> int:
+    """How many chunks `iter_sliding_chunks` yields for a stripped text of `length` chars."""
+    if length <= 0:
+        return 0
+    if length <= size:
+        return 1
+    return -(-(length - size) // stride) + 1
+
+
+def iter_sliding_chunks(text: str, size: int = 3500, stride: int = 2625) -> Iterator[str]:
+    """
+    Overlapping windows of `size` chars every `stride` chars, so facts on a boundary appear whole in one chunk.
+    Lazy: callers that stop early never slice the rest of the text.
+    """
     buf = text.strip()
-    while buf:
-        chunks.append(buf[:max_chars])
-        buf = buf[max_chars:]
-    return chunks
+    if not buf:
+        return
+    start = 0
+    while True:
+        yield buf[start:start + size]
+        if start + size >= len(buf):
+            return
+        start += stride
 
 
 def save_file_record(db: Database, user_id: int, file_id: str, file_name: str, file_size: int, mime_type: str) -> str:
@@ -73,6 +154,33 @@ def save_file_record(db: Database, user_id: int, file_id: str, file_name: str, f
     return str(res.inserted_id)
 
 
+def parse_document_bytes(file_bytes: bytes, mime_type: str, file_name: str) -> str:
+    """Pick a reader from the MIME type or extension; falls back to plain text."""
+    mime = mime_type.lower()
+    name = file_name.lower()
+    if "pdf" in mime or name.endswith(".pdf"):
+        return _read_pdf_bytes(file_bytes)
+    if "word" in mime or "docx" in mime or name.endswith(".docx"):
+        return _read_docx_bytes(file_bytes)
+    if "powerpoint" in mime or "presentation" in mime or name.endswith((".ppt", ".pptx")):
+        return _read_ppt_bytes(file_bytes)
+    return _read_txt_bytes(file_bytes)
+
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    """PDF/DOCX/PPTX parsing is pure-Python CPU work; run it in processes so it does not hold the GIL."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            from ..config import get_config
+            # spawn, not fork: the bot process is full of threads holding locks
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=get_config().parse_processes,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _parse_pool
+
+
 def fetch_and_parse_file(bot: TeleBot, db: Database, message: Message) -> Tuple[str, str]:
     """Return (content_text, file_name). Raises ValueError on invalid/too-big or unknown type."""
     if not message.document:
@@ -82,19 +190,9 @@ def fetch_and_parse_file(bot: TeleBot, db: Database, message: Message) -> Tuple[
         raise ValueError("File exceeds 20 MB. Please split it and send again.")
     file_info = bot.get_file(doc.file_id)
     file_bytes = bot.download_file(file_info.file_path)
-    if doc.mime_type and "pdf" in doc.mime_type.lower():
-        text = _read_pdf_bytes(file_bytes)
-    elif doc.file_name and doc.file_name.lower().endswith(".pdf"):
-        text = _read_pdf_bytes(file_bytes)
-    elif doc.mime_type and ("word" in doc.mime_type.lower() or "docx" in doc.mime_type.lower()):
-        text = _read_docx_bytes(file_bytes)
-    elif doc.file_name and doc.file_name.lower().endswith(".docx"):
-        text = _read_docx_bytes(file_bytes)
-    elif doc.mime_type and ("powerpoint" in doc.mime_type.lower() or "presentation" in doc.mime_type.lower()) or (doc.file_name and doc.file_name.lower().endswith((".ppt", ".pptx"))):
-        text = _read_ppt_bytes(file_bytes)
-    else:
-        # treat as text
-        text = _read_txt_bytes(file_bytes)
+    text = _get_parse_pool().submit(
+        parse_document_bytes, file_bytes, doc.mime_type or "", doc.file_name or ""
+    ).result(timeout=PARSE_TIMEOUT_SECONDS)
     if not text.strip():
         raise ValueError("Failed to parse file content.")
     save_file_record(db, message.from_user.id, doc.file_id, doc.file_name or "file", doc.file_size or 0, doc.mime_type or "")
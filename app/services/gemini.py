@@ -1,11 +1,28 @@
-from typing import List, Dict, Optional
-import json
+from typing import Dict, Iterable, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import itertools
 import base64
+import hashlib
+import threading
+import orjson
+from cachetools import TTLCache
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 from ..config import get_config
 from ..repositories.users import UsersRepository
 from ..db import get_db
+from .state_store import StateStore
+
+
+# Identical requests (same note/file/media and options) reuse earlier questions for a few hours
+_question_cache = StateStore("questions", ttl=4 * 3600)
+
+# Re-sent keys skip the Gemini round-trip while their verdict is fresh
+_key_verdicts: TTLCache = TTLCache(maxsize=1024, ttl=300)
+_key_verdicts_lock = threading.Lock()
+# Responses that mean the key itself is bad (invalid, unauthorized, no access)
+_KEY_REJECTED_CODES = (400, 401, 403)
 
 def _choose_api_key(user_id: Optional[int]) -> Optional[str]:
     """Return user's own Gemini key if set; otherwise fallback to global, if any."""
@@ -21,6 +38,31 @@ def _choose_api_key(user_id: Optional[int]) -> Optional[str]:
         api_key = cfg.gemini_api_key or None
     return api_key
 
+@functools.lru_cache(maxsize=256)
+def get_client(api_key: str) -> genai.Client:
+    """One client per key, so its HTTP connection pool is reused across requests."""
+    return genai.Client(api_key=api_key)
+
+
+def _file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _question_cache_key(note: str, num_questions: int, media_data: Optional[bytes], media_path: Optional[str], **options) -> str:
+    if media_path:
+        source = _file_digest(media_path)
+    elif media_data:
+        source = hashlib.sha256(media_data).hexdigest()
+    else:
+        source = hashlib.sha256(note.encode()).hexdigest()
+    key = orjson.dumps({"src": source, "n": num_questions, **options}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(key).hexdigest()
+
+
 def generate_questions(
     note: str,
     num_questions: int = 5,
@@ -31,6 +73,7 @@ def generate_questions(
     topic_title: Optional[str] = None,
     difficulty: str = "Medium",
     media_data: Optional[bytes] = None,
+    media_path: Optional[str] = None,
     mime_type: Optional[str] = None,
     question_type: str = "multiple_choice"
 ) -> List[Dict]:
@@ -39,7 +82,20 @@ def generate_questions(
         return []
 
     try:
-        client = genai.Client(api_key=api_key)
+        cache_key = _question_cache_key(
+            note or "", num_questions, media_data, media_path,
+            title_only=title_only, allow_beyond=allow_beyond, topic_title=topic_title or "",
+            difficulty=difficulty, mime_type=mime_type or "", question_type=question_type,
+        )
+        cached = _question_cache.get(cache_key)
+    except Exception:
+        cache_key, cached = None, None
+    if cached:
+        return cached["questions"]
+
+    uploaded = None
+    try:
+        client = get_client(api_key)
         
         safe_note = note or ""
         safe_title = topic_title or ""
@@ -73,7 +129,15 @@ Source:
 """.strip()
 
         contents = []
-        if media_data and mime_type:
+        if media_path and mime_type:
+            # Files API uploads stream from disk, so large audio never sits in memory
+            uploaded = client.files.upload(file=media_path, config={"mime_type": mime_type})
+            media_part = types.Part.from_uri(file_uri=uploaded.uri, mime_type=uploaded.mime_type or mime_type)
+        elif media_data and mime_type:
+            media_part = types.Part.from_bytes(data=media_data, mime_type=mime_type)
+        else:
+            media_part = None
+        if media_part is not None:
             # For media (audio/video), provide better context
             media_context = "Analyze the audio/video content below and generate questions based on what is discussed, explained, or presented in the media."
             if safe_title:
@@ -81,7 +145,7 @@ Source:
             
             contents.append(types.Content(
                 parts=[
-                    types.Part.from_bytes(data=media_data, mime_type=mime_type),
+                    media_part,
                     types.Part.from_text(text=f"{media_context}\n\n{prompt_text}")
                 ]
             ))
@@ -110,12 +174,12 @@ Source:
             end_idx = text.rfind(']')
             if start_idx != -1 and end_idx != -1:
                 cleaned = text[start_idx:end_idx+1]
-                parsed = json.loads(cleaned)
+                parsed = orjson.loads(cleaned)
             else:
                 # Fallback to simple strip/replace
                 cleaned = text.replace("```json", "").replace("```", "").strip()
-                parsed = json.loads(cleaned)
-        except (ValueError, json.JSONDecodeError):
+                parsed = orjson.loads(cleaned)
+        except ValueError:
             print(f"Failed to parse Gemini response: {text[:200]}")
             return []
         
@@ -125,24 +189,85 @@ Source:
             if isinstance(q, dict)
             and all(k in q for k in ("question", "choices", "answer_index", "explanation"))
         ]
+        if validated and cache_key:
+            try:
+                _question_cache.set(cache_key, {"questions": validated})
+            except Exception:
+                pass
         return validated
 
     except Exception as e:
         print(f"Gemini API Error: {e}")
         return []
+    finally:
+        if uploaded is not None:
+            try:
+                client.files.delete(name=uploaded.name)
+            except Exception:
+                pass
+
+def generate_from_chunks(chunks: Iterable[str], num_questions: int, chunk_count: Optional[int] = None, **kwargs) -> List[Dict]:
+    """
+    Spread `num_questions` over `chunks`, calling Gemini for several chunks at once.
+
+    Chunks are taken in order and in waves just big enough to cover the
+    questions still missing, so a long file with a small quota does not fan
+    out to every chunk. `chunks` may be a lazy iterator (pass `chunk_count`
+    then); chunks after the quota is met are never produced. Results keep
+    chunk order.
+    """
+    if chunk_count is None:
+        chunks = list(chunks)
+        chunk_count = len(chunks)
+    chunks = iter(chunks)
+    per_chunk = max(1, num_questions // max(1, chunk_count))
+    max_workers = max(1, get_config().gemini_concurrency)
+    questions: List[Dict] = []
+    seen = set()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini") as pool:
+        while len(questions) < num_questions:
+            missing = num_questions - len(questions)
+            wave = list(itertools.islice(chunks, min(max_workers, -(-missing // per_chunk))))
+            if not wave:
+                break
+            for batch in pool.map(lambda ch: generate_questions(ch, per_chunk, **kwargs), wave):
+                for q in batch:
+                    # Overlapping chunks can yield the same question twice
+                    stem = " ".join(str(q["question"]).lower().split())[:80]
+                    if stem not in seen:
+                        seen.add(stem)
+                        questions.append(q)
+    del questions[num_questions:]
+    return questions
+
 
 def validate_gemini_api_key(api_key: str) -> bool:
-    """Validate a Gemini key with a minimal request."""
+    """Validate a Gemini key with a minimal request; verdicts are reused for a few minutes."""
     api_key = (api_key or "").strip()
     if not api_key:
         return False
-    
+    # Keyed by digest so raw keys are not kept around in memory
+    digest = hashlib.sha256(api_key.encode()).hexdigest()
+    with _key_verdicts_lock:
+        cached = _key_verdicts.get(digest)
+    if cached is not None:
+        return cached
+
     try:
         client = genai.Client(api_key=api_key)
         client.models.generate_content(
             model="gemini-2.5-flash",
             contents="Return empty JSON array: []",
         )
-        return True
+        ok = True
+    except errors.ClientError as e:
+        # A rate limit (429) or other client error says nothing about the key itself
+        if e.code not in _KEY_REJECTED_CODES:
+            return False
+        ok = False
     except Exception:
-        return False
\ No newline at end of file
+        # Network or server trouble: refuse this time, but ask again next time
+        return False
+    with _key_verdicts_lock:
+        _key_verdicts[digest] = ok
+    return ok
@@ -0,0 +1,28 @@
+import requests
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
+from urllib3.util import Retry
+
+
+def build_session(pool_size: int) -> requests.Session:
+    """
+    A keep-alive session whose connection pool is large enough for `pool_size`
+    concurrent callers. Only failures to connect are retried: telebot sends
+    sendPoll/copyMessage as GET, so retrying a read timeout or a 5xx could
+    deliver the same message twice.
+    """
+    session = requests.Session()
+    retry = Retry(total=None, connect=3, read=0, status=0, other=0, redirect=0, backoff_factor=0.2)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def install_telegram_session(pool_size: int) -> requests.Session:
+    """Make every telebot thread share one pooled session instead of one per thread."""
+    session = build_session(pool_size)
+    apihelper.session = session
+    # The default TTL rebuilds each thread's session every 10 minutes, dropping warm connections
+    apihelper.SESSION_TIME_TO_LIVE = None
+    return session
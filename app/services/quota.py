@@ -16,29 +16,51 @@ def is_premium(user_doc: dict) -> bool:
     return True
 
 
-def has_quota(db: Database, user_id: int) -> bool:
+def daily_note_limit(user: dict) -> int:
     cfg = get_config()
-    users_repo = UsersRepository(db)
-    user = users_repo.get(user_id) or {}
-    
     # If user has personal Gemini key, use custom key limit
     personal_key = user.get("gemini_api_key")
     if personal_key and str(personal_key).strip():
-        max_notes = cfg.max_notes_custom_key
-    else:
-        # Standard limits
-        is_prem = is_premium(user)
-        max_notes = cfg.max_notes_premium if is_prem else cfg.max_notes_regular
-        
-    return int(user.get("notes_today", 0)) < int(max_notes)
+        return int(cfg.max_notes_custom_key)
+    # Standard limits
+    return int(cfg.max_notes_premium if is_premium(user) else cfg.max_notes_regular)
 
 
-def increment_quota(db: Database, user_id: int) -> None:
-    UsersRepository(db).bump_notes_today(user_id)
+def notes_used_today(user: dict) -> int:
+    last = user.get("last_note_time")
+    # notes_today belongs to the day of the last note, so it no longer counts once that day is over
+    if isinstance(last, datetime) and last.date() != datetime.now().date():
+        return 0
+    # Legacy ISO-string stamps are a new day to try_claim_quota too, which then rewrites them as dates
+    if isinstance(last, str):
+        return 0
+    return int(user.get("notes_today", 0))
 
 
-def increase_total_notes(db: Database, user_id: int) -> None:
-    UsersRepository(db).bump_total_notes(user_id)
+def has_quota(db: Database, user_id: int, user: dict | None = None) -> bool:
+    """Read-only check for menus; claim_note is what actually enforces the limit."""
+    if user is None:
+        user = UsersRepository(db).get(user_id) or {}
+    return notes_used_today(user) < daily_note_limit(user)
+
+
+def claim_note(db: Database, user_id: int, user: dict | None = None, cooldown_seconds: int = 10) -> str | None:
+    """
+    Atomically reserve one note for user_id. Returns None on success, otherwise
+    "cooldown" (last note was under cooldown_seconds ago) or "quota".
+    """
+    users_repo = UsersRepository(db)
+    if user is None:
+        user = users_repo.get(user_id) or {}
+    if users_repo.try_claim_quota(user_id, daily_note_limit(user), cooldown_seconds) is not None:
+        return None
+    if not can_submit_note_now(db, user_id, cooldown_seconds):
+        return "cooldown"
+    return "quota"
+
+
+def release_note(db: Database, user_id: int) -> None:
+    UsersRepository(db).release_quota(user_id)
 
 
 def can_submit_note_now(db: Database, user_id: int, cooldown_seconds: int = 10) -> bool:
@@ -53,11 +75,3 @@ def can_submit_note_now(db: Database, user_id: int, cooldown_seconds: int = 10)
         except Exception:
             return True
     return datetime.now() - last >= timedelta(seconds=cooldown_seconds)
-
-
-def update_last_note_time(db: Database, user_id: int) -> None:
-    UsersRepository(db).set_last_note_time(user_id)
-
-
-def reset_notes_if_new_day(db: Database, user_id: int) -> None:
-    UsersRepository(db).reset_notes_if_new_day(user_id)
\ No newline at end of file
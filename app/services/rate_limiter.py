@@ -0,0 +1,60 @@
+import threading
+import time
+from telebot import apihelper
+
+
+# Bot API methods that deliver a message to a chat and count against Telegram's flood limits
+SEND_METHODS = (
+    "sendMessage", "sendPoll", "sendDocument", "sendPhoto", "sendVideo",
+    "sendAudio", "sendVoice", "sendAnimation", "sendMediaGroup",
+    "copyMessage", "forwardMessage",
+)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Consume `tokens` if available right now; never blocks."""
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        """Block until `tokens` are available, then consume them."""
+        while True:
+            with self.lock:
+                self._refill(time.monotonic())
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def install_send_limiter(rate: float) -> TokenBucket:
+    """
+    Route every outgoing send* request through a shared token bucket so the
+    bot as a whole stays under `rate` messages per second.
+    """
+    bucket = TokenBucket(rate)
+
+    def limited_request(method, url, **kwargs):
+        if url.rsplit("/", 1)[-1] in SEND_METHODS:
+            bucket.acquire()
+        return apihelper._get_req_session().request(method, url, **kwargs)
+
+    apihelper.CUSTOM_REQUEST_SENDER = limited_request
+    return bucket
@@ -2,16 +2,18 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from datetime import datetime
 from telebot import TeleBot
-import time
 from pymongo.database import Database
-from ..services.gemini import generate_questions
-from ..services.file_parser import chunk_text
+from ..services.gemini import generate_questions, generate_from_chunks
+from ..services.file_parser import iter_sliding_chunks, sliding_chunk_count
+from ..services.delivery import DeliveryQueue, batch_by_length
+from ..utils import EXPLANATION_LIMIT, format_question
 
 
 class QuizScheduler:
-    def __init__(self, db: Database, bot: TeleBot) -> None:
+    def __init__(self, db: Database, bot: TeleBot, delivery: DeliveryQueue) -> None:
         self.db = db
         self.bot = bot
+        self.delivery = delivery
         self.schedules = db["schedules"]
         self.scheduler = BackgroundScheduler()
 
@@ -44,15 +46,9 @@ class QuizScheduler:
                 allow_beyond = bool(sched.get("allow_beyond", False))
                 user_id = int(sched.get("user_id"))
                 if file_content:
-                    chunks = chunk_text(file_content, max_chars=3500)
-                    per_chunk = max(1, num // max(1, len(chunks)))
-                    questions = []
-                    for idx, ch in enumerate(chunks):
-                        if len(questions) >= num:
-                            break
-                        qbatch = generate_questions(ch, per_chunk, user_id=user_id, title_only=False, allow_beyond=True)
-                        questions.extend(qbatch)
-                    questions = questions[:num]
+                    chunks = iter_sliding_chunks(file_content, size=3500, stride=2625)
+                    chunk_count = sliding_chunk_count(len(file_content.strip()), size=3500, stride=2625)
+                    questions = generate_from_chunks(chunks, num, chunk_count=chunk_count, user_id=user_id, title_only=False, allow_beyond=True)
                 elif title:
                     questions = generate_questions("", num, user_id=user_id, title_only=True, allow_beyond=True, topic_title=title)
                 else:
@@ -61,34 +57,33 @@ class QuizScheduler:
                     self.schedules.update_one({"_id": sched["_id"]}, {"$set": {"status": "failed"}})
                     continue
 
-                letters = ["A", "B", "C", "D"]
-                for idx, q in enumerate(questions, start=1):
-                    time.sleep(delay)
-                    if qtype == "text":
-                        text = f"{idx}. {q['question']}\n"
-                        for i, c in enumerate(q["choices"]):
-                            prefix = letters[i] if i < len(letters) else str(i + 1)
-                            text += f"{prefix}. {c}\n"
-                        text += f"\nCorrect Answer: {letters[q['answer_index']]} - {q['choices'][q['answer_index']]}"
-                        explanation = (q.get("explanation") or "")
-                        if explanation:
-                            text += f"\nExplanation: {explanation[:195]}"
-                        self.bot.send_message(target, text)
-                    else:
-                        self.bot.send_poll(
+                sends = 0
+                if qtype == "text":
+                    rendered = [format_question(idx, q, html=False) for idx, q in enumerate(questions, start=1)]
+                    for group in batch_by_length(rendered):
+                        sends += 1
+                        self.delivery.submit(sends * delay, "send_message", target, "\n\n".join(rendered[i] for i in group))
+                else:
+                    for q in questions:
+                        sends += 1
+                        self.delivery.submit(
+                            sends * delay,
+                            "send_poll",
                             target,
                             q["question"],
                             q["choices"],
                             type="quiz",
                             correct_option_id=q["answer_index"],
-                            explanation=(q.get("explanation") or "")[:195],
+                            explanation=(q.get("explanation") or "")[:EXPLANATION_LIMIT],
                         )
 
                 self.schedules.update_one({"_id": sched["_id"]}, {"$set": {"status": "sent"}})
-                # Send summary to user
-                try:
-                    self.bot.send_message(user_id, f"✅ Scheduled quiz posted: {len(questions)} questions to {sched.get('target_label','PM')}")
-                except Exception:
-                    pass
+                # Summary follows the last queued question
+                self.delivery.submit(
+                    sends * delay + 1,
+                    "send_message",
+                    user_id,
+                    f"✅ Scheduled quiz posted: {len(questions)} questions to {sched.get('target_label','PM')}",
+                )
             except Exception:
                 self.schedules.update_one({"_id": sched["_id"]}, {"$set": {"status": "failed"}})
\ No newline at end of file
@@ -0,0 +1,89 @@
+import threading
+import time
+from typing import Any, Optional
+import msgpack
+from cachetools import TLRUCache
+from ..config import get_config
+
+
+_redis = None
+
+# Without Redis, each namespace keeps at most this many live entries in memory
+LOCAL_MAX_ENTRIES = 10_000
+
+
+def get_redis():
+    """Shared Redis client, or None when REDIS_URL is not configured."""
+    global _redis
+    if _redis is None:
+        url = get_config().redis_url
+        if not url:
+            return None
+        import redis
+        _redis = redis.Redis.from_url(url, decode_responses=False)
+    return _redis
+
+
+class StateStore:
+    """
+    Per-user conversation state with a TTL.
+
+    Values are msgpack-encoded dicts stored under `ptb:{namespace}:{user_id}`
+    in Redis when REDIS_URL is set, otherwise in a process-local cache that
+    drops expired entries and, past LOCAL_MAX_ENTRIES, the least recently
+    used ones. Either way `get` returns a fresh copy, so callers must `set`
+    after mutating it.
+    """
+
+    def __init__(self, namespace: str, ttl: int = 1800, max_entries: int = LOCAL_MAX_ENTRIES) -> None:
+        self.namespace = namespace
+        self.ttl = ttl
+        # Entries are (expires_at, raw); abandoned flows age out without being read again
+        self._local: TLRUCache = TLRUCache(maxsize=max_entries, ttu=lambda _key, entry, _now: entry[0], timer=time.monotonic)
+        self._lock = threading.Lock()
+
+    def _key(self, user_id: Any) -> str:
+        return f"ptb:{self.namespace}:{user_id}"
+
+    def get(self, user_id: Any) -> Optional[dict]:
+        key = self._key(user_id)
+        r = get_redis()
+        if r is not None:
+            raw = r.get(key)
+        else:
+            with self._lock:
+                entry = self._local.get(key)
+            raw = entry[1] if entry else None
+        if raw is None:
+            return None
+        return msgpack.unpackb(raw, raw=False, strict_map_key=False)
+
+    def set(self, user_id: Any, state: dict, ex: Optional[int] = None) -> None:
+        key = self._key(user_id)
+        ttl = ex or self.ttl
+        raw = msgpack.packb(state, use_bin_type=True)
+        r = get_redis()
+        if r is not None:
+            r.set(key, raw, ex=ttl)
+            return
+        with self._lock:
+            self._local[key] = (time.monotonic() + ttl, raw)
+
+    def update(self, user_id: Any, **fields: Any) -> dict:
+        """Merge `fields` into the user's state (creating it if absent) and save it."""
+        state = self.get(user_id) or {}
+        state.update(fields)
+        self.set(user_id, state)
+        return state
+
+    def delete(self, user_id: Any) -> None:
+        key = self._key(user_id)
+        r = get_redis()
+        if r is not None:
+            r.delete(key)
+            return
+        with self._lock:
+            self._local.pop(key, None)
+
+    def __contains__(self, user_id: Any) -> bool:
+        return self.get(user_id) is not None
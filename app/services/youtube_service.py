@@ -3,10 +3,12 @@ import os
 import glob
 import time
 import shutil
+import tempfile
 import traceback
 from typing import Tuple, Optional, Iterable
 import yt_dlp
 from yt_dlp.utils import DownloadError
+from .file_parser import TEMP_MEDIA_PREFIX
 
 # -----------------------
 # Configuration / constants
@@ -251,21 +253,22 @@ def _attempt_download_with_format(url: str, fmt: str, outtmpl: str, has_ffmpeg:
         return None
 
 
-def download_audio(url: str, max_audio_mb: int = DEFAULT_MAX_AUDIO_MB, headers: Optional[dict] = None) -> Tuple[Optional[bytes], Optional[str]]:
+def download_audio_file(url: str, max_audio_mb: int = DEFAULT_MAX_AUDIO_MB, headers: Optional[dict] = None) -> Tuple[Optional[str], Optional[str]]:
     """
     Robust audio downloader:
      - tries multiple format fallback orders
      - sets headers to reduce 403s
      - converts to small mp3 if ffmpeg available
-    Returns (bytes, mime) or (None, None)
+    Each call downloads into its own temp directory, so concurrent downloads never
+    see each other's files. Returns (path, mime) or (None, None); the caller owns
+    the returned file and must remove it.
     """
     if headers is None:
         headers = HTTP_HEADERS
 
-    cleanup_temp_files()
-
     has_ffmpeg = is_ffmpeg_available()
-    outtmpl = TEMP_AUDIO_PREFIX  # yt-dlp will append extension
+    work_dir = tempfile.mkdtemp(prefix="qgb_yt_")
+    outtmpl = os.path.join(work_dir, TEMP_AUDIO_PREFIX)  # yt-dlp will append extension
 
     format_candidates = [
         "bestaudio[ext=m4a]/bestaudio[ext=webm]/bestaudio/best",
@@ -274,12 +277,15 @@ def download_audio(url: str, max_audio_mb: int = DEFAULT_MAX_AUDIO_MB, headers:
         "best",
     ]
 
-    for fmt in format_candidates:
-        ok = _attempt_download_with_format(url, fmt, outtmpl, has_ffmpeg, headers)
-        if ok:
-            files = [f for f in glob.glob(f"{TEMP_AUDIO_PREFIX}*") if not f.endswith(".part") and ".part-" not in f]
+    try:
+        for fmt in format_candidates:
+            ok = _attempt_download_with_format(url, fmt, outtmpl, has_ffmpeg, headers)
+            if not ok:
+                continue
+            pattern = os.path.join(work_dir, f"{TEMP_AUDIO_PREFIX}*")
+            files = [f for f in glob.glob(pattern) if not f.endswith(".part") and ".part-" not in f]
             if not files:
-                cleanup_temp_files()
+                cleanup_temp_files(pattern)
                 continue
 
             files.sort(key=os.path.getmtime, reverse=True)
@@ -288,47 +294,39 @@ def download_audio(url: str, max_audio_mb: int = DEFAULT_MAX_AUDIO_MB, headers:
             try:
                 size_bytes = os.path.getsize(fp)
             except Exception:
-                cleanup_temp_files()
-                continue
-
-            if size_bytes > max_audio_mb * 1024 * 1024:
-                cleanup_temp_files()
+                cleanup_temp_files(pattern)
                 continue
 
-            if size_bytes == 0:
-                cleanup_temp_files()
+            if size_bytes > max_audio_mb * 1024 * 1024 or size_bytes == 0:
+                cleanup_temp_files(pattern)
                 continue
 
-            try:
-                with open(fp, "rb") as fh:
-                    data = fh.read()
-            except Exception:
-                cleanup_temp_files()
-                continue
-            finally:
-                cleanup_temp_files()
+            ext = os.path.splitext(fp)[1].lower()
+            fd, staged = tempfile.mkstemp(prefix=TEMP_MEDIA_PREFIX, suffix=ext)
+            os.close(fd)
+            shutil.move(fp, staged)
 
             if has_ffmpeg:
-                return data, "audio/mp3"
-            else:
-                ext = os.path.splitext(fp)[1].lower()
-                mime_map = {".webm": "audio/webm", ".m4a": "audio/mp4", ".mp4": "audio/mp4", ".opus": "audio/opus", ".mp3": "audio/mp3", ".ogg": "audio/ogg"}
-                return data, mime_map.get(ext, "audio/octet-stream")
+                return staged, "audio/mp3"
+            mime_map = {".webm": "audio/webm", ".m4a": "audio/mp4", ".mp4": "audio/mp4", ".opus": "audio/opus", ".mp3": "audio/mp3", ".ogg": "audio/ogg"}
+            return staged, mime_map.get(ext, "audio/octet-stream")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
     print("Audio download failed for all format fallbacks.")
-    cleanup_temp_files()
     return None, None
 
 
 # -----------------------
 # Public function (keeps same return signature)
 # -----------------------
-def get_youtube_transcript(url: str, max_audio_mb: int = DEFAULT_MAX_AUDIO_MB) -> Tuple[Optional[str], Optional[bytes], Optional[str], Optional[str], Optional[str]]:
+def get_youtube_content(url: str, max_audio_mb: int = DEFAULT_MAX_AUDIO_MB) -> Tuple[Optional[str], Optional[str], Optional[str], Optional[str], Optional[str]]:
     """
     Main convenience function:
-      returns (transcript_text, audio_bytes, mime_type, title, description)
+      returns (transcript_text, audio_path, mime_type, title, description)
 
     Tries transcript first, falls back to audio download if not available.
+    The audio, if any, is left on disk; the caller must remove audio_path.
     """
     video_id = extract_video_id(url)
     if not video_id:
@@ -348,9 +346,9 @@ def get_youtube_transcript(url: str, max_audio_mb: int = DEFAULT_MAX_AUDIO_MB) -
     # Transcript not available → download audio
     print("Transcript not available — attempting audio download...")
     try:
-        audio_data, mime = download_audio(url, max_audio_mb=max_audio_mb, headers=HTTP_HEADERS)
-        if audio_data and len(audio_data) > 0:
-            return None, audio_data, mime, title, description
+        audio_path, mime = download_audio_file(url, max_audio_mb=max_audio_mb, headers=HTTP_HEADERS)
+        if audio_path:
+            return None, audio_path, mime, title, description
     except Exception as e:
         print(f"Audio download error: {e}")
 
@@ -363,3 +361,4 @@ def get_youtube_transcript(url: str, max_audio_mb: int = DEFAULT_MAX_AUDIO_MB) -
         "• Video is too long or unavailable\n"
         "Try a different video or a shorter one."
     )
+
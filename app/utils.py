@@ -1,3 +1,4 @@
+import hashlib
 from telebot import TeleBot
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 from typing import List
@@ -5,6 +6,17 @@ from datetime import datetime, timedelta, timezone
 from .config import get_config
 from .services.settings_service import SettingsService
 from .db import get_db
+from .services.state_store import StateStore
+from .services.rate_limiter import TokenBucket
+from .repositories.users import UsersRepository
+
+
+# Only positive verdicts are cached, so a user who just joined is never told to join again
+_subscription_cache = StateStore("sub", ttl=120)
+
+# Error alerts: one per signature per minute, and at most a burst of 5 then one every 10s overall
+_alert_seen = StateStore("alert", ttl=60)
+_alert_bucket = TokenBucket(rate=0.1, capacity=5)
 
 
 def is_admin(user_doc: dict) -> bool:
@@ -19,6 +31,9 @@ def is_subscribed(bot: TeleBot, user_id: int) -> bool:
     if not force:
         return True
     channels = ss.get_list_str("force_channels", default=get_config().force_channels)
+    cached = _subscription_cache.get(user_id)
+    if cached and cached.get("channels") == channels:
+        return True
     for channel in channels:
         try:
             status = bot.get_chat_member(channel, user_id).status
@@ -26,13 +41,21 @@ def is_subscribed(bot: TeleBot, user_id: int) -> bool:
                 return False
         except Exception:
             return False
+    _subscription_cache.set(user_id, {"channels": channels})
     return True
 
 
+def forget_subscription(user_id: int) -> None:
+    _subscription_cache.delete(user_id)
+
+
+_HOME_KEYBOARD = InlineKeyboardMarkup()
+_HOME_KEYBOARD.add(InlineKeyboardButton("🔙 Home", callback_data="home"))
+
+
 def home_keyboard() -> InlineKeyboardMarkup:
-    kb = InlineKeyboardMarkup()
-    kb.add(InlineKeyboardButton("🔙 Home", callback_data="home"))
-    return kb
+    # Static, so one shared instance; callers must not add rows to it
+    return _HOME_KEYBOARD
 
 def main_menu(user_id: int) -> InlineKeyboardMarkup:
     # Placeholder to avoid import error circular dependency
@@ -66,19 +89,51 @@ def format_dt_utc3(dt: datetime, fmt: str = "%Y-%m-%d %H:%M") -> str:
     return to_utc3(dt).strftime(fmt)
 
 
-def notify_admins(bot: TeleBot, message: str, db):
+def notify_admins(bot: TeleBot, message: str, db, dedupe_key: str | None = None, disable_notification: bool = False):
     """
-    Sends a message to all admins.
+    Sends a message to all admins, silently with `disable_notification`.
+    With `dedupe_key`, repeats within a minute and bursts beyond the alert budget are dropped.
     """
     if db is None:
         return
+    if dedupe_key is not None:
+        signature = hashlib.sha1(dedupe_key.encode()).hexdigest()
+        if signature in _alert_seen or not _alert_bucket.try_acquire():
+            return
+        _alert_seen.set(signature, {})
     
     try:
-        admins = db["users"].find({"role": "admin"})
-        for admin in admins:
+        for admin_id in UsersRepository(db).admin_ids():
             try:
-                bot.send_message(admin["id"], f"🚨 **Admin Notification**\n\n{message}", parse_mode="Markdown")
+                bot.send_message(
+                    admin_id,
+                    f"🚨 **Admin Notification**\n\n{message}",
+                    parse_mode="Markdown",
+                    disable_notification=disable_notification,
+                )
             except Exception:
                 pass
     except Exception:
-        pass
\ No newline at end of file
+        pass
+
+CHOICE_LETTERS = ("A", "B", "C", "D", "E", "F", "G", "H")
+# Telegram caps poll explanations at 200 characters
+EXPLANATION_LIMIT = 195
+
+
+def choice_label(i: int) -> str:
+    return CHOICE_LETTERS[i] if i < len(CHOICE_LETTERS) else str(i + 1)
+
+
+def format_question(idx: int, q: dict, html: bool = True) -> str:
+    """Render a question with its choices, answer and (trimmed) explanation as one text block."""
+    lines = [f"{idx}. {q['question']}"]
+    lines.extend(f"{choice_label(i)}. {c}" for i, c in enumerate(q["choices"]))
+    answer = q["answer_index"]
+    answer_label = "<b>Correct Answer</b>:" if html else "Correct Answer:"
+    lines.append("")
+    lines.append(f"{answer_label} {choice_label(answer)} - {q['choices'][answer]}")
+    explanation = q.get("explanation") or ""
+    if explanation:
+        lines.append(f"{'<b>Explanation:</b>' if html else 'Explanation:'} {explanation[:EXPLANATION_LIMIT]}")
+    return "\n".join(lines)
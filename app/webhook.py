@@ -0,0 +1,55 @@
+import hashlib
+from fastapi import Body, FastAPI, Header, HTTPException
+from telebot.types import Update
+
+from .bot import ALLOWED_UPDATES, bot, cfg, get_bot_info, scheduler
+from .logger import logger
+
+
+# Telegram echoes this back in X-Telegram-Bot-Api-Secret-Token; it is also the URL path segment
+WEBHOOK_SECRET = cfg.webhook_secret or hashlib.sha256(cfg.bot_token.encode()).hexdigest()[:32]
+
+app = FastAPI()
+
+
+@app.post("/webhook/{secret}")
+def receive_update(
+    secret: str,
+    update: dict = Body(...),
+    x_telegram_bot_api_secret_token: str | None = Header(default=None),
+):
+    # Sync endpoint on purpose: handler filters touch Mongo/Redis, so keep them off the event loop
+    if secret != WEBHOOK_SECRET or x_telegram_bot_api_secret_token != WEBHOOK_SECRET:
+        raise HTTPException(status_code=403)
+    # With threaded=True this only runs filters and queues the handlers, so Telegram gets its 200 quickly
+    bot.process_new_updates([Update.de_json(update)])
+    return {"ok": True}
+
+
+@app.get("/health")
+def health():
+    return {"ok": True}
+
+
+def run() -> None:
+    import uvicorn
+
+    get_bot_info()
+    # Runs in the supervising process only; uvicorn workers just import `app`
+    if scheduler is not None:
+        scheduler.start()
+    url = f"{cfg.webhook_url.rstrip('/')}/webhook/{WEBHOOK_SECRET}"
+    bot.set_webhook(
+        url=url,
+        secret_token=WEBHOOK_SECRET,
+        max_connections=100,
+        allowed_updates=ALLOWED_UPDATES,
+    )
+    logger.info(f"Webhook set to {cfg.webhook_url.rstrip('/')}/webhook/…")
+    # Additional workers re-import the app in their own processes
+    target = app if cfg.webhook_workers <= 1 else "app.webhook:app"
+    uvicorn.run(target, host="0.0.0.0", port=cfg.port, workers=cfg.webhook_workers)
+
+
+if __name__ == "__main__":
+    run()